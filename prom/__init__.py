@@ -10,6 +10,9 @@ from .config import DsnConnection, \
     JsonField, \
     Index
 from .query import Query, CacheQuery
+from .cache import identity_map
+from .session import session
+from .instrument import profile, detect_n_plus_one
 from . import decorators
 from .model import Orm
 from .interface import get_interface, \
@@ -17,7 +20,9 @@ from .interface import get_interface, \
     get_interfaces, \
     configure, \
     configure_environ
-from .exception import InterfaceError, Error, UniqueError
+from .exception import InterfaceError, Error, UniqueError, CancelError, \
+    TransactionError, \
+    NPlusOneError
 from . import utils
 
 
@@ -0,0 +1,592 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio support, every Query and Orm db method has an async counterpart
+
+    foo = await Foo.query.is_bar(1).aget_one()
+    async for foo in Foo.query.aall():
+        foo.bar = 2
+        await foo.asave()
+
+the async methods use an AsyncInterface, these wrap the Interface that was
+configured for the Orm's connection name so the SQL is compiled and the rows
+are turned into Orm instances by the same code as the sync methods, only the
+trip to the db is different
+
+This module needs python 3
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import asyncio
+import functools
+import logging
+import sys
+import weakref
+
+from . import decorators
+from .interface import get_interface as get_sync_interface
+from .session import hydrate
+from .instrument import take_stats
+from .compat import *
+
+
+logger = logging.getLogger(__name__)
+
+
+try:
+    from contextlib import asynccontextmanager
+
+except ImportError:
+    # python < 3.7
+    class AsyncGeneratorContextManager(object):
+        def __init__(self, gen):
+            self.gen = gen
+
+        async def __aenter__(self):
+            try:
+                return await self.gen.__anext__()
+            except StopAsyncIteration:
+                raise RuntimeError("generator didn't yield")
+
+        async def __aexit__(self, exc_type, exc, tb):
+            if exc_type is None:
+                try:
+                    await self.gen.__anext__()
+                except StopAsyncIteration:
+                    return False
+                raise RuntimeError("generator didn't stop")
+
+            if exc is None:
+                exc = exc_type()
+
+            try:
+                await self.gen.athrow(exc_type, exc, tb)
+
+            except StopAsyncIteration as e:
+                return e is not exc
+
+            except BaseException as e:
+                if e is exc:
+                    return False
+                raise
+
+            raise RuntimeError("generator didn't stop after athrow()")
+
+    def asynccontextmanager(func):
+        """backport of python 3.7's contextlib.asynccontextmanager"""
+        @functools.wraps(func)
+        def helper(*args, **kwargs):
+            return AsyncGeneratorContextManager(func(*args, **kwargs))
+        return helper
+
+
+def current_task():
+    """return the task that is running"""
+    get_task = getattr(asyncio, "current_task", None)
+    if get_task is None:
+        get_task = asyncio.Task.current_task # python < 3.7
+    return get_task()
+
+
+def get_interface(name=''):
+    """
+    return the AsyncInterface of the interface configured with name
+
+    name -- string -- the connection name, see interface.get_interface()
+    return -- AsyncInterface
+    """
+    return get_sync_interface(name).get_async_interface()
+
+
+class AsyncInterface(object):
+    """The async version of an interface.base.SQLInterface
+
+    the SQL comes from the sync interface (self.interface), and anything that
+    has to change the schema (eg, a missing table) is handed to the sync
+    interface to fix in run_sync(), everything else is awaited
+
+    each task keeps the connection it got until it has freed it as many times as
+    it got it, so everything in an async transaction uses the same connection
+    """
+    connected = False
+    """true if a connection has been established, false otherwise"""
+
+    def __init__(self, interface):
+        """
+        interface -- interface.base.Interface -- the configured sync interface
+        """
+        self.interface = interface
+        self.checkouts = weakref.WeakKeyDictionary()
+
+    @property
+    def connection_config(self):
+        return self.interface.connection_config
+
+    async def connect(self):
+        if self.connected: return self.connected
+
+        self.connected = True
+        try:
+            await self._connect(self.connection_config)
+
+        except Exception as e:
+            self.connected = False
+            self.raise_error(e)
+
+        self.log("Connected async {}", self.connection_config.interface_name)
+        return self.connected
+
+    async def _connect(self, connection_config): raise NotImplementedError()
+
+    async def close(self):
+        """close an open connection"""
+        if not self.connected: return True
+
+        await self._close()
+        self.connected = False
+        self.checkouts = weakref.WeakKeyDictionary()
+        self.log("Closed async Connection {}", self.connection_config.interface_name)
+        return True
+
+    async def _close(self): raise NotImplementedError()
+
+    async def get_connection(self, readonly=False):
+        if not self.connected: await self.connect()
+        task = current_task()
+        checkout = self.checkouts.get(task, None)
+        if checkout:
+            checkout[1] += 1
+            return checkout[0]
+
+        connection = await self._get_connection(readonly=readonly)
+        self.checkouts[task] = [connection, 1]
+        self.log("getting async connection {}", id(connection))
+        return connection
+
+    async def _get_connection(self, readonly=False): raise NotImplementedError()
+
+    async def free_connection(self, connection):
+        if not self.connected: return
+        task = current_task()
+        checkout = self.checkouts.get(task, None)
+        if checkout and checkout[0] is connection:
+            checkout[1] -= 1
+            if checkout[1] > 0: return
+            self.checkouts.pop(task, None)
+
+        self.log("freeing async connection {}", id(connection))
+        await self._free_connection(connection)
+
+    async def _free_connection(self, connection): raise NotImplementedError()
+
+    async def run_sync(self, callback, *args, **kwargs):
+        """run callback(*args, **kwargs) in a thread so it doesn't block the loop
+
+        return -- mixed -- whatever callback returns
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(callback, *args, **kwargs))
+
+    @asynccontextmanager
+    async def connection(self, connection=None, **kwargs):
+        if connection:
+            yield connection
+
+        else:
+            connection = await self.get_connection(readonly=kwargs.get("readonly", False))
+            try:
+                yield connection
+
+            finally:
+                await self.free_connection(connection)
+
+    @asynccontextmanager
+    async def transaction(self, connection=None, **kwargs):
+        """
+        the async version of Interface.transaction()
+
+        example --
+            async with ai.transaction():
+                await foo.asave()
+                await bar.asave()
+        """
+        async with self.connection(connection) as connection:
+            name = connection.transaction_name()
+            await connection.transaction_start(name)
+            try:
+                yield connection
+                await connection.transaction_stop()
+
+            except Exception as e:
+                await connection.transaction_fail(name)
+                self.raise_error(e)
+
+    async def query(self, query_str, *query_args, **query_options):
+        """run a raw query on the db, see Interface.query()"""
+        async with self.connection(**query_options) as connection:
+            query_options['connection'] = connection
+            try:
+                return await self._query(query_str, query_args, **query_options)
+
+            except Exception as e:
+                self.raise_error(e)
+
+    async def _query(self, query_str, query_args=None, **query_options):
+        raise NotImplementedError()
+
+    async def _run(self, callback, schema, *args, **kwargs):
+        """the async version of Interface._get_query(), every call that touches a
+        table goes through here so a missing table or column can be added and
+        callback ran again"""
+        async with self.connection(**kwargs) as connection:
+            kwargs['connection'] = connection
+            savepoint = self.savepoint(schema, **kwargs)
+            try:
+                if savepoint:
+                    async with self.transaction(connection):
+                        ret = await callback(schema, *args, **kwargs)
+
+                else:
+                    ret = await callback(schema, *args, **kwargs)
+
+            except Exception as e:
+                exc_info = sys.exc_info()
+                if not savepoint and connection.in_transaction() and not self.interface.statement_rollback:
+                    # the failure aborted the transaction so there is no fixing it
+                    self.interface.schema_cache.clear()
+                    self.raise_error(e, exc_info)
+
+                if await self.handle_error(schema, e, **kwargs):
+                    ret = await callback(schema, *args, **kwargs)
+                else:
+                    self.raise_error(e, exc_info)
+
+        return ret
+
+    def savepoint(self, schema, connection, readonly=False, **kwargs):
+        """return True if a call on schema needs a savepoint so it can fail without
+        aborting the transaction connection is in, see Interface.savepoint() and
+        Interface.read_savepoint()"""
+        if not connection.in_transaction() or self.interface.statement_rollback:
+            return False
+
+        # reads and writes only need one if the schema cache doesn't know the
+        # table is fine
+        return not self.interface.schema_cache.has_fields(schema)
+
+    async def handle_error(self, schema, e, **kwargs):
+        """return True if the schema problem that caused e was fixed"""
+        connection = kwargs.get('connection', None)
+        if not connection or connection.closed: return False
+        e = getattr(e, "e", e)
+        return await self._handle_error(schema, e, **kwargs)
+
+    async def _handle_error(self, schema, e, **kwargs): raise NotImplementedError()
+
+    async def insert(self, schema, fields, **kwargs):
+        """
+        the async version of Interface.insert()
+
+        return -- mixed -- the primary key of the row just inserted
+        """
+        return await self._run(self._insert, schema, fields, **kwargs)
+
+    async def _insert(self, schema, fields, **kwargs): raise NotImplementedError()
+
+    async def update(self, schema, fields, query, **kwargs):
+        """
+        the async version of Interface.update()
+
+        return -- int -- how many rows where updated
+        """
+        return await self._run(self._update, schema, fields, query, **kwargs)
+
+    async def _update(self, schema, fields, query, **kwargs):
+        query_str, query_args = self.interface._update_SQL(schema, fields, query)
+        return await self._query(query_str, query_args, count_result=True, **kwargs)
+
+    async def get_one(self, schema, query, **kwargs):
+        kwargs.setdefault("readonly", True)
+        ret = await self._run(self._get_one, schema, query, **kwargs)
+        if ret:
+            ret = self.interface.convert_row(schema, ret)
+        else:
+            ret = {}
+        return ret
+
+    async def _get_one(self, schema, query, **kwargs):
+        query_str, query_args = self.interface.get_SQL(schema, query, one_query=True)
+        return await self._query(query_str, query_args, fetchone=True, **kwargs)
+
+    async def get(self, schema, query, **kwargs):
+        kwargs.setdefault("readonly", True)
+        ret = await self._run(self._get, schema, query, **kwargs)
+        if ret:
+            ret = self.interface.convert_rows(schema, ret)
+        else:
+            ret = []
+        return ret
+
+    async def _get(self, schema, query, **kwargs):
+        query_str, query_args = self.interface.get_SQL(schema, query)
+        return await self._query(query_str, query_args, **kwargs)
+
+    async def count(self, schema, query, **kwargs):
+        kwargs.setdefault("readonly", True)
+        ret = await self._run(self._count, schema, query, **kwargs)
+        return int(ret)
+
+    async def _count(self, schema, query, **kwargs):
+        query_str, query_args = self.interface.get_SQL(schema, query, count_query=True)
+        ret = await self._query(query_str, query_args, **kwargs)
+        return int(ret[0]['ct']) if ret else 0
+
+    async def delete(self, schema, query, **kwargs):
+        if not query or not query.fields_where:
+            raise ValueError('aborting delete because there is no where clause')
+        return await self._run(self._delete, schema, query, **kwargs)
+
+    async def _delete(self, schema, query, **kwargs):
+        where_query_str, query_args = self.interface.get_SQL(schema, query, only_where_clause=True)
+        query_str = 'DELETE FROM {} {}'.format(
+            self.interface._normalize_table_name(schema),
+            where_query_str
+        )
+        return await self._query(query_str, query_args, count_result=True, **kwargs)
+
+    def log(self, format_str, *format_args, **log_options):
+        return self.interface.log(format_str, *format_args, **log_options)
+
+    def raise_error(self, e, exc_info=None):
+        return self.interface.raise_error(e, exc_info)
+
+
+class AsyncIterator(object):
+    """Returned from Query.aall(), it goes through every row of the query a chunk
+    at a time like query.AllIterator
+
+    example --
+        async for foo in Foo.query.is_bar(1).aall():
+            print(foo.pk)
+    """
+    def __init__(self, query, chunk_limit=5000):
+        limit, offset = query.bounds.get()
+        if not limit: limit = 0
+        if limit and limit < chunk_limit:
+            chunk_limit = limit
+
+        self.query = query.copy()
+        self.chunk_limit = chunk_limit
+        self.limit = limit
+        self.offset = offset
+        self.results = []
+        self.has_more = True # until the first chunk says otherwise
+        self._iter_count = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.limit and self._iter_count >= self.limit:
+            raise StopAsyncIteration()
+
+        if not self.results:
+            if not self.has_more:
+                raise StopAsyncIteration()
+
+            q = self.query.copy().offset(self.offset).limit(self.chunk_limit)
+            results = await q.aget()
+            self.results = list(results)
+            self.has_more = results.has_more
+            self.offset += self.chunk_limit
+            if not self.results:
+                raise StopAsyncIteration()
+
+        self._iter_count += 1
+        return self.results.pop(0)
+
+
+class AsyncQueryMixin(object):
+    """the async methods of query.Query, these return the same things as their
+    sync counterparts"""
+    @property
+    def async_interface(self):
+        return self.interface.get_async_interface()
+
+    async def _aquery(self, method_name, **kwargs):
+        if not self.can_get: return self.default_val
+        ai = self.async_interface
+        kwargs = self.query_options(**kwargs)
+        return await getattr(ai, method_name)(self.schema, self, **kwargs)
+
+    async def aget(self, limit=None, page=None):
+        """the async version of get()"""
+        from .query import ResultsIterator # avoid a circular import
+
+        has_more = False
+        self.bounds.paginate = True
+        limit_paginate, offset = self.bounds.get(limit, page)
+        self.default_val = []
+        take_stats()
+        results = await self._aquery('get')
+
+        if limit_paginate:
+            self.bounds.paginate = False
+            if len(results) == limit_paginate:
+                has_more = True
+                results.pop(-1)
+
+        it = ResultsIterator(results, orm_class=self.orm_class, has_more=has_more, query=self)
+        return self.iterator_class(it)
+
+    def aall(self):
+        """the async version of all(), this is iterated with async for
+
+        return -- AsyncIterator
+        """
+        return AsyncIterator(self)
+
+    async def aget_one(self):
+        """the async version of get_one()"""
+        self.default_val = None
+        o = self.default_val
+        d = await self._aquery('get_one')
+        if d:
+            o = hydrate(self.orm_class, d)
+        return o
+
+    async def aget_pk(self, field_val):
+        """the async version of get_pk()"""
+        return await self.is_field(self.schema.pk_name, field_val).aget_one()
+
+    async def acount(self):
+        """the async version of count()"""
+        fields_sort = self.fields_sort
+        self.fields_sort = self.fields_sort_class()
+
+        self.default_val = 0
+        ret = await self._aquery('count')
+
+        self.fields_sort = fields_sort
+        return ret
+
+    async def ahas(self):
+        """the async version of has()"""
+        v = await self.aget_one()
+        return True if v else False
+
+    async def ainsert(self):
+        """the async version of insert()"""
+        self.default_val = 0
+        ret = await self.async_interface.insert(self.schema, self.fields, **self.query_options())
+        self._awritten("insert", ret)
+        return ret
+
+    async def aupdate(self):
+        """the async version of update()"""
+        self.default_val = 0
+        ret = await self.async_interface.update(
+            self.schema,
+            self.fields,
+            self,
+            **self.query_options()
+        )
+        self._awritten("update", ret)
+        return ret
+
+    async def adelete(self):
+        """the async version of delete()"""
+        self.default_val = None
+        ret = await self._aquery('delete')
+        self._awritten("delete", ret)
+        return ret
+
+    def _awritten(self, method_name, ret):
+        """an async write finished, the identity maps and the query cache (see
+        query.BaseCacheQuery) can't be trusted anymore"""
+        if method_name != "insert":
+            self._invalidate_identity_maps()
+
+        cache_written = getattr(self, "cache_written", None)
+        if ret and cache_written:
+            cache_written(method_name)
+
+
+class AsyncOrmMixin(object):
+    """the async methods of model.Orm, these work like their sync counterparts"""
+    @decorators.classproperty
+    def async_interface(cls):
+        """return the AsyncInterface of cls.interface"""
+        return cls.interface.get_async_interface()
+
+    @classmethod
+    async def acreate(cls, fields=None, **fields_kwargs):
+        """the async version of create()"""
+        instance = cls(fields, **fields_kwargs)
+        await instance.asave()
+        return instance
+
+    async def ainsert(self):
+        """the async version of insert()"""
+        ret = True
+        schema = self.schema
+        fields = self.depopulate(False)
+
+        q = self.query
+        q.set_fields(fields)
+        pk = await q.ainsert()
+        if pk:
+            fields = q.fields
+            fields[schema.pk_name] = pk
+            self._populate(fields)
+
+        else:
+            ret = False
+
+        return ret
+
+    async def aupdate(self):
+        """the async version of update()"""
+        ret = True
+        fields = self.depopulate(True)
+        q = self.query
+        q.set_fields(fields)
+
+        pk = self.pk
+        if pk:
+            q.is_field(self.schema.pk_name, pk)
+
+        else:
+            raise ValueError("You cannot update without a primary key")
+
+        if await q.aupdate():
+            fields = q.fields
+            self._populate(fields)
+
+        else:
+            ret = False
+
+        return ret
+
+    async def asave(self):
+        """the async version of save()"""
+        pk = None
+        if self.schema.pk_name not in self.modified_fields:
+            pk = self.pk
+
+        if pk:
+            ret = await self.aupdate()
+        else:
+            ret = await self.ainsert()
+
+        return ret
+
+    async def adelete(self):
+        """the async version of delete()"""
+        ret = False
+        pk = self.pk
+        if pk:
+            pk_name = self.schema.pk_name
+            await self.query.is_field(pk_name, pk).adelete()
+            self.deleted()
+            ret = True
+
+        return ret
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Queue up writes and send them to the db together
+
+    with interface.batch():
+        pk = interface.insert(schema, {"foo": 1}) # returns a BatchResult
+        Foo.create(bar=2) # the orm's pk is set when the batch is flushed
+
+    pk.result() # the primary key of the row
+
+Everything in a batch is written in one transaction when the with block ends, and
+consecutive writes with the same SQL are sent to the db together (see
+Interface.flush_batch()), reads aren't queued so they don't see the queued writes
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import logging
+
+from .compat import *
+
+
+logger = logging.getLogger(__name__)
+
+
+class BatchResult(object):
+    """The deferred result of a write that was queued in a Batch, it gets its
+    value when the batch is flushed"""
+    def __init__(self):
+        self.finished = False
+        self.value = None
+        self.error = None
+        self.callbacks = []
+
+    def done(self):
+        """return True if the batch this write was in has been flushed"""
+        return self.finished
+
+    def result(self):
+        """return the value the write returned (eg, the primary key for an insert),
+        an update's value is how many rows it changed, or None if the db couldn't
+        say, so treat it as success rather than a count
+
+        :returns: mixed
+        """
+        if not self.finished:
+            raise ValueError("the batch has not been flushed yet")
+
+        if self.error is not None:
+            raise self.error
+
+        return self.value
+
+    def on_result(self, callback):
+        """call callback(value) once the write has made it to the db, if the batch
+        fails callback will never be called
+
+        :param callback: callable
+        """
+        if self.finished:
+            if self.error is None:
+                callback(self.value)
+
+        else:
+            self.callbacks.append(callback)
+
+    def set_result(self, value):
+        self.value = value
+        self.finished = True
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(value)
+
+    def set_error(self, e):
+        self.error = e
+        self.finished = True
+        self.callbacks = []
+
+
+class BatchStatement(object):
+    """A queued write, statements with the same query_str and options can be sent
+    together"""
+    option_names = ("timeout", "settings")
+    """the query options (see Query.query_options()) that are kept with the write
+    and used when it is flushed"""
+
+    def __init__(self, method_name, schema, fields, query, query_str, query_args, options=None):
+        """
+        :param method_name: str, insert, update or delete
+        :param schema: Schema
+        :param fields: dict, the values being written
+        :param query: Query, the where of an update or delete, None for an insert
+        :param query_str: str, the SQL of the write
+        :param query_args: list, the values of the placeholders in query_str
+        :param options: dict, the query options of the write (eg, timeout)
+        """
+        self.method_name = method_name
+        self.schema = schema
+        self.fields = fields
+        self.query = query
+        self.query_str = query_str
+        self.query_args = query_args
+        self.options = options or {}
+        self.result = BatchResult()
+
+    def can_send_with(self, statement):
+        """return True if this statement can be sent to the db together with
+        statement"""
+        return self.query_str == statement.query_str and self.options == statement.options
+
+
+class Batch(object):
+    """Holds the writes an Interface queued while Interface.batch() is active, a
+    batch belongs to the thread that started it"""
+    def __init__(self, interface, **kwargs):
+        """
+        :param interface: Interface
+        :param **kwargs: passed to Interface.flush_batch()
+        """
+        self.interface = interface
+        self.kwargs = kwargs
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def add(self, method_name, schema, fields, query=None, **kwargs):
+        """queue a write
+
+        :param **kwargs: the query options of the write, the ones in
+            BatchStatement.option_names are used when the write is flushed
+        :returns: BatchResult, it will have the value of the write after flush()
+        """
+        options = {k: kwargs[k] for k in BatchStatement.option_names if kwargs.get(k)}
+        statement = self.interface.batch_statement(method_name, schema, fields, query, options)
+        self.statements.append(statement)
+        return statement.result
+
+    def flush(self):
+        """send all the queued writes to the db"""
+        statements, self.statements = self.statements, []
+        if not statements: return
+
+        logger.debug("Flushing batch of {} statements".format(len(statements)))
+        try:
+            values = self.interface.flush_batch(statements, **self.kwargs)
+
+        except Exception as e:
+            for statement in statements:
+                statement.result.set_error(e)
+            raise
+
+        for statement, value in zip(statements, values):
+            statement.result.set_result(value)
+
+    def discard(self):
+        """throw away all the queued writes"""
+        statements, self.statements = self.statements, []
+        for statement in statements:
+            statement.result.set_error(ValueError("the batch was discarded"))
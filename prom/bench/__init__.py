@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of prom's hot paths
+
+    python -m prom bench
+    python -m prom bench --dsn "prom.interface.postgres.PostgreSQL://user:pw@host/db" --out-file=run.json
+    python -m prom bench --compare=run.json
+
+Every scenario (see scenarios.py) runs against its own tables with the same
+rows every time (the data and the random choices come from a seeded
+random.Random) so runs can be compared. By default it runs against a SQLite
+db in a temp directory.
+
+Each scenario is called once to warm up, then iterations times with each call
+timed on its own, then once more while tracemalloc (python 3 only) watches the
+memory it allocates. A call does ops operations (eg, hydrating 1000 rows is
+1000 ops) and only the whole call is timed, so the call_p50/call_p95/call_p99
+percentiles are of the mean time of an operation in each call, they are only
+the latencies of single operations for the scenarios that do one op per call.
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import os
+import random
+import platform
+import tempfile
+import shutil
+import datetime
+import logging
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from ..compat import *
+from ..config import DsnConnection
+from ..interface import set_interface, get_interfaces
+from ..instrument import timer, percentile
+from .. import __version__
+
+
+logger = logging.getLogger(__name__)
+
+
+class Result(object):
+    """The measurements of one scenario"""
+    def __init__(self, name, ops, timings, peak_memory=None):
+        """
+        :param name: str, the scenario's name
+        :param ops: int, how many operations each call did
+        :param timings: list, the seconds each call took
+        :param peak_memory: int, the most bytes allocated during a call, None if
+            it couldn't be measured
+        """
+        self.name = name
+        self.ops = ops
+        self.timings = timings
+        self.peak_memory = peak_memory
+
+    @property
+    def ops_per_sec(self):
+        total = sum(self.timings)
+        return (self.ops * len(self.timings)) / total if total else 0.0
+
+    @property
+    def latencies(self):
+        """the sorted mean seconds of an operation in each call, these are per
+        call means and not the latencies of single operations unless ops is 1"""
+        return sorted(t / self.ops for t in self.timings)
+
+    @property
+    def mean(self):
+        return sum(self.timings) / (self.ops * len(self.timings))
+
+    def jsonable(self):
+        latencies = self.latencies
+        return {
+            "name": self.name,
+            "ops": self.ops,
+            "iterations": len(self.timings),
+            "ops_per_sec": self.ops_per_sec,
+            "mean": self.mean,
+            "call_p50": percentile(latencies, 50),
+            "call_p95": percentile(latencies, 95),
+            "call_p99": percentile(latencies, 99),
+            "peak_memory": self.peak_memory,
+        }
+
+
+class Benchmark(object):
+    """Runs scenarios against an interface and keeps their results
+
+    the scenarios use the interface through the connection_name connection so
+    the interfaces the process already has configured aren't touched
+    """
+    connection_name = "prom_bench"
+
+    def __init__(self, dsn="", rows=100000, seed=1, processes=2):
+        """
+        :param dsn: str, the db to run against, a SQLite db in a temp directory
+            if empty
+        :param rows: int, how many rows the read scenarios work with
+        :param seed: int, the seed of the random data and choices
+        :param processes: int, how many processes the reduce scenario uses
+        """
+        self.directory = ""
+        if not dsn:
+            self.directory = tempfile.mkdtemp(prefix="prom-bench-")
+            dsn = "prom.interface.sqlite.SQLite://{}".format(
+                os.path.join(self.directory, "bench.db")
+            )
+
+        self.dsn = dsn
+        self.rows = int(rows)
+        self.seed = seed
+        self.processes = processes
+        self.results = []
+
+    def __enter__(self):
+        self.setup()
+        return self
+
+    def __exit__(self, *args):
+        self.teardown()
+
+    def setup(self):
+        from .scenarios import create_orm_classes
+
+        self.interface = DsnConnection(self.dsn).interface
+        set_interface(self.interface, self.connection_name)
+        self.random = random.Random(self.seed)
+        self.orm_class, self.write_orm_class = create_orm_classes(self.connection_name)
+        self.interface.delete_table(self.orm_class.schema)
+        self.interface.delete_table(self.write_orm_class.schema)
+        self.orm_class.install()
+        self.write_orm_class.install()
+
+        with self.interface.batch():
+            for row in self.create_rows(self.rows):
+                self.orm_class.create(row)
+        self.pks = list(self.orm_class.query.asc_pk().pks())
+
+    def teardown(self):
+        interface = get_interfaces().pop(self.connection_name, None)
+        if interface:
+            interface.delete_table(self.orm_class.schema)
+            interface.delete_table(self.write_orm_class.schema)
+            interface.close()
+
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def create_rows(self, count):
+        """return count rows of fields, the same count always makes the same rows"""
+        r = random.Random(self.seed)
+        start = datetime.datetime(2020, 1, 1)
+        for i in range(count):
+            yield {
+                "foo": i,
+                "bar": "bar {} {}".format(i, r.randint(0, 1000000)),
+                "che": start + datetime.timedelta(seconds=i),
+                "baz": r.random() > 0.5,
+            }
+
+    def get_scenarios(self, names=None):
+        """return the scenarios to run, in the order they run
+
+        :param names: list, only return the scenarios with these names
+        """
+        from .scenarios import scenario_classes
+        ret = []
+        seen = set()
+        for scenario_class in scenario_classes:
+            scenario = scenario_class(self)
+            # with only a few rows the get scenarios can be the same
+            if scenario.name in seen: continue
+            seen.add(scenario.name)
+
+            if not names or scenario.name in names:
+                ret.append(scenario)
+        return ret
+
+    def run(self, names=None):
+        """run the scenarios
+
+        :param names: list, only run the scenarios with these names
+        :returns: list, the Result of each scenario
+        """
+        for scenario in self.get_scenarios(names):
+            logger.info("Running {}".format(scenario.name))
+            self.results.append(self.measure(scenario))
+        return self.results
+
+    def measure(self, scenario):
+        """run scenario and return its Result"""
+        scenario.setup()
+        try:
+            scenario.run()
+
+            timings = []
+            for _ in range(scenario.iterations):
+                start = timer()
+                scenario.run()
+                timings.append(timer() - start)
+
+            peak_memory = None
+            if tracemalloc:
+                tracemalloc.start()
+                try:
+                    scenario.run()
+                    _, peak_memory = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+
+        finally:
+            scenario.teardown()
+
+        return Result(scenario.name, scenario.ops, timings, peak_memory)
+
+    def get_result(self, name):
+        for result in self.results:
+            if result.name == name:
+                return result
+
+    def summary(self):
+        """return the ratios between scenarios
+
+        orm_overhead -- how many times longer it takes to get the rows as Orm
+            instances than it takes the driver to fetch the same rows
+        """
+        ret = {}
+        orm = self.get_result("get_{}".format(self.rows))
+        raw = self.get_result("raw_get_{}".format(self.rows))
+        if orm and raw:
+            ret["orm_overhead"] = orm.mean / raw.mean
+        return ret
+
+    def jsonable(self):
+        return {
+            "environment": {
+                "prom": __version__,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "interface": self.interface.connection_config.interface_name,
+                "rows": self.rows,
+                "seed": self.seed,
+            },
+            "results": [result.jsonable() for result in self.results],
+            "summary": self.summary(),
+        }
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+The scenarios a Benchmark runs, scenario_classes holds them in the order they run
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import datetime
+
+from ..compat import *
+from ..model import Orm
+from ..config import Field
+from ..query import CacheQuery, hydrate
+
+
+def create_orm_classes(connection_name):
+    """return the Orm classes the scenarios use
+
+    :param connection_name: str, the name of the interface the classes use
+    :returns: tuple, (read orm class, write orm class), the read class's table
+        has the benchmark's rows, the write class's table is for the scenarios
+        that insert
+    """
+    class BenchOrm(Orm):
+        table_name = "prom_bench"
+        foo = Field(int, True)
+        bar = Field(str, True)
+        che = Field(datetime.datetime)
+        baz = Field(bool)
+
+    class BenchWriteOrm(BenchOrm):
+        table_name = "prom_bench_write"
+
+    BenchOrm.connection_name = connection_name
+    BenchWriteOrm.connection_name = connection_name
+    return BenchOrm, BenchWriteOrm
+
+
+class Scenario(object):
+    """One thing to measure, a child needs a name and a run() that does ops
+    operations each time it is called"""
+    name = ""
+
+    iterations = 10
+    """how many times run() is called and timed"""
+
+    ops = 1
+    """how many operations each run() does"""
+
+    def __init__(self, bench):
+        """
+        :param bench: Benchmark
+        """
+        self.bench = bench
+        self.orm_class = bench.orm_class
+        self.interface = bench.interface
+
+    def setup(self): pass
+
+    def run(self): raise NotImplementedError()
+
+    def teardown(self): pass
+
+
+class InsertScenario(Scenario):
+    name = "insert"
+    iterations = 200
+
+    def setup(self):
+        self.rows = self.bench.create_rows(self.iterations + 2)
+
+    def run(self):
+        self.bench.write_orm_class.create(next(self.rows))
+
+
+class BulkInsertScenario(Scenario):
+    name = "bulk_insert"
+    iterations = 20
+    ops = 1000
+
+    def run(self):
+        orm_class = self.bench.write_orm_class
+        with self.interface.batch():
+            for row in self.bench.create_rows(self.ops):
+                orm_class.create(row)
+
+
+class GetPkScenario(Scenario):
+    name = "get_pk"
+    iterations = 500
+
+    def run(self):
+        self.orm_class.query.get_pk(self.bench.random.choice(self.bench.pks))
+
+
+class GetScenario(Scenario):
+    """get() the rows and create an Orm for each one"""
+    iterations = 20
+
+    def __init__(self, bench, limit):
+        super(GetScenario, self).__init__(bench)
+        self.ops = min(limit, bench.rows)
+        self.name = "get_{}".format(self.ops)
+
+    def run(self):
+        list(self.orm_class.query.asc_pk().limit(self.ops).get())
+
+
+class RawGetScenario(GetScenario):
+    """fetch the same rows as GetScenario using the driver's cursor, this is what
+    the orm overhead is measured against"""
+    def __init__(self, bench, limit):
+        super(RawGetScenario, self).__init__(bench, limit)
+        self.name = "raw_{}".format(self.name)
+
+    def setup(self):
+        query = self.orm_class.query.asc_pk().limit(self.ops)
+        self.query_str, self.query_args = self.interface.get_SQL(self.orm_class.schema, query)
+
+    def run(self):
+        with self.interface.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(self.query_str, self.query_args)
+            cursor.fetchall()
+
+
+class AllScenario(Scenario):
+    """scan the whole table with all()"""
+    name = "all"
+    iterations = 10
+
+    def setup(self):
+        self.ops = self.bench.rows
+
+    def run(self):
+        for o in self.orm_class.query.all():
+            pass
+
+
+class ValuesScenario(Scenario):
+    name = "values"
+    iterations = 20
+
+    def setup(self):
+        self.ops = self.bench.rows
+
+    def run(self):
+        list(self.orm_class.query.select_foo().select_bar().values())
+
+
+class PksScenario(ValuesScenario):
+    name = "pks"
+
+    def run(self):
+        list(self.orm_class.query.pks())
+
+
+class CountScenario(Scenario):
+    name = "count"
+    iterations = 200
+
+    def run(self):
+        self.orm_class.query.gte_foo(self.bench.rows // 2).count()
+
+
+class CacheHitScenario(Scenario):
+    """get_pk() of a row that is in the CacheQuery cache"""
+    name = "cache_hit"
+    iterations = 500
+
+    def setup(self):
+        self.pk = self.bench.pks[0]
+        self.cache = CacheQuery.cache()
+        self.cache.__enter__()
+        self.query().get_pk(self.pk)
+
+    def query(self):
+        return CacheQuery(self.orm_class)
+
+    def run(self):
+        q = self.query()
+        q.get_pk(self.pk)
+        if not q.cache_hit:
+            raise RuntimeError("{} was not a cache hit".format(self.pk))
+
+    def teardown(self):
+        self.cache.__exit__(None, None, None)
+
+
+class ReduceScenario(Scenario):
+    name = "reduce"
+    iterations = 10
+
+    def setup(self):
+        self.ops = self.bench.rows
+        self.count = 0
+
+    def target_map(self, o):
+        return o.foo
+
+    def target_reduce(self, foo):
+        self.count += 1
+
+    def run(self):
+        self.orm_class.query.reduce(
+            self.target_map,
+            self.target_reduce,
+            threads=self.bench.processes
+        )
+
+
+class HydrateScenario(Scenario):
+    """create an Orm from each row without touching the db"""
+    name = "hydrate"
+    iterations = 30
+
+    def setup(self):
+        self.rows = self.interface.get(
+            self.orm_class.schema,
+            self.orm_class.query.limit(min(10000, self.bench.rows)),
+        )
+        self.ops = len(self.rows)
+
+    def run(self):
+        orm_class = self.orm_class
+        for d in self.rows:
+            hydrate(orm_class, dict(d))
+
+
+class NewOrmScenario(Scenario):
+    """create an Orm from fields like a new instance would be, without touching
+    the db"""
+    name = "new_orm"
+    iterations = 30
+
+    def setup(self):
+        self.rows = list(self.bench.create_rows(min(10000, self.bench.rows)))
+        self.ops = len(self.rows)
+
+    def run(self):
+        orm_class = self.orm_class
+        for fields in self.rows:
+            orm_class(fields)
+
+
+class DepopulateScenario(Scenario):
+    """get the fields of new instances that would be inserted"""
+    name = "depopulate"
+    iterations = 30
+
+    def setup(self):
+        rows = self.bench.create_rows(min(10000, self.bench.rows))
+        self.orms = [self.orm_class(fields) for fields in rows]
+        self.ops = len(self.orms)
+
+    def run(self):
+        for o in self.orms:
+            o.depopulate(False)
+
+
+class JsonableScenario(Scenario):
+    name = "jsonable"
+    iterations = 30
+
+    def setup(self):
+        self.orms = list(self.orm_class.query.limit(min(10000, self.bench.rows)).get())
+        self.ops = len(self.orms)
+
+    def run(self):
+        for o in self.orms:
+            o.jsonable()
+
+
+scenario_classes = [
+    InsertScenario,
+    BulkInsertScenario,
+    GetPkScenario,
+    lambda bench: GetScenario(bench, 1000),
+    lambda bench: GetScenario(bench, bench.rows),
+    lambda bench: RawGetScenario(bench, bench.rows),
+    AllScenario,
+    ValuesScenario,
+    PksScenario,
+    CountScenario,
+    CacheHitScenario,
+    ReduceScenario,
+    HydrateScenario,
+    NewOrmScenario,
+    DepopulateScenario,
+    JsonableScenario,
+]
+"""the scenarios in the order they run, each is called with the Benchmark"""
@@ -0,0 +1,992 @@
+# -*- coding: utf-8 -*-
+"""
+The storage that backs query.CacheQuery
+
+The cached values are shared by every thread of the process and bounded by both
+a number of entries and an (approximate) amount of memory, when either bound is
+reached the least recently used entries are dropped.
+
+Writes don't clear anything, instead they bump a per table generation counter,
+every cached entry remembers the generation it was created under, so once the
+generation moves on the old entries are never returned again and will eventually
+fall out of the cache
+
+A CacheNamespace can also be given a CacheBackend that lives outside the process
+(eg, SQLiteCacheBackend), then the in process cache acts as a first level in front
+of the backend and the table generations are kept in the backend so a write in
+one process will invalidate the cached values of every process, each process only
+re-reads a table's generation from the backend every CacheNamespace.generation_ttl
+seconds so another process's write can take that long to be seen
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import os
+import sys
+import threading
+import logging
+import time
+import sqlite3
+from collections import OrderedDict
+from contextlib import contextmanager
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .compat import *
+from .utils import make_key
+
+
+logger = logging.getLogger(__name__)
+
+
+def sizeof(val, depth=3):
+    """return the approximate size in bytes of val
+
+    this is not meant to be exact, it is meant to be cheap, it will walk into
+    containers (eg, a list of row dicts) up to depth levels
+
+    :param val: mixed, usually the result of a query
+    :param depth: int, how many levels of containers to descend into
+    :returns: int, the bytes val is (roughly) using
+    """
+    size = sys.getsizeof(val, 0)
+    if depth > 0:
+        if isinstance(val, (list, tuple, set, frozenset)):
+            for v in val:
+                size += sizeof(v, depth - 1)
+
+        elif hasattr(val, "keys") and not isinstance(val, basestring):
+            for k in val.keys():
+                size += sizeof(k, depth - 1) + sizeof(val[k], depth - 1)
+
+    return size
+
+
+def plain(val):
+    """convert val into builtin types so it can be serialized
+
+    db rows (eg, sqlite3.Row) can't always be pickled, so they are turned into dicts
+
+    :param val: mixed, usually the result of a query
+    :returns: mixed, val using builtin types
+    """
+    if isinstance(val, list):
+        val = [plain(v) for v in val]
+
+    elif isinstance(val, tuple):
+        val = tuple(plain(v) for v in val)
+
+    elif hasattr(val, "keys") and not isinstance(val, basestring):
+        val = {k: plain(val[k]) for k in val.keys()}
+
+    return val
+
+
+class LRUCache(object):
+    """A thread safe least recently used mapping that is bounded by count and bytes
+
+    every value is stored with its size, so the total bytes held can be tracked
+    without having to walk all the values again
+    """
+    def __init__(self, max_entries=0, max_bytes=0, callback=None):
+        """
+        :param max_entries: int, 0 means unbounded, otherwise how many values to hold
+        :param max_bytes: int, 0 means unbounded, otherwise the approximate size
+            all the held values can reach
+        :param callback: callable, callback(event, key, size) will be called
+            whenever a value is added ("set") or removed ("delete" or "evict")
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.callback = callback
+        self.lock = threading.RLock()
+        self.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.bytes = 0
+
+    def get(self, key):
+        """return the value found at key
+
+        :param key: hashable
+        :returns: tuple, (val, hit) where hit is True if key was found
+        """
+        with self.lock:
+            try:
+                size, val = self.entries.pop(key)
+
+            except KeyError:
+                return None, False
+
+            else:
+                # re-adding moves key to the most recently used end
+                self.entries[key] = (size, val)
+                return val, True
+
+    def set(self, key, val, size=None):
+        """set val into key, this might cause the least used values to be dropped
+
+        :param key: hashable
+        :param val: mixed
+        :param size: int, the size of val, if None it will be figured out with sizeof()
+        :returns: bool, True if val was added
+        """
+        if size is None:
+            size = sizeof(val)
+
+        with self.lock:
+            self.delete(key)
+
+            if self.max_bytes and size > self.max_bytes:
+                # this value could never fit so there is no reason to make
+                # everything else leave to try
+                return False
+
+            self.entries[key] = (size, val)
+            self.bytes += size
+            if self.callback:
+                self.callback("set", key, size)
+            self.evict()
+
+        return True
+
+    def delete(self, key):
+        """remove key if it exists
+
+        :returns: bool, True if key was found
+        """
+        with self.lock:
+            try:
+                size, val = self.entries.pop(key)
+
+            except KeyError:
+                return False
+
+            else:
+                self.bytes -= size
+                if self.callback:
+                    self.callback("delete", key, size)
+                return True
+
+    def evict(self):
+        """drop the least used values until the cache is within its bounds
+
+        :returns: int, how many values were dropped
+        """
+        count = 0
+        with self.lock:
+            while self.entries and self.full():
+                key, (size, val) = self.entries.popitem(last=False)
+                self.bytes -= size
+                count += 1
+                if self.callback:
+                    self.callback("evict", key, size)
+
+        return count
+
+    def full(self):
+        """Return True if the cache is over either of its bounds"""
+        if self.max_entries and len(self.entries) > self.max_entries:
+            return True
+        if self.max_bytes and self.bytes > self.max_bytes:
+            return True
+        return False
+
+
+class LocalProperty(object):
+    """A property whose value is specific to the current thread
+
+    the owning instance needs a `local` attribute that is a threading.local()
+    """
+    def __init__(self, name, default, cast=None, doc=None):
+        self.name = name
+        self.default = default
+        self.cast = cast
+        self.__doc__ = doc
+
+    def __get__(self, instance, owner):
+        if instance is None: return self
+        return getattr(instance.local, self.name, self.default)
+
+    def __set__(self, instance, v):
+        setattr(instance.local, self.name, self.cast(v) if self.cast else v)
+
+    def __delete__(self, instance):
+        instance.local.__dict__.pop(self.name, None)
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls for the same key so only one of them actually runs
+
+    this is used to stop a stampede of threads all running the same query at the
+    same time when a cached value is missing or expired
+    """
+    class Call(object):
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.exc_info = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def busy(self, key):
+        """return True if a call for key is currently running"""
+        return key in self.calls
+
+    def do(self, key, callback, *args, **kwargs):
+        """run callback unless another thread is already running it for key, in
+        which case wait for that thread to finish and use its result
+
+        :param key: hashable
+        :param callback: callable, called with *args, **kwargs
+        :returns: tuple, (result, shared) where shared is True if another thread
+            ran callback, the result is the same object every caller received so
+            it shouldn't be modified
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.Call()
+                self.calls[key] = call
+
+        if leader:
+            try:
+                call.result = callback(*args, **kwargs)
+
+            except Exception:
+                call.exc_info = sys.exc_info()
+                raise
+
+            finally:
+                with self.lock:
+                    self.calls.pop(key, None)
+                call.event.set()
+
+        else:
+            call.event.wait()
+            if call.exc_info:
+                reraise(*call.exc_info)
+
+        return call.result, not leader
+
+
+class SchemaCache(object):
+    """The tables and columns an Interface knows are in the db
+
+    it is loaded with one catalog query (see Interface.load_schema_cache()) and
+    then kept up to date as the interface changes the schema, so checking if a
+    table has all the fields of a Schema doesn't go to the db. Changes made by
+    other processes are only seen the next time it is loaded
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """forget everything, the next lookup will load it again"""
+        self.tables = None
+
+    def loaded(self):
+        return self.tables is not None
+
+    def set_tables(self, tables):
+        """
+        :param tables: dict, table name keys with an iterable of column names values
+        """
+        tables = {k: set(v) for k, v in tables.items()}
+        with self.lock:
+            self.tables = tables
+
+    def get_fields(self, table_name):
+        """return the column names of table_name, None if the table isn't in the db
+
+        :returns: set
+        """
+        fields = (self.tables or {}).get(str(table_name), None)
+        return None if fields is None else set(fields)
+
+    def has_table(self, table_name):
+        return str(table_name) in (self.tables or {})
+
+    def has_fields(self, schema):
+        """return True if the table of schema has every field of schema"""
+        fields = (self.tables or {}).get(str(schema), None)
+        return fields is not None and all(field_name in fields for field_name in schema.fields)
+
+    def add_fields(self, table_name, field_names):
+        """the table now has field_names, nothing happens if nothing is loaded
+        since the next load will pick them up"""
+        with self.lock:
+            if self.tables is not None:
+                self.tables.setdefault(str(table_name), set()).update(field_names)
+
+    def discard(self, table_name):
+        """the table is no longer in the db"""
+        with self.lock:
+            if self.tables is not None:
+                self.tables.pop(str(table_name), None)
+
+
+class CacheStats(object):
+    """Counts what a CacheNamespace is doing for each table and each query shape
+
+    example --
+        stats = CacheQuery.cache_namespace.stats
+        snapshot = stats.snapshot()
+        snapshot["tables"]["foo_table"]["hits"]
+
+        # send a snapshot to the logs every minute
+        stats.hook(lambda snapshot: logger.info(snapshot), interval=60)
+    """
+    table_counters = ("hits", "misses", "stale", "invalidations", "evictions", "entries", "bytes")
+    """the counters kept for each table"""
+
+    shape_counters = ("hits", "misses", "stale")
+    """the counters kept for each query shape (see Query.shape())"""
+
+    def __init__(self, track_shapes=True):
+        """
+        :param track_shapes: bool, False to only count by table
+        """
+        self.track_shapes = track_shapes
+        self.lock = threading.Lock()
+        self.hooks = []
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.tables = {}
+            self.shapes = {}
+            self.start = time.time()
+
+    def counters(self, counters, key, names):
+        """return the counters dict at key, this should be called while holding
+        the lock"""
+        ret = counters.get(key)
+        if ret is None:
+            ret = dict.fromkeys(names, 0)
+            counters[key] = ret
+        return ret
+
+    def incr(self, table_name, name, shape=None):
+        """increment the name counter of the table (and shape)"""
+        with self.lock:
+            self.counters(self.tables, table_name, self.table_counters)[name] += 1
+            if shape is not None and self.track_shapes:
+                self.counters(self.shapes, shape, self.shape_counters)[name] += 1
+
+        if self.hooks:
+            self.run_hooks()
+
+    def store_callback(self, event, key, size):
+        """passed to LRUCache so the entries, bytes, and evictions of each table
+        can be counted, key is (table_name, key)"""
+        with self.lock:
+            counters = self.counters(self.tables, key[0], self.table_counters)
+            if event == "set":
+                counters["entries"] += 1
+                counters["bytes"] += size
+
+            else:
+                counters["entries"] -= 1
+                counters["bytes"] -= size
+                if event == "evict":
+                    counters["evictions"] += 1
+
+    def snapshot(self):
+        """return a copy of all the counters
+
+        :returns: dict, with keys "timestamp", "seconds" (how long the counters
+            have been counting), "tables", and "shapes"
+        """
+        with self.lock:
+            now = time.time()
+            return {
+                "timestamp": now,
+                "seconds": now - self.start,
+                "tables": {k: dict(v) for k, v in self.tables.items()},
+                "shapes": {k: dict(v) for k, v in self.shapes.items()},
+            }
+
+    def hook(self, callback, interval=60):
+        """callback(snapshot) will be called every interval seconds
+
+        the hooks are checked when the counters change, so nothing will be called
+        while the cache isn't being used
+        """
+        with self.lock:
+            self.hooks.append([callback, interval, time.time() + interval])
+
+    def run_hooks(self):
+        callbacks = []
+        now = time.time()
+        with self.lock:
+            for h in self.hooks:
+                if now >= h[2]:
+                    h[2] = now + h[1]
+                    callbacks.append(h[0])
+
+        if callbacks:
+            snapshot = self.snapshot()
+            for callback in callbacks:
+                try:
+                    callback(snapshot)
+
+                except Exception as e:
+                    logger.exception(e)
+
+
+class CacheBackend(object):
+    """The interface a cache that is shared by multiple processes has to implement
+
+    values are stored with a ttl and every table has a generation that can only
+    go up, CacheNamespace uses the generations to decide if a value is current
+    """
+    def get(self, key):
+        """must return a tuple (val, hit)"""
+        raise NotImplementedError()
+
+    def set(self, key, val, ttl):
+        """store val at key for ttl seconds"""
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+    def clear(self):
+        """get rid of all the stored values, this should never reset the generations"""
+        raise NotImplementedError()
+
+    def generation(self, table_name):
+        """return the current generation of table_name, 0 if it was never invalidated"""
+        raise NotImplementedError()
+
+    def invalidate(self, table_name):
+        """atomically increment and return the generation of table_name"""
+        raise NotImplementedError()
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """A cache shared by every process on the host using a SQLite db in WAL mode
+
+    every thread (of every process) gets its own connection to the db, WAL mode
+    means reads never block on the writes of the other processes
+
+    example --
+        from prom import CacheQuery
+        from prom.cache import SQLiteCacheBackend
+
+        CacheQuery.cache_namespace.backend = SQLiteCacheBackend("/tmp/prom-cache.db")
+    """
+    def __init__(self, path, timeout=5.0, prune_interval=1000):
+        """
+        :param path: str, the path to the SQLite db file, it will be created if it
+            doesn't exist
+        :param timeout: float, how long to wait on a lock held by another process
+        :param prune_interval: int, expired values are deleted every this many sets
+        """
+        self.path = path
+        self.timeout = timeout
+        self.prune_interval = prune_interval
+        self.sets = 0
+        self.local = threading.local()
+
+        conn = self.get_connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS prom_cache ("
+            " key TEXT PRIMARY KEY NOT NULL,"
+            " val BLOB NOT NULL,"
+            " expires REAL NOT NULL"
+            ")"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS prom_cache_expires ON prom_cache (expires)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS prom_cache_generation ("
+            " table_name TEXT PRIMARY KEY NOT NULL,"
+            " generation INTEGER NOT NULL"
+            ")"
+        )
+
+    def get_connection(self):
+        """return the connection for the current thread of the current process, a
+        forked child can't use the connections of its parent"""
+        pid = os.getpid()
+        conn = getattr(self.local, "connection", None)
+        if conn is None or self.local.pid != pid:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,
+            )
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = conn
+            self.local.pid = pid
+
+        return conn
+
+    def get(self, key):
+        try:
+            row = self.get_connection().execute(
+                "SELECT val FROM prom_cache WHERE key = ? AND expires > ?",
+                (key, time.time())
+            ).fetchone()
+
+        except sqlite3.Error as e:
+            logger.warning("Cache backend get failed: {}".format(e))
+            row = None
+
+        if row:
+            return pickle.loads(bytes(row[0])), True
+
+        return None, False
+
+    def set(self, key, val, ttl):
+        val = pickle.dumps(plain(val), pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        try:
+            conn = self.get_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO prom_cache (key, val, expires) VALUES (?, ?, ?)",
+                (key, sqlite3.Binary(val), now + ttl)
+            )
+
+            self.sets += 1
+            if self.prune_interval and (self.sets % self.prune_interval) == 0:
+                conn.execute("DELETE FROM prom_cache WHERE expires <= ?", (now,))
+
+        except sqlite3.Error as e:
+            logger.warning("Cache backend set failed: {}".format(e))
+            return False
+
+        return True
+
+    def delete(self, key):
+        try:
+            self.get_connection().execute("DELETE FROM prom_cache WHERE key = ?", (key,))
+
+        except sqlite3.Error as e:
+            logger.warning("Cache backend delete failed: {}".format(e))
+            return False
+
+        return True
+
+    def clear(self):
+        try:
+            self.get_connection().execute("DELETE FROM prom_cache")
+
+        except sqlite3.Error as e:
+            logger.warning("Cache backend clear failed: {}".format(e))
+            return False
+
+        return True
+
+    def generation(self, table_name):
+        """returns None if the generation couldn't be read, nothing should be
+        considered current then"""
+        try:
+            row = self.get_connection().execute(
+                "SELECT generation FROM prom_cache_generation WHERE table_name = ?",
+                (table_name,)
+            ).fetchone()
+
+        except sqlite3.Error as e:
+            logger.warning("Cache backend generation failed: {}".format(e))
+            return None
+
+        return row[0] if row else 0
+
+    def invalidate(self, table_name):
+        """returns None if the generation couldn't be incremented"""
+        try:
+            conn = self.get_connection()
+            conn.execute(
+                "INSERT OR IGNORE INTO prom_cache_generation (table_name, generation) VALUES (?, 0)",
+                (table_name,)
+            )
+            conn.execute(
+                "UPDATE prom_cache_generation SET generation = generation + 1 WHERE table_name = ?",
+                (table_name,)
+            )
+
+        except sqlite3.Error as e:
+            logger.warning("Cache backend invalidate failed: {}".format(e))
+            return None
+
+        return self.generation(table_name)
+
+
+class CacheNamespace(object):
+    """This is what actually does the memory caching of CacheQuery
+
+    The cached values are shared by all the threads in the process, but whether
+    caching is active (and for how long values should be cached) is thread local
+    so it can be scoped using CacheQuery.cache()
+
+    If the process forks then the child will start with an empty cache (but it will
+    still share the values held by the backend)
+    """
+    cache_class = LRUCache
+
+    active = LocalProperty("active", False, bool)
+
+    ttl = LocalProperty(
+        "ttl",
+        3600,
+        float,
+        "how long you should cache results for cacheable queries",
+    )
+
+    stale_ttl = LocalProperty(
+        "stale_ttl",
+        0,
+        float,
+        "how long after expiring a result can be returned while it is refreshed",
+    )
+
+    jitter = LocalProperty(
+        "jitter",
+        0.0,
+        float,
+        "the fraction the ttl of each result will be randomly moved up or down",
+    )
+
+    @property
+    def process_id(self):
+        f = getattr(os, 'getpid', None)
+        return f() if f else 0
+
+    @property
+    def store(self):
+        """return the LRUCache that holds the values for this process"""
+        pid = self.process_id
+        if pid != self.pid:
+            with self.lock:
+                if pid != self.pid:
+                    self.reset()
+        return self._store
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, backend=None, generation_ttl=1.0):
+        """
+        :param max_entries: int, how many results can be cached at any one time
+        :param max_bytes: int, roughly how much memory the cached results can take up
+        :param backend: CacheBackend, a cache shared with other processes that will
+            be checked when a value isn't in this process's cache
+        :param generation_ttl: float, how many seconds a table generation read from
+            the backend is trusted before it is read again, this is how long it can
+            take for this process to see another process's writes
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.generation_ttl = generation_ttl
+        self.stats = CacheStats()
+        self.local = threading.local()
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        """get rid of everything that has been cached"""
+        with self.lock:
+            self.pid = self.process_id
+            self.generations = {}
+            self.backend_generations = {}
+            self.stats.reset()
+            self._store = self.cache_class(
+                max_entries=self.max_entries,
+                max_bytes=self.max_bytes,
+                callback=self.stats.store_callback,
+            )
+
+    def clear(self):
+        self.reset()
+        if self.backend:
+            self.backend.clear()
+
+    def backend_key(self, table_name, key):
+        """the backend is shared by other processes so it needs a key that (unlike
+        hash() or the repr() of a set) is the same in every process"""
+        return "{}:{}".format(table_name, md5(make_key(key)))
+
+    def generation(self, schema):
+        """return the current generation of the table
+
+        :returns: int, this can be None if there is a backend and it failed, then
+            nothing is current
+        """
+        table_name = str(schema)
+        if self.backend:
+            now = time.time()
+            generation, expires = self.backend_generations.get(table_name, (None, 0.0))
+            if expires <= now:
+                generation = self.backend.generation(table_name)
+                if generation is not None and self.generation_ttl > 0:
+                    self.backend_generations[table_name] = (
+                        generation,
+                        now + self.generation_ttl
+                    )
+
+            return generation
+
+        return self.generations.get(table_name, 0)
+
+    def invalidate(self, schema):
+        """make every value currently cached for the table stale
+
+        :returns: int, the new generation of the table
+        """
+        table_name = str(schema)
+        self.stats.incr(table_name, "invalidations")
+        if self.backend:
+            generation = self.backend.invalidate(table_name)
+            if generation is None:
+                self.backend_generations.pop(table_name, None)
+
+            elif self.generation_ttl > 0:
+                self.backend_generations[table_name] = (
+                    generation,
+                    time.time() + self.generation_ttl
+                )
+
+            return generation
+
+        with self.lock:
+            generation = self.generations.get(table_name, 0) + 1
+            self.generations[table_name] = generation
+        return generation
+
+    def get(self, schema, key, generation=None):
+        """return the value cached at key for schema if it is still current
+
+        :param generation: int, the current generation of the table if it is
+            already known, this saves looking it up again
+        :returns: tuple, (val, hit)
+        """
+        table_name = str(schema)
+        if generation is None:
+            generation = self.generation(schema)
+            if generation is None:
+                return None, False
+
+        val, hit = self.store.get((table_name, key))
+        if hit:
+            val_generation, val = val
+            if val_generation == generation:
+                return val, True
+
+            self.store.delete((table_name, key))
+
+        if self.backend:
+            val, hit = self.backend.get(self.backend_key(table_name, key))
+            if hit:
+                val_generation, val = val
+                if val_generation == generation:
+                    self.store.set((table_name, key), (generation, val))
+                    return val, True
+
+        return None, False
+
+    def set(self, schema, key, val, generation=None, ttl=None):
+        """cache val at key for schema
+
+        :param generation: int, the generation of the table when val was fetched
+            from the db, if the table has moved on since then val won't be cached,
+            defaults to the current generation
+        :param ttl: int, how many seconds the backend should hold val, defaults
+            to self.ttl
+        """
+        table_name = str(schema)
+        current_generation = self.generation(schema)
+        if current_generation is None:
+            return False
+
+        if generation is None:
+            generation = current_generation
+
+        if generation != current_generation:
+            return False
+
+        ret = self.store.set((table_name, key), (generation, val))
+        if self.backend:
+            self.backend.set(
+                self.backend_key(table_name, key),
+                (generation, val),
+                self.ttl if ttl is None else ttl,
+            )
+
+        return ret
+
+
+class IdentityMap(object):
+    """Holds the rows of a table by their primary key
+
+    query.Query will check the active identity map in get_pk() and get_pks() before
+    going to the db, and any full rows returned from get() or get_one() are added
+    to it. Writes made through Query.update() and Query.delete() (and so Orm.save()
+    and Orm.delete()) only invalidate the primary keys they touched, unless the
+    where clause is more complicated than that, then the whole table is invalidated
+
+    rows are held instead of Orm instances so every lookup gets its own instance,
+    this means one map can safely be shared between threads
+
+    see -- identity_map(), set_identity_map()
+    """
+    def __init__(self, max_entries=0, max_bytes=0):
+        """
+        :param max_entries: int, 0 for unbounded, otherwise how many rows to hold
+        :param max_bytes: int, 0 for unbounded, otherwise roughly how much memory
+            the held rows can use
+        """
+        self.lock = threading.RLock()
+        self.store = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+        self.clear()
+
+    def __len__(self):
+        return len(self.store)
+
+    def clear(self):
+        with self.lock:
+            self.store.clear()
+            self.generations = {}
+            self.writes = {}
+
+    def token(self, schema):
+        """return a token that should be grabbed before the db is queried and then
+        passed to set() so rows can't be held if the table was written to while
+        they were being fetched"""
+        return self.writes.get(str(schema), 0)
+
+    def get(self, schema, pk):
+        """return the row held for pk
+
+        :returns: tuple, (row, hit)
+        """
+        table_name = str(schema)
+        val, hit = self.store.get((table_name, pk))
+        if hit:
+            generation, row = val
+            if generation == self.generations.get(table_name, 0):
+                return dict(row), True
+
+            self.store.delete((table_name, pk))
+
+        return None, False
+
+    def get_many(self, schema, pks):
+        """return all the held rows for pks
+
+        :returns: dict, pk keys with row values for every pk that was found
+        """
+        ret = {}
+        for pk in pks:
+            row, hit = self.get(schema, pk)
+            if hit:
+                ret[pk] = row
+        return ret
+
+    def set(self, schema, pk, row, token=None):
+        """hold row for pk
+
+        :param token: mixed, the value of token() before row was fetched
+        :returns: bool, True if the row is now held
+        """
+        if pk is None: return False
+
+        table_name = str(schema)
+        with self.lock:
+            if token is not None and token != self.writes.get(table_name, 0):
+                return False
+
+            generation = self.generations.get(table_name, 0)
+            return self.store.set((table_name, pk), (generation, dict(row)))
+
+    def set_many(self, schema, rows, token=None):
+        """hold all the rows, the pk of each row is found using the schema"""
+        pk_name = schema.pk_name
+        for row in rows:
+            self.set(schema, row[pk_name], row, token=token)
+
+    def invalidate(self, schema, pks=None):
+        """get rid of the held rows for pks, or every held row for the table if pks
+        is None"""
+        table_name = str(schema)
+        with self.lock:
+            self.writes[table_name] = self.writes.get(table_name, 0) + 1
+            if pks is None:
+                self.generations[table_name] = self.generations.get(table_name, 0) + 1
+
+            else:
+                for pk in pks:
+                    self.store.delete((table_name, pk))
+
+
+identity_maps = threading.local()
+"""holds the stack of identity maps activated with identity_map() for each thread"""
+
+global_identity_map = None
+"""the identity map used when there isn't a thread specific one active"""
+
+
+def set_identity_map(im):
+    """set the identity map that will be used by every thread of the process when
+    there isn't an identity_map() active
+
+    :param im: IdentityMap, pass in None to turn off the global map
+    """
+    global global_identity_map
+    global_identity_map = im
+
+
+def get_identity_maps():
+    """return all the active identity maps for the current thread, most specific first"""
+    ret = list(reversed(getattr(identity_maps, "stack", [])))
+    if global_identity_map is not None:
+        ret.append(global_identity_map)
+    return ret
+
+
+def get_identity_map():
+    """return the identity map that should be used by the current thread, None if
+    there isn't one"""
+    stack = getattr(identity_maps, "stack", None)
+    return stack[-1] if stack else global_identity_map
+
+
+@contextmanager
+def identity_map(max_entries=0, max_bytes=0):
+    """activate an identity map for the current thread while in the with block,
+    this is handy to wrap a request or a job so the same rows aren't fetched
+    over and over
+
+    example --
+        with prom.identity_map():
+            foo = Foo.query.get_pk(1) # hits the db
+            foo = Foo.query.get_pk(1) # comes from the map
+
+    :returns: IdentityMap
+    """
+    im = IdentityMap(max_entries=max_entries, max_bytes=max_bytes)
+    stack = getattr(identity_maps, "stack", None)
+    if stack is None:
+        stack = []
+        identity_maps.stack = stack
+
+    stack.append(im)
+    try:
+        yield im
+
+    finally:
+        stack.pop()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import json
+
+from captain import exit as console, echo
+from captain.decorators import arg
+
+from ..bench import Benchmark
+from ..utils import Stream
+
+
+def format_seconds(seconds):
+    if seconds < 0.001:
+        return "{:.1f}us".format(seconds * 1000000.0)
+    elif seconds < 1.0:
+        return "{:.2f}ms".format(seconds * 1000.0)
+    return "{:.2f}s".format(seconds)
+
+
+def format_bytes(size):
+    if size is None:
+        return "-"
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024.0:
+            return "{:.1f}{}".format(size, unit)
+        size /= 1024.0
+    return "{:.1f}GB".format(size)
+
+
+@arg("--dsn", default="", help="the db to benchmark, defaults to a SQLite db in a temp directory")
+@arg("--rows", type=int, default=100000, help="how many rows the read scenarios use")
+@arg("--seed", type=int, default=1, help="the seed of the random data")
+@arg("--processes", type=int, default=2, help="how many processes the reduce scenario uses")
+@arg("--scenario", "-s", dest="names", action="append", default=[], help="only run this scenario, can be passed more than once")
+@arg("--compare", "-c", default="", help="the json output of a previous run to compare this run to")
+@arg("--out-file", "-o", dest="stream", type=Stream, default="", help="write the json results to a file path, default stdout")
+def main_bench(dsn, rows, seed, processes, names, compare, stream):
+    """Run reproducible benchmarks of prom's hot paths and print ops/sec, latency
+    percentiles and peak memory of each one, the json of the results is written
+    to --out-file so it can be passed to --compare in a later run
+    """
+    previous = {}
+    if compare:
+        with open(compare) as fp:
+            previous = {r["name"]: r for r in json.load(fp)["results"]}
+
+    with Benchmark(dsn=dsn, rows=rows, seed=seed, processes=processes) as bench:
+        bench.run(names)
+        d = bench.jsonable()
+
+    echo.err(
+        "{:<16} {:>12} {:>10} {:>10} {:>10} {:>10} {:>10}",
+        "scenario", "ops/sec", "call p50", "call p95", "call p99", "memory", "change"
+    )
+    for r in d["results"]:
+        change = ""
+        if r["name"] in previous:
+            change = "{:+.1f}%".format(
+                (r["ops_per_sec"] / previous[r["name"]]["ops_per_sec"] - 1.0) * 100.0
+            )
+
+        echo.err(
+            "{:<16} {:>12.1f} {:>10} {:>10} {:>10} {:>10} {:>10}",
+            r["name"],
+            r["ops_per_sec"],
+            format_seconds(r["call_p50"]),
+            format_seconds(r["call_p95"]),
+            format_seconds(r["call_p99"]),
+            format_bytes(r["peak_memory"]),
+            change,
+        )
+
+    for name, ratio in d["summary"].items():
+        echo.err("{}: {:.2f}x", name, ratio)
+
+    with stream.open() as fp:
+        fp.write_line(json.dumps(d, indent=2, sort_keys=True))
@@ -146,6 +146,65 @@ class DsnConnection(Connection):
         return ret
 
 
+def is_default(method, function):
+    """return True if the bound method is function, this is how the defaults of a
+    Field are told apart from customized ones"""
+    return getattr(method, "__func__", None) is getattr(function, "__func__", function)
+
+
+class CompiledSchema(object):
+    """The lookups the Orm and Query hot paths need, they are all figured out once
+    from the fields of a schema, see Schema.compiled
+
+    none of these should be modified
+    """
+    def __init__(self, fields):
+        """
+        :param fields: dict, the fields of the schema
+        """
+        self.fields = fields
+
+        self.field_names = tuple(fields)
+        """the column names in the order the fields were added"""
+
+        self.normal_fields = {k: v for k, v in fields.items() if not k.startswith('_')}
+        self.magic_fields = {k: v for k, v in fields.items() if k.startswith('_')}
+        self.required_fields = {k: v for k, v in self.normal_fields.items() if v.required}
+
+        self.normal_field_names = frozenset(self.normal_fields)
+        self.required_field_names = tuple(self.required_fields)
+
+        self.object_field_names = tuple(
+            k for k, v in self.normal_fields.items() if isinstance(v, ObjectField)
+        )
+        """the fields that are always modified since changes to their values can't
+        be seen"""
+
+        self.pk = None
+        for field in fields.values():
+            if field.is_pk():
+                self.pk = field
+                break
+        self.pk_name = self.pk.name if self.pk else None
+
+        self.field_name_map = {k: k for k in fields}
+        """maps every name a field can be looked up with to its field name"""
+        if self.pk:
+            self.field_name_map.setdefault("pk", self.pk_name)
+
+        self.igets = {}
+        """field name keys with the field's iget method, None if iget would return
+        the value it was given"""
+
+        self.isets = {}
+        """field name keys with the field's iset method, None if iset would return
+        the value it was given"""
+
+        for k, field in fields.items():
+            self.igets[k] = None if field.is_passthrough_iget() else field.iget
+            self.isets[k] = None if is_default(field.iset, Field.default_iset) else field.iset
+
+
 class Schema(object):
     """
     handles all table schema definition
@@ -166,20 +225,36 @@ class Schema(object):
     indexes = None
     """dict -- all the indexes this schema will have"""
 
+    _compiled = None
+
+    @property
+    def compiled(self):
+        """the CompiledSchema of the fields, it is created the first time it is needed
+        and again after a field is added"""
+        ret = self._compiled
+        if ret is None:
+            ret = self.compile()
+        return ret
+
     @property
     def normal_fields(self):
         """fields that aren't magic (eg, aren't _id, _created, _updated)"""
-        return {f:v for f, v in self.fields.items() if not f.startswith('_')}
+        return self.compiled.normal_fields
 
     @property
     def required_fields(self):
         """The normal required fields (eg, no magic fields like _id are included)"""
-        return {f:v for f, v in self.normal_fields.items() if v.required}
+        return self.compiled.required_fields
 
     @property
     def magic_fields(self):
         """the magic fields for the schema"""
-        return {f:v for f, v in self.fields.items() if f.startswith('_')}
+        return self.compiled.magic_fields
+
+    @property
+    def pk_name(self):
+        """the name of the primary key field, None if there isn't one"""
+        return self.compiled.pk_name
 
     @classmethod
     def get_instance(cls, orm_class):
@@ -260,12 +335,22 @@ class Schema(object):
 
         else:
             if name == u"pk":
-                for field_name, field in self.fields.items():
-                    if field.options.get('pk', False):
-                        return field
+                pk = self.compiled.pk
+                if pk:
+                    return pk
 
             raise AttributeError("No {} field in schema {}".format(name, self.table_name))
 
+    def compile(self):
+        """freeze the fields into the lookups the Orm and Query hot paths use, this
+        is called the first time they are needed and again after a field is added
+        or a field's iget or iset is changed
+
+        :returns: CompiledSchema
+        """
+        self._compiled = CompiledSchema(self.fields)
+        return self._compiled
+
     def set_field(self, field_name, field):
         if not field_name: raise ValueError("field_name is empty")
         if field_name in self.fields: raise ValueError("{} already exists and cannot be changed".format(field_name))
@@ -276,6 +361,8 @@ class Schema(object):
             self.set_index(field_name, Index(field_name, unique=True))
 
         self.fields[field_name] = field
+        field.owner_schemas.append(self)
+        self._compiled = None
         return self
 
     def set_index(self, index_name, index):
@@ -307,7 +394,10 @@ class Schema(object):
         most of the time, the field_name of k will just be k, but this makes special
         allowance for k's like "pk" which will return _id
         """
-        return self.__getattr__(k).name
+        try:
+            return self.compiled.field_name_map[k]
+        except KeyError:
+            raise AttributeError("No {} field in schema {}".format(k, self.table_name))
 
 
 class Index(object):
@@ -456,6 +546,9 @@ class Field(object):
         field_options.setdefault("unique", False)
         field_options.update(d)
 
+        # the schemas this field was added to, they compile its iget and iset
+        self.owner_schemas = []
+
         self.fgetter(field_options.pop("fget", self.default_fget))
         self.fsetter(field_options.pop("fset", self.default_fset))
         self.fdeleter(field_options.pop("fdel", self.default_fdel))
@@ -508,6 +601,15 @@ class Field(object):
 
         return ret
 
+    def is_passthrough_iget(self):
+        """return True if iget always returns the value it is given, the iget call
+        can be skipped for these fields when an Orm is populated"""
+        return (
+            self.default is None
+            and is_default(self.iget, Field.default_iget)
+            and is_default(self.fdefault, Field.default_fdefault)
+        )
+
     def default_iset(self, instance, val, is_update, is_modified):
         return val
 
@@ -549,12 +651,20 @@ class Field(object):
 
     def igetter(self, iget):
         self.iget = iget
+        self.reset_compiled()
         return self
 
     def isetter(self, iset):
         self.iset = iset
+        self.reset_compiled()
         return self
 
+    def reset_compiled(self):
+        """the schemas this field is in will compile it again the next time they
+        need it, so a changed iget or iset is used"""
+        for schema in self.owner_schemas:
+            schema._compiled = None
+
     def jsonabler(self, jsonable):
         self.jsonable = jsonable
 
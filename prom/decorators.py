@@ -1,11 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, division, print_function, absolute_import
-import time
 from functools import wraps
 import logging
 
-from .exception import InterfaceError
-
 
 logger = logging.getLogger(__name__)
 
@@ -15,66 +12,27 @@ def reconnecting(count=None, backoff=None):
     It will attempt to reconnect if the connection is closed and run the same 
     method again.
 
-    TODO -- I think this will have issues with transactions using passed in
-    connections, ie, you pass in a transacting connection to the insert() method
-    and that connection gets dropped, this will reconnect but the transaction will
-    be hosed.
+    The interface's retry_policy (see retry.RetryPolicy) decides which errors can
+    be retried and how long to wait between attempts. If the method was passed
+    a connection that is in a transaction it won't be retried since the transaction
+    would be gone with the connection
 
-    count -- integer -- how many attempts to run the method, defaults to 3
-    backoff -- float -- how long to sleep on failure, defaults to 1.0
+    count -- integer -- how many attempts to run the method, defaults to the
+        policy's attempts (the reconnect_attempts dsn option, 3)
+    backoff -- float -- how long to sleep before the first retry, defaults to the
+        policy's backoff (the reconnect_backoff dsn option, 1.0)
     """
-    # we get trixxy here so we can manipulate these values in the wrapped function,
-    # this is one of the first times I wish we were on Python 3
-    # http://stackoverflow.com/a/9264845/5006
-    reconn_params = {
-        "count": count,
-        "backoff": backoff
-    }
-
     def retry_decorator(func):
         @wraps(func)
         def wrapper(self, *args, **kwargs):
-
-            count = reconn_params["count"]
-            backoff = reconn_params["backoff"]
-
-            if count is None:
-                count = self.connection_config.options.get('reconnect_attempts', 3)
-
-            if backoff is None:
-                backoff = self.connection_config.options.get('reconnect_backoff', 1.0)
-
-            count = int(count)
-            backoff = float(backoff)
-
-            for attempt in range(1, count + 1):
-                try:
-                    backoff_seconds = float(attempt - 1) * backoff
-                    if backoff_seconds:
-                        logger.debug("sleeping {} seconds before attempt {}".format(
-                            backoff_seconds,
-                            attempt
-                        ))
-                    time.sleep(backoff_seconds)
-
-                    return func(self, *args, **kwargs)
-
-                except InterfaceError as e:
-                    e_msg = str(e.e)
-                    # TODO -- this gets us by SQLite and Postgres, but might not
-                    # work in the future, so this needs to be a tad more robust
-                    if "closed" in e_msg.lower():
-                        if attempt == count:
-                            logger.debug("all {} attempts failed".format(count))
-                            raise
-                        else:
-                            logger.debug("attempt {}/{} failed, retrying".format(
-                                attempt,
-                                count
-                            ))
-
-                    else:
-                        raise
+            return self.retry_policy.call(
+                self,
+                func,
+                args=[self] + list(args),
+                kwargs=kwargs,
+                attempts=count,
+                backoff=backoff,
+            )
 
         return wrapper
 
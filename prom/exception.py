@@ -16,3 +16,28 @@ class InterfaceError(Error):
 
 class UniqueError(InterfaceError):
     pass
+
+
+class CancelError(InterfaceError):
+    """the query was stopped because it ran past its timeout"""
+    pass
+
+
+class TransactionError(CancelError):
+    """the db ended the transaction the query was in on its own, everything the
+    transaction wrote has been rolled back"""
+    pass
+
+
+class NPlusOneError(Error):
+    """raised by instrument.detect_n_plus_one(mode="raise") with the query shapes
+    that ran too many times, they are in .found"""
+    def __init__(self, found):
+        self.found = found
+        super(NPlusOneError, self).__init__("\n".join(str(n) for n in found))
+
+
+class NPlusOneWarning(UserWarning):
+    """issued by instrument.detect_n_plus_one() for each query shape that ran too
+    many times"""
+    pass
@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, division, print_function, absolute_import
+from collections import deque
 
 import psycogreen.gevent
-from gevent.queue import Queue
-import psycopg2
-from psycopg2 import extensions, OperationalError, connect
-from psycopg2.pool import AbstractConnectionPool, PoolError
+import gevent
+from gevent.event import Event
+from gevent.lock import Semaphore
+from psycopg2.pool import PoolError
 
 from .interface import get_interfaces
+from .interface import postgres
 from .interface.postgres import PostgreSQL
 
 def patch_all(maxconn=10, **kwargs):
@@ -22,68 +24,83 @@ def patch_all(maxconn=10, **kwargs):
             interface.connection_config.options.update(kwargs)
 
 
-class ConnectionPool(AbstractConnectionPool):
-    """a gevent green thread safe connection pool
-    this is based off an example found here
-    https://github.com/surfly/gevent/blob/master/examples/psycopg2_pool.py
-    """
-    def __init__(self, minconn, maxconn, *args, **kwargs):
-        self.size = 0
-        self.minconn = minconn
-        self.maxconn = maxconn
-        self.closed = False
-
-        self._args = args
-        self._kwargs = kwargs
-        self._pool = Queue()
-
-        for i in range(self.minconn):
-            connection = self._connect()
-            self.putconn(connection)
-
-    def _connect(self, key=None):
-        self.size += 1
-        try:
-            # I think connect() causes a WAIT, so we need to increment size before
-            # we call connect() in order to actually make it increment
-            conn = psycopg2.connect(*self._args, **self._kwargs)
+class Condition(object):
+    """the parts of threading.Condition the connection pool uses, but waiting
+    only blocks the green thread, this works whether threading has been monkey
+    patched or not"""
+    def __init__(self):
+        self._lock = Semaphore()
+        self._waiters = deque()
 
-        except:
-            self.size -= 1
-            raise
+    def __enter__(self):
+        self._lock.acquire()
+        return self
 
-        return conn
+    def __exit__(self, *args):
+        self._lock.release()
 
-    def getconn(self, key=None):
-        if self.closed: raise PoolError("connection pool is closed")
-        pool = self._pool
-        if self.size >= self.maxconn or pool.qsize():
-            conn = pool.get()
+    def wait(self, timeout=None):
+        """this should be called while holding the lock, it is released while
+        waiting for notify() or timeout seconds"""
+        waiter = Event()
+        self._waiters.append(waiter)
+        self._lock.release()
+        try:
+            waiter.wait(timeout)
 
-        else:
+        finally:
+            self._lock.acquire()
             try:
-                conn = self._connect()
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
 
-            except:
-                raise
+    def notify(self, n=1):
+        for _ in range(n):
+            if not self._waiters: break
+            self._waiters.popleft().set()
 
-        return conn
+    def notify_all(self):
+        self.notify(len(self._waiters))
 
-    def putconn(self, conn=None, key=None, close=False):
-        if self.closed: raise PoolError("connection pool is closed")
-        if close:
-            conn.close()
-        else:
-            self._pool.put(conn)
 
-    def closeall(self):
-        if self.closed: raise PoolError("connection pool is closed")
-        # TODO -- might be better to do this decrementing self.size?
-        while not self._pool.empty():
-            conn = self._pool.get_nowait()
-            try:
-                conn.close()
-            except Exception:
-                pass
+class ConnectionPool(postgres.ConnectionPool):
+    """a gevent green thread safe connection pool
 
-        self.closed = True
+    it has everything the postgres.ConnectionPool has (acquisition timeouts,
+    pinging connections before handing them out, replacing closed and broken
+    connections, idle and lifetime limits, and stats) but waiting for a
+    connection only blocks the green thread, and if idle or lifetime is set a
+    green thread closes the expired idle connections so they don't stay open
+    while the pool is quiet
+
+    originally based off an example found here
+    https://github.com/surfly/gevent/blob/master/examples/psycopg2_pool.py
+    """
+    def __init__(self, minconn, maxconn, reap_interval=0.0, **kwargs):
+        """
+        :param reap_interval: float, how many seconds between each reap(), it
+            defaults to the smaller of idle and lifetime
+        :param **kwargs: see postgres.ConnectionPool
+        """
+        super(ConnectionPool, self).__init__(minconn, maxconn, **kwargs)
+
+        timeouts = [t for t in (self.idle_timeout, self.lifetime) if t]
+        self.reap_interval = float(reap_interval) or (min(timeouts) if timeouts else 0.0)
+        self._reaper = None
+        if self.reap_interval:
+            self._reaper = gevent.spawn(self._reap_forever)
+
+    def create_condition(self):
+        return Condition()
+
+    def _reap_forever(self):
+        while not self.closed:
+            gevent.sleep(self.reap_interval)
+            self.reap()
+
+    def closeall(self):
+        super(ConnectionPool, self).closeall()
+        if self._reaper is not None:
+            self._reaper.kill(block=False)
+            self._reaper = None
@@ -0,0 +1,715 @@
+# -*- coding: utf-8 -*-
+"""
+Structured events for the queries an Interface runs
+
+Every statement an interface runs can become a QueryEvent (the query shape, how
+long it took, how many rows, the connection and if it was in a transaction),
+the interface's QueryLog (Interface.query_log) decides which events are kept,
+all of them, 1 in every N, or only the ones slower than some milliseconds, and
+hands those to its sink. When the sink isn't listening (eg, the default LogSink
+when the prom logger isn't at DEBUG) no event is created and the query isn't
+even timed.
+
+The query log is configured with the connection's dsn options:
+
+    query_log_sample -- int -- only keep 1 in every N events
+    query_log_slow -- float -- only keep events that took at least this many ms
+    query_log_sink -- string -- the full class path of the QuerySink
+    query_log_level -- string|int -- the logging level LogSink uses, DEBUG by default
+
+The plans of slow queries can also be captured, when explain_slow is set the
+first query of each shape that takes at least that many milliseconds is
+EXPLAINed and the plan is kept in the interface's PlanLog (Interface.plan_log)
+and logged as a warning:
+
+    explain_slow -- float -- EXPLAIN queries that took at least this many ms, 0 (off) by default
+    explain_limit -- int -- the most plans that are kept, 1000 by default
+
+Besides the query log, every event is also given to the listeners that are
+active in the current thread, this is how profile() sees every query that runs
+inside of it no matter what interface ran it:
+
+    with prom.profile() as p:
+        ...
+    p.report()
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import os
+import sys
+import re
+import math
+import time
+import json
+import logging
+import itertools
+import threading
+import warnings
+from contextlib import contextmanager
+from collections import Counter, OrderedDict
+
+from .utils import get_objects
+from .exception import NPlusOneError, NPlusOneWarning
+from .compat import *
+
+
+logger = logging.getLogger(__name__)
+
+
+timer = getattr(time, "perf_counter", time.time)
+"""the clock query durations are measured with"""
+
+
+SHAPE_SPACE_REGEX = re.compile(r"\s+")
+SHAPE_LIST_REGEX = re.compile(r"(%s|\?)(?:\s*,\s*(?:%s|\?))+")
+SHAPE_BOUNDS_REGEX = re.compile(r"\b(LIMIT|OFFSET)\s+\d+", re.I)
+
+
+def get_shape(query_str):
+    """return the normalized query_str, whitespace is collapsed and lists of
+    placeholders (eg, IN (%s, %s, %s)) become one placeholder and ... and the
+    numbers of LIMIT and OFFSET become N so every query that only differs by
+    its values or how many values it has has the same shape
+
+    :param query_str: str, the SQL with placeholders
+    :returns: str
+    """
+    shape = SHAPE_SPACE_REGEX.sub(" ", query_str).strip()
+    shape = SHAPE_LIST_REGEX.sub(r"\1, ...", shape)
+    return SHAPE_BOUNDS_REGEX.sub(r"\1 N", shape)
+
+
+class QueryEvent(object):
+    """One statement an interface ran"""
+    def __init__(self, interface_name, query_str, query_args, start, duration, rows=None, connection_id=0, in_transaction=False, error=None):
+        """
+        :param interface_name: str, the name of the interface's connection
+        :param query_str: str, the SQL that ran
+        :param query_args: list, the values of query_str's placeholders
+        :param start: float, the time.time() the query started
+        :param duration: float, how many milliseconds the query took
+        :param rows: int, how many rows the query returned or changed, None if
+            that isn't known (eg, a cursor result)
+        :param connection_id: int, the id() of the connection the query ran on
+        :param in_transaction: bool, True if the query ran in a transaction
+        :param error: Exception, what the query raised if it failed
+        """
+        self.interface_name = interface_name
+        self.query_str = query_str
+        self.query_args = query_args
+        self.start = start
+        self.duration = duration
+        self.rows = rows
+        self.connection_id = connection_id
+        self.in_transaction = in_transaction
+        self.error = error
+        self._shape = None
+
+    @property
+    def shape(self):
+        """the normalized query_str, see get_shape()"""
+        if self._shape is None:
+            self._shape = get_shape(self.query_str)
+        return self._shape
+
+    def jsonable(self):
+        """return a dict of the event that can be passed to json.dumps"""
+        return {
+            "interface_name": self.interface_name,
+            "shape": self.shape,
+            "start": self.start,
+            "duration": self.duration,
+            "rows": self.rows,
+            "connection_id": self.connection_id,
+            "in_transaction": self.in_transaction,
+            "error": unicode(self.error) if self.error else None,
+        }
+
+    def __str__(self):
+        return "{:.3f}ms rows={} connection={} transaction={}{}: {}".format(
+            self.duration,
+            self.rows,
+            self.connection_id,
+            int(self.in_transaction),
+            " error" if self.error else "",
+            self.shape,
+        )
+
+
+class QuerySink(object):
+    """Where a QueryLog puts the events it keeps, a child needs to implement
+    emit()"""
+    def is_enabled(self):
+        """return False if the sink would throw away every event, the interface
+        doesn't even time its queries then"""
+        return True
+
+    def emit(self, event):
+        """
+        :param event: QueryEvent
+        """
+        raise NotImplementedError()
+
+
+class LogSink(QuerySink):
+    """Logs each event as one line, the event is also passed to the handlers as
+    the query_event attribute of the log record
+
+    this is the default sink, so queries are only timed when its logger is at
+    its level
+    """
+    def __init__(self, level=logging.DEBUG, logger=logger):
+        if isinstance(level, basestring) and not level.isdigit():
+            level = logging.getLevelName(level.upper())
+        self.level = int(level)
+        self.logger = logger
+
+    def is_enabled(self):
+        return self.logger.isEnabledFor(self.level)
+
+    def emit(self, event):
+        self.logger.log(self.level, "%s", event, extra={"query_event": event})
+
+
+class ListSink(QuerySink):
+    """Keeps every event in a list, this is handy for tests"""
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event):
+        self.events.append(event)
+
+
+class QueryLog(object):
+    """Decides which query events an Interface keeps and gives those to the sink"""
+    @classmethod
+    def create(cls, connection_config):
+        """create a query log using the options of the connection_config, this
+        is how an Interface gets its query log
+
+        :param connection_config: config.Connection
+        :returns: QueryLog
+        """
+        options = connection_config.options if connection_config else {}
+        sink_class_name = options.get("query_log_sink", "")
+        if sink_class_name:
+            _, sink_class = get_objects(sink_class_name)
+            sink = sink_class()
+
+        else:
+            sink = LogSink(level=options.get("query_log_level", logging.DEBUG))
+
+        return cls(
+            sink=sink,
+            sample=options.get("query_log_sample", 1),
+            slow=options.get("query_log_slow", 0.0),
+        )
+
+    def __init__(self, sink, sample=1, slow=0.0):
+        """
+        :param sink: QuerySink
+        :param sample: int, only keep 1 in every sample events, 1 keeps them all
+        :param slow: float, only keep events that took at least this many
+            milliseconds, the events this keeps are then sampled
+        """
+        self.sink = sink
+        self.sample = max(int(sample), 1)
+        self.slow = float(slow)
+        self.counter = itertools.count()
+
+    def is_enabled(self):
+        return self.sink.is_enabled()
+
+    def __call__(self, event):
+        """give event to the sink if it is kept
+
+        :param event: QueryEvent
+        :returns: bool, True if the event was kept
+        """
+        if self.slow and event.duration < self.slow:
+            return False
+
+        if self.sample > 1 and next(self.counter) % self.sample:
+            return False
+
+        self.sink.emit(event)
+        return True
+
+
+class QueryPlan(object):
+    """The plan of a query the PlanLog captured"""
+    def __init__(self, event, plan):
+        """
+        :param event: QueryEvent, the slow query
+        :param plan: list, what Interface.explain_query() returned
+        """
+        self.event = event
+        self.plan = plan
+
+    def jsonable(self):
+        d = self.event.jsonable()
+        d["plan"] = self.plan
+        return d
+
+
+class PlanLog(object):
+    """Decides which slow queries an Interface EXPLAINs and keeps the plans, only
+    the first slow query of each shape is EXPLAINed"""
+    explainable_regex = re.compile(r"^\s*(?:SELECT|WITH|UPDATE|DELETE)\b", re.I)
+    """EXPLAIN only ever runs on the statements this matches"""
+
+    @classmethod
+    def create(cls, connection_config):
+        """create a plan log using the options of the connection_config
+
+        :param connection_config: config.Connection
+        :returns: PlanLog
+        """
+        options = connection_config.options if connection_config else {}
+        return cls(
+            slow=options.get("explain_slow", 0.0),
+            limit=options.get("explain_limit", 1000),
+        )
+
+    def __init__(self, slow=0.0, limit=1000):
+        """
+        :param slow: float, EXPLAIN queries that took at least this many
+            milliseconds, 0 turns capturing off
+        :param limit: int, the most plans that are kept
+        """
+        self.slow = float(slow)
+        self.limit = int(limit)
+        self.plans = OrderedDict()
+
+    def is_enabled(self):
+        return self.slow > 0.0
+
+    def should_explain(self, event):
+        """return True if event's query should be EXPLAINed
+
+        :param event: QueryEvent
+        :returns: bool
+        """
+        return (
+            self.is_enabled()
+            and event.duration >= self.slow
+            and not event.error
+            and len(self.plans) < self.limit
+            and event.shape not in self.plans
+            and self.explainable_regex.match(event.query_str)
+        )
+
+    def add(self, event, plan):
+        """
+        :param event: QueryEvent, the slow query
+        :param plan: list, the query's plan
+        """
+        self.plans[event.shape] = QueryPlan(event, plan)
+        logger.warning(
+            "Slow query plan %.3fms: %s\n%s",
+            event.duration,
+            event.shape,
+            json.dumps(plan, indent=2, default=unicode)
+        )
+
+    def get(self, query_str):
+        """return the QueryPlan of query_str's shape, None if there isn't one"""
+        return self.plans.get(get_shape(query_str))
+
+    def jsonable(self):
+        return [p.jsonable() for p in self.plans.values()]
+
+
+local = threading.local()
+
+
+def get_listeners():
+    """return the listeners active in the current thread, each is called with the
+    QueryEvent of every statement any interface runs
+
+    :returns: list, empty if nothing is listening
+    """
+    return getattr(local, "listeners", ())
+
+
+def add_listener(listener):
+    """
+    :param listener: callable, called with each QueryEvent until it is removed
+    """
+    local.listeners = list(get_listeners()) + [listener]
+
+
+def remove_listener(listener):
+    local.listeners = [l for l in get_listeners() if l is not listener]
+
+
+def get_query():
+    """return the query.Query that is running in the current thread, this is only
+    known while a listener is active"""
+    return getattr(local, "query", None)
+
+
+@contextmanager
+def querying(query):
+    """mark query as the query that is running in the current thread so the
+    listeners can see it, see get_query()"""
+    previous = get_query()
+    local.query = query
+    try:
+        yield query
+    finally:
+        local.query = previous
+
+
+def take_stats():
+    """return the QueryStats the active profilers put the most recent query into,
+    this is how hydration time is added to the query that fetched the rows
+
+    :returns: list, the stats, they are forgotten so each query's stats can only be
+        taken once
+    """
+    ret = []
+    for listener in get_listeners():
+        stats = getattr(listener, "take_last", None)
+        if stats:
+            stats = stats()
+            if stats:
+                ret.append(stats)
+    return ret
+
+
+def add_hydration(stats, start, count=1):
+    """add the time spent turning rows into Orm instances since start to stats
+
+    :param stats: list, what take_stats() returned
+    :param start: float, the timer() when hydration started
+    :param count: int, how many instances were hydrated
+    """
+    duration = (timer() - start) * 1000.0
+    for s in stats:
+        s.hydration += duration
+        s.hydrated += count
+
+
+def percentile(values, p):
+    """return the nearest rank percentile of values
+
+    :param values: list, sorted numbers
+    :param p: float, between 0 and 100
+    :returns: float
+    """
+    if not values: return 0.0
+    k = max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)
+    return values[min(k, len(values) - 1)]
+
+
+PROM_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_call_site(frame=None):
+    """return the first line outside of prom that led to frame
+
+    :param frame: frame, defaults to the caller's frame
+    :returns: str, "path:lineno in function"
+    """
+    frame = frame or sys._getframe(1)
+    while frame:
+        path = os.path.abspath(frame.f_code.co_filename)
+        if not path.startswith(PROM_DIRECTORY):
+            return "{}:{} in {}".format(path, frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return ""
+
+
+class QueryStats(object):
+    """The aggregated events of all the queries that had the same shape"""
+    def __init__(self, shape):
+        self.shape = shape
+        self.count = 0
+        self.errors = 0
+        self.durations = []
+        self.rows = 0
+        self.hydration = 0.0
+        self.hydrated = 0
+        self.call_sites = Counter()
+
+    @property
+    def total(self):
+        """the milliseconds all the queries took"""
+        return sum(self.durations)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def p95(self):
+        return percentile(sorted(self.durations), 95)
+
+    @property
+    def call_site(self):
+        """the call site most of the queries came from"""
+        call_sites = self.call_sites.most_common(1)
+        return call_sites[0][0] if call_sites else ""
+
+    def add(self, event, call_site=""):
+        """
+        :param event: QueryEvent
+        :param call_site: str, where the query was called from
+        """
+        self.count += 1
+        self.durations.append(event.duration)
+        if event.rows:
+            self.rows += event.rows
+        if event.error:
+            self.errors += 1
+        if call_site:
+            self.call_sites[call_site] += 1
+
+    def jsonable(self):
+        return {
+            "shape": self.shape,
+            "count": self.count,
+            "errors": self.errors,
+            "total": self.total,
+            "mean": self.mean,
+            "p95": self.p95,
+            "rows": self.rows,
+            "hydration": self.hydration,
+            "hydrated": self.hydrated,
+            "call_sites": dict(self.call_sites),
+        }
+
+
+class Profiler(object):
+    """Aggregates the queries that run while it is active by their shape, this is
+    what profile() returns
+
+    all the times are in milliseconds
+    """
+    def __init__(self, call_sites=True):
+        """
+        :param call_sites: bool, False to not find where each query was called from,
+            which is the most expensive part of profiling
+        """
+        self.call_sites = call_sites
+        self.stats = {}
+        self.last = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        add_listener(self)
+
+    def stop(self):
+        remove_listener(self)
+        self.last = None
+
+    def __call__(self, event):
+        """
+        :param event: QueryEvent
+        """
+        shape = event.shape
+        stats = self.stats.get(shape)
+        if stats is None:
+            stats = QueryStats(shape)
+            self.stats[shape] = stats
+
+        stats.add(event, get_call_site() if self.call_sites else "")
+        self.last = stats
+
+    def take_last(self):
+        """return the QueryStats of the most recent query and forget it"""
+        ret = self.last
+        self.last = None
+        return ret
+
+    def get_stats(self, sort="total"):
+        """return the QueryStats, biggest first
+
+        :param sort: str, the QueryStats attribute to sort by (eg, total, count,
+            mean, p95, rows, hydration)
+        :returns: list
+        """
+        return sorted(self.stats.values(), key=lambda s: getattr(s, sort), reverse=True)
+
+    def report(self, sort="total", stream=None):
+        """print a table of the queries, biggest first
+
+        :param sort: str, see get_stats()
+        :param stream: io.IOBase, where the table is printed, defaults to stdout
+        """
+        stream = stream or sys.stdout
+        line = "{:>6} {:>10} {:>9} {:>9} {:>8} {:>10}  {}"
+        print(line.format("count", "total", "mean", "p95", "rows", "hydration", "shape"), file=stream)
+        for s in self.get_stats(sort):
+            print(
+                line.format(
+                    s.count,
+                    "{:.2f}ms".format(s.total),
+                    "{:.2f}ms".format(s.mean),
+                    "{:.2f}ms".format(s.p95),
+                    s.rows,
+                    "{:.2f}ms".format(s.hydration),
+                    s.shape,
+                ),
+                file=stream
+            )
+            if s.call_site:
+                print("{:>58}  {}".format("", s.call_site), file=stream)
+
+    def jsonable(self, sort="total"):
+        return [s.jsonable() for s in self.get_stats(sort)]
+
+    def dump(self, sort="total", stream=None):
+        """return the json of the queries, biggest first
+
+        :param sort: str, see get_stats()
+        :param stream: io.IOBase, if passed the json is also written to it
+        :returns: str
+        """
+        ret = json.dumps(self.jsonable(sort), indent=2)
+        if stream:
+            stream.write(ret)
+        return ret
+
+
+class NPlusOne(object):
+    """A query shape that ran more times in a scope than it should have"""
+    def __init__(self, stats, query=None):
+        """
+        :param stats: QueryStats, the stats of the shape
+        :param query: query.Query, the query that crossed the threshold if it is known
+        """
+        self.stats = stats
+        self.orm_class = query.orm_class if query is not None else None
+        self.field_name = ""
+        self.ref_names = []
+        if self.orm_class:
+            schema = self.orm_class.schema
+            where = query.fields_where
+            if len(where) == 1 and where[0][0] == "is":
+                self.field_name = where[0][1]
+
+            if self.field_name == schema.pk_name:
+                self.ref_names = self.get_ref_names(schema)
+
+    @property
+    def count(self):
+        return self.stats.count
+
+    def get_ref_names(self, schema):
+        """return the names of the fields of other tables that reference schema,
+        one of these is probably what each query got the pk from"""
+        from .config import Schema # avoid a circular import
+        ret = []
+        for other in list(Schema.instances.values()):
+            if other is schema: continue
+            for field_name, field in other.fields.items():
+                if field.schema is schema:
+                    orm_class = getattr(other, "orm_class", None)
+                    ret.append("{}.{}".format(
+                        orm_class.__name__ if orm_class else other,
+                        field_name
+                    ))
+        return ret
+
+    def suggestion(self):
+        """return the batched alternative of the repeated query"""
+        verb = self.stats.shape.split(" ", 1)[0].upper()
+        if verb in set(["INSERT", "UPDATE", "DELETE"]):
+            return "wrap the loop in interface.batch() so the statements are sent together"
+
+        if self.field_name:
+            name = self.orm_class.__name__
+            if self.field_name == self.orm_class.schema.pk_name:
+                return "get all the rows with one {}.query.get_pks(pks)".format(name)
+            return "get all the rows with one {}.query.in_{}(values).get()".format(
+                name,
+                self.field_name
+            )
+
+        return "get all the rows with one query using in_FIELDNAME()"
+
+    def __str__(self):
+        lines = [
+            "N+1 query: {} ran {} times".format(self.stats.shape, self.count)
+        ]
+        if self.stats.call_site:
+            lines.append("  called from {}".format(self.stats.call_site))
+        if self.field_name:
+            field = "{}.{}".format(self.orm_class.__name__, self.field_name)
+            if self.ref_names:
+                field = "{} (referenced by {})".format(field, ", ".join(self.ref_names))
+            lines.append("  field {}".format(field))
+        lines.append("  {}".format(self.suggestion()))
+        return "\n".join(lines)
+
+
+class NPlusOneDetector(Profiler):
+    """A Profiler that flags every query shape that runs more than threshold
+    times while it is active, this is what detect_n_plus_one() returns
+
+    in warn mode an NPlusOneWarning is issued as soon as a shape crosses the
+    threshold, in raise mode an NPlusOneError with all the shapes that crossed it
+    is raised when the with block ends so a test can fail on them
+    """
+    def __init__(self, threshold=10, mode="warn", **kwargs):
+        """
+        :param threshold: int, a shape can run this many times before it is flagged
+        :param mode: str, "warn" or "raise"
+        :param **kwargs: passed to Profiler
+        """
+        if mode not in set(["warn", "raise"]):
+            raise ValueError("mode {} is not warn or raise".format(mode))
+
+        super(NPlusOneDetector, self).__init__(**kwargs)
+        self.threshold = int(threshold)
+        self.mode = mode
+        self.found = OrderedDict()
+
+    def __exit__(self, exc_type, *args):
+        super(NPlusOneDetector, self).__exit__(exc_type, *args)
+        if self.mode == "raise" and self.found and exc_type is None:
+            raise NPlusOneError(list(self.found.values()))
+
+    def __call__(self, event):
+        super(NPlusOneDetector, self).__call__(event)
+        stats = self.last
+        if stats.count > self.threshold and stats.shape not in self.found:
+            n = NPlusOne(stats, get_query())
+            self.found[stats.shape] = n
+            if self.mode == "warn":
+                warnings.warn(str(n), NPlusOneWarning)
+
+
+def detect_n_plus_one(threshold=10, mode="warn", **kwargs):
+    """flag every query shape that runs more than threshold times in the with block
+
+        with detect_n_plus_one(mode="raise"):
+            for foo in Foo.query.get():
+                Bar.query.get_pk(foo.bar_id)
+
+    :param threshold: int, see NPlusOneDetector
+    :param mode: str, "warn" or "raise"
+    :param **kwargs: passed to Profiler
+    :returns: NPlusOneDetector
+    """
+    return NPlusOneDetector(threshold=threshold, mode=mode, **kwargs)
+
+
+def profile(**kwargs):
+    """profile every query that runs in the with block
+
+        with profile() as p:
+            Foo.query.get()
+        p.report()
+
+    :param **kwargs: passed to Profiler
+    :returns: Profiler
+    """
+    return Profiler(**kwargs)
@@ -6,11 +6,19 @@ import datetime
 import logging
 from contextlib import contextmanager
 import uuid as uuidgen
+import threading
+import weakref
+import time
 
 # first party
 from ..query import Query
 from ..exception import InterfaceError
 from ..decorators import reconnecting
+from ..retry import RetryPolicy
+from ..instrument import QueryLog, PlanLog, QueryEvent, timer, get_listeners
+from ..batch import Batch, BatchStatement
+from ..cache import SchemaCache, SingleFlight
+from ..utils import get_objects
 from ..compat import *
 
 
@@ -131,6 +139,62 @@ class SQLConnection(Connection):
         cur.execute("ROLLBACK TO SAVEPOINT {}".format(name))
 
 
+class ConversionPlan(object):
+    """How the rows of one query shape (a schema and the columns the db returned)
+    are turned into python values, only the columns whose field needs a
+    conversion are in the plan so every other column is left just as the db
+    returned it
+
+    see Interface.get_conversion_plan()
+    """
+    def __init__(self, names, converters):
+        """
+        :param names: tuple, the column names of the rows in the order the db
+            returned them
+        :param converters: list, (column_name, callback) tuples, callback is
+            called with every non None value of the column
+        """
+        self.names = names
+        self.converters = converters
+
+    def __bool__(self):
+        return bool(self.converters)
+    __nonzero__ = __bool__ # py2
+
+    def convert_row(self, row):
+        """return row with the values of the plan's columns converted, the row is
+        changed in place unless the db's row can't be changed, then a dict is
+        returned"""
+        if not isinstance(row, dict):
+            row = dict(zip(self.names, row))
+
+        for name, callback in self.converters:
+            v = row[name]
+            if v is not None:
+                row[name] = callback(v)
+        return row
+
+    def convert_rows(self, rows):
+        convert_row = self.convert_row
+        return [convert_row(row) for row in rows]
+
+
+class ConvertedCursor(object):
+    """Wraps a db cursor so the rows are converted as they are iterated, this
+    is what a cursor_result query returns when its rows need converting"""
+    def __init__(self, cursor, plan):
+        self.cursor = cursor
+        self.plan = plan
+
+    def __iter__(self):
+        convert_row = self.plan.convert_row
+        for row in self.cursor:
+            yield convert_row(row)
+
+    def __getattr__(self, k):
+        return getattr(self.cursor, k)
+
+
 class Interface(object):
 
     connected = False
@@ -139,6 +203,29 @@ class Interface(object):
     connection_config = None
     """a config.Connection() instance"""
 
+    retry_policy_class = RetryPolicy
+    """the class used to create the retry_policy"""
+
+    statement_rollback = False
+    """True if a statement that fails inside a transaction only undoes itself, False
+    if the db aborts the whole transaction (see savepoint())"""
+
+    async_interface_class = ""
+    """the full class path of the aio.AsyncInterface for this db, see
+    get_async_interface()"""
+
+    async_interface = None
+
+    read_savepoint_modes = ("always", "repair", "never")
+    """how reads (and writes) inside a transaction are wrapped (see read_savepoint()),
+    set with the read_savepoints dsn option, repair is the default"""
+
+    _retry_policy = None
+
+    _query_log = None
+
+    _plan_log = None
+
     @classmethod
     def configure(cls, connection_config):
         host = connection_config.host
@@ -149,6 +236,11 @@ class Interface(object):
 
     def __init__(self, connection_config=None):
         self.connection_config = connection_config
+        self.batch_local = threading.local()
+        self.schema_cache = SchemaCache()
+        self.schema_flight = SingleFlight()
+        self.schema_rlock = threading.RLock()
+        self.conversion_plans = weakref.WeakKeyDictionary()
 
     def connect(self, connection_config=None, *args, **kwargs):
         """
@@ -176,12 +268,143 @@ class Interface(object):
 
     def _connect(self, connection_config): raise NotImplementedError()
 
+    @property
+    def retry_policy(self):
+        """the retry.RetryPolicy the reconnecting methods use, created from the
+        connection_config options the first time it is needed"""
+        if self._retry_policy is None:
+            self._retry_policy = self.retry_policy_class.create(self.connection_config)
+        return self._retry_policy
+
+    @retry_policy.setter
+    def retry_policy(self, retry_policy):
+        self._retry_policy = retry_policy
+
+    @property
+    def query_log(self):
+        """the instrument.QueryLog every statement's QueryEvent goes through, created
+        from the connection_config options the first time it is needed"""
+        if self._query_log is None:
+            self._query_log = QueryLog.create(self.connection_config)
+        return self._query_log
+
+    @query_log.setter
+    def query_log(self, query_log):
+        self._query_log = query_log
+
+    @property
+    def plan_log(self):
+        """the instrument.PlanLog that keeps the plans of slow queries, created from
+        the connection_config options the first time it is needed"""
+        if self._plan_log is None:
+            self._plan_log = PlanLog.create(self.connection_config)
+        return self._plan_log
+
+    @plan_log.setter
+    def plan_log(self, plan_log):
+        self._plan_log = plan_log
+
+    def start_query(self):
+        """return when a statement started, this is only timed if something will
+        see the statement's QueryEvent
+
+        :returns: float, the instrument.timer() if the query log or the plan log
+            is enabled or a listener (eg, a profiler) is active, 0.0 otherwise
+        """
+        if self.query_log.is_enabled() or self.plan_log.is_enabled() or get_listeners():
+            return timer()
+        return 0.0
+
+    def log_query(self, connection, query_str, query_args, start, rows=None, error=None):
+        """give the QueryEvent of a statement that ran to the query log and the
+        active listeners, this is only called if start_query() returned a start
+
+        :param connection: the connection the statement ran on
+        :param query_str: str
+        :param query_args: list
+        :param start: float, the instrument.timer() when the statement started
+        :param rows: int, how many rows were returned or changed
+        :param error: Exception, what the statement raised
+        :returns: QueryEvent
+        """
+        duration = timer() - start
+        event = QueryEvent(
+            self.connection_config.interface_name,
+            query_str,
+            query_args,
+            start=time.time() - duration,
+            duration=duration * 1000.0,
+            rows=rows,
+            connection_id=id(connection),
+            in_transaction=connection.in_transaction(),
+            error=error,
+        )
+        for listener in get_listeners():
+            listener(event)
+
+        if self.query_log.is_enabled():
+            self.query_log(event)
+        return event
+
+    def capture_plan(self, connection, event):
+        """EXPLAIN the query of event and add the plan to the plan log, a plan that
+        can't be captured is only logged since the query itself succeeded
+
+        :param connection: the connection the query ran on
+        :param event: QueryEvent, the slow query
+        """
+        try:
+            with self.savepoint(connection) as connection:
+                plan = self.explain_query(
+                    event.query_str,
+                    *(event.query_args or ()),
+                    connection=connection
+                )
+
+        except Exception as e:
+            self.log(e)
+
+        else:
+            self.plan_log.add(event, plan)
+
+    def is_retryable_error(self, e):
+        """return True if the call that raised e can be tried again, this should
+        only be True for errors that are caused by the connection or by the db
+        being unavailable, not by the query
+
+        :param e: InterfaceError, the raised error, e.e is the driver's error
+        :returns: bool
+        """
+        e_msg = str(e.e)
+        return "closed" in e_msg.lower()
+
     def free_connection(self, connection): pass
 
-    def get_connection(self): raise NotImplementedError()
+    def get_connection(self, readonly=False):
+        """return a connection to the db
+
+        :param readonly: bool, a hint that the connection will only be used to
+            read, interfaces that have connections just for reading can use it
+        """
+        raise NotImplementedError()
 
     def is_connected(self): return self.connected
 
+    def get_async_interface(self):
+        """return the aio.AsyncInterface that makes the same calls as this interface
+        but with asyncio, it is created the first time it is needed
+
+        :returns: aio.AsyncInterface
+        """
+        if self.async_interface is None:
+            if not self.async_interface_class:
+                raise ValueError("{} has no async interface".format(type(self).__name__))
+
+            _, interface_class = get_objects(self.async_interface_class)
+            self.async_interface = interface_class(self)
+
+        return self.async_interface
+
     @contextmanager
     def connection(self, connection=None, **kwargs):
         try:
@@ -193,7 +416,7 @@ class Interface(object):
                 # connection fails to be created then free_connection() will fail
                 # which would then cover up the real error, so don't think to 
                 # yourself you can move it back into try/finally
-                connection = self.get_connection()
+                connection = self.get_connection(readonly=kwargs.get("readonly", False))
                 try:
                     yield connection
 
@@ -252,6 +475,131 @@ class Interface(object):
                 connection.transaction_fail(name)
                 self.raise_error(e)
 
+    @contextmanager
+    def savepoint(self, connection=None, **kwargs):
+        """
+        wrap a single statement so it can fail without taking the transaction the
+        connection is in down with it, this is what lets handle_error() fix the
+        problem and run the statement again
+
+        the connections are autocommit so a statement that isn't in a transaction
+        can't hurt anything when it fails, and neither can one on a db that only
+        undoes the failed statement (see statement_rollback), so a SAVEPOINT is
+        only sent when the connection is in a transaction the failure would abort
+
+        example --
+            with self.savepoint(**kwargs) as connection:
+                # run one statement
+        """
+        with self.connection(connection, **kwargs) as connection:
+            if connection.in_transaction() and not self.statement_rollback:
+                with self.transaction(connection):
+                    yield connection
+
+            else:
+                yield connection
+
+    @contextmanager
+    def batch(self, **kwargs):
+        """
+        queue the inserts, updates and deletes of the current thread until the
+        with block ends and then write them all in one transaction, sending writes
+        with the same SQL to the db together
+
+        while the batch is active insert(), update() and delete() return
+        batch.BatchResult instances that get their values (eg, the primary key)
+        when the batch is flushed, if the block raises an error nothing is written
+
+        reads aren't queued and the queued writes aren't sent until the block
+        ends, so a read inside the block doesn't see the writes queued before it
+
+        example --
+            with interface.batch():
+                pk = interface.insert(schema, {"foo": 1})
+            pk.result() # the new primary key
+
+        a batch inside another batch is the same batch
+        """
+        batch = self.get_batch()
+        if batch is not None:
+            yield batch
+
+        else:
+            batch = Batch(self, **kwargs)
+            self.batch_local.batch = batch
+            try:
+                yield batch
+
+            except Exception:
+                batch.discard()
+                raise
+
+            else:
+                batch.flush()
+
+            finally:
+                self.batch_local.batch = None
+
+    def get_batch(self):
+        """return the active batch.Batch of the current thread, None if there isn't one"""
+        return getattr(self.batch_local, "batch", None)
+
+    def batch_statement(self, method_name, schema, fields, query=None, options=None):
+        """return a batch.BatchStatement for the write, this is called when the
+        write is queued
+
+        :param options: dict, the query options (eg, timeout) of the write
+        """
+        raise NotImplementedError()
+
+    @reconnecting()
+    def flush_batch(self, statements, **kwargs):
+        """write all the statements in one transaction
+
+        :param statements: list, batch.BatchStatement instances
+        :returns: list, the value of each statement (eg, the pk of an insert, an
+            update's value can be None if the rows changed aren't known)
+        """
+        ret = []
+        with self.transaction(**kwargs) as connection:
+            kwargs['connection'] = connection
+            start = 0
+            while start < len(statements):
+                # consecutive statements with the same SQL and options are sent
+                # together
+                stop = start + 1
+                while stop < len(statements) and statements[stop].can_send_with(statements[start]):
+                    stop += 1
+
+                group = statements[start:stop]
+                values = self._write(
+                    lambda schema, **kwargs: self._flush_batch(group, **kwargs),
+                    group[0].schema,
+                    **dict(kwargs, **group[0].options)
+                )
+                ret.extend(values)
+                start = stop
+
+        return ret
+
+    def _flush_batch(self, statements, **kwargs):
+        """write statements that all have the same SQL and options, by default
+        this just runs them one at a time
+
+        :param **kwargs: these have the options (eg, timeout) of the statements
+
+        :returns: list, the value of each statement
+        """
+        ret = []
+        for statement in statements:
+            if statement.method_name == "insert":
+                ret.append(self._insert(statement.schema, statement.fields, **kwargs))
+            elif statement.method_name == "delete":
+                ret.append(self._delete(statement.schema, statement.query, **kwargs))
+            else:
+                ret.append(self._update(statement.schema, statement.fields, statement.query, **kwargs))
+        return ret
+
     def set_table(self, schema, **kwargs):
         """
         add the table to the db
@@ -275,6 +623,8 @@ class Interface(object):
                             **index.options
                         )
 
+                self.schema_cache.add_fields(schema, schema.fields.keys())
+
             except InterfaceError:
                 # check to see if this table now exists, it might have been created
                 # in another thread
@@ -320,6 +670,7 @@ class Interface(object):
             with self.transaction(**kwargs):
                 self._delete_table(schema, **kwargs)
 
+        self.schema_cache.discard(schema)
         return True
 
     def _delete_table(self, schema): raise NotImplementedError()
@@ -339,6 +690,8 @@ class Interface(object):
             kwargs['connection'] = connection
             self._delete_tables(**kwargs)
 
+        self.schema_cache.clear()
+
     def _delete_tables(self, **kwargs): raise NotImplementedError()
 
     def get_fields(self, table_name, **kwargs):
@@ -388,24 +741,14 @@ class Interface(object):
         schema -- Schema()
         fields -- dict -- the values to persist
 
-        return -- int -- the primary key of the row just inserted
+        return -- int -- the primary key of the row just inserted, or a
+            batch.BatchResult if a batch is active (see batch())
         """
-        r = 0
-
-        with self.connection(**kwargs) as connection:
-            kwargs['connection'] = connection
-            try:
-                with self.transaction(**kwargs):
-                    r = self._insert(schema, fields, **kwargs)
+        batch = self.get_batch()
+        if batch is not None:
+            return batch.add("insert", schema, fields, **kwargs)
 
-            except Exception as e:
-                exc_info = sys.exc_info()
-                if self.handle_error(schema, e, **kwargs):
-                    r = self._insert(schema, fields, **kwargs)
-                else:
-                    self.raise_error(e, exc_info)
-
-        return r
+        return self._write(self._insert, schema, fields, **kwargs)
 
     def _insert(self, schema, fields, **kwargs): raise NotImplementedError()
 
@@ -418,24 +761,46 @@ class Interface(object):
         fields -- dict -- the values to persist
         query -- Query() -- will be used to create the where clause
 
-        return -- int -- how many rows where updated
+        return -- int -- how many rows where updated, or a batch.BatchResult if a
+            batch is active (see batch()), the result of a batched update might be
+            None if the db can't say how many rows each statement changed
         """
+        batch = self.get_batch()
+        if batch is not None:
+            return batch.add("update", schema, fields, query, **kwargs)
+
+        return self._write(self._update, schema, fields, query, **kwargs)
+
+    def _update(self, schema, fields, query, **kwargs): raise NotImplementedError()
+
+    def _write(self, callback, schema, *args, **kwargs):
+        """the write version of _get_query(), callback is ran again if it failed
+        because of a problem handle_error() could fix"""
         with self.connection(**kwargs) as connection:
             kwargs['connection'] = connection
+            savepoint = self.write_savepoint(schema, **kwargs)
             try:
-                with self.transaction(**kwargs):
-                    r = self._update(schema, fields, query, **kwargs)
+                if savepoint:
+                    with self.transaction(**kwargs):
+                        ret = callback(schema, *args, **kwargs)
+
+                else:
+                    ret = callback(schema, *args, **kwargs)
 
             except Exception as e:
                 exc_info = sys.exc_info()
+                if not savepoint and connection.in_transaction() and not self.statement_rollback:
+                    # the failure aborted the transaction so there is no fixing it,
+                    # the schema cache might be wrong about something so load it again
+                    self.schema_cache.clear()
+                    self.raise_error(e, exc_info)
+
                 if self.handle_error(schema, e, **kwargs):
-                    r = self._update(schema, fields, query, **kwargs)
+                    ret = callback(schema, *args, **kwargs)
                 else:
                     self.raise_error(e, exc_info)
 
-        return r
-
-    def _update(self, schema, fields, query, **kwargs): raise NotImplementedError()
+        return ret
 
     @reconnecting()
     def _get_query(self, callback, schema, query=None, *args, **kwargs):
@@ -444,10 +809,12 @@ class Interface(object):
         if not query: query = Query()
 
         ret = None
+        kwargs.setdefault("readonly", True)
         with self.connection(**kwargs) as connection:
             kwargs['connection'] = connection
+            savepoint = self.read_savepoint(schema, **kwargs)
             try:
-                if connection.in_transaction():
+                if savepoint:
                     # we wrap SELECT queries in a transaction if we are in a transaction because
                     # it could cause data loss if it failed by causing the db to discard
                     # anything in the current transaction if the query isn't wrapped,
@@ -460,6 +827,12 @@ class Interface(object):
 
             except Exception as e:
                 exc_info = sys.exc_info()
+                if not savepoint and connection.in_transaction() and not self.statement_rollback:
+                    # the failure aborted the transaction so there is no fixing it,
+                    # the schema cache is wrong about something so load it again
+                    self.schema_cache.clear()
+                    self.raise_error(e, exc_info)
+
                 if self.handle_error(schema, e, **kwargs):
                     ret = callback(schema, query, *args, **kwargs)
                 else:
@@ -467,6 +840,85 @@ class Interface(object):
 
         return ret
 
+    def read_savepoint(self, schema, connection, **kwargs):
+        """
+        return True if a read on schema should be wrapped in a savepoint, reads
+        outside of a transaction never need one (see savepoint())
+
+        the read_savepoints dsn option picks the strategy --
+            always -- every read in a transaction gets a savepoint
+            repair -- only reads that handle_error() might need to fix get one, once
+                the table has been found to have every field of schema its reads
+                go straight to the db
+            never -- reads are never wrapped, if one fails the transaction fails
+
+        schema -- Schema()
+        connection -- the connection the read will run on
+        return -- boolean
+        """
+        options = self.connection_config.options if self.connection_config else {}
+        mode = options.get("read_savepoints", "repair")
+        if mode not in self.read_savepoint_modes:
+            raise ValueError("read_savepoints must be one of {}, not {}".format(
+                ", ".join(self.read_savepoint_modes),
+                mode
+            ))
+
+        if not connection.in_transaction() or self.statement_rollback:
+            return False
+
+        if mode == "repair":
+            return not self.is_checked_table(schema, connection=connection)
+
+        return mode == "always"
+
+    def write_savepoint(self, schema, connection, **kwargs):
+        """
+        return True if a write on schema should be wrapped in a savepoint, writes
+        follow the same rules (and the same read_savepoints dsn option) as reads,
+        so with the default repair strategy a write in a transaction only gets a
+        savepoint until the table is known to have every field of schema
+
+        schema -- Schema()
+        connection -- the connection the write will run on
+        return -- boolean
+        """
+        return self.read_savepoint(schema, connection, **kwargs)
+
+    def is_checked_table(self, schema, **kwargs):
+        """
+        return True if the table of schema exists and has all the fields of schema,
+        this is answered by the schema cache so the catalog is only asked once
+
+        schema -- Schema()
+        return -- boolean
+        """
+        return self.get_schema_cache(**kwargs).has_fields(schema)
+
+    def get_schema_cache(self, **kwargs):
+        """return the cache of the tables and columns in the db, it is loaded if
+        this is the first time it is needed
+
+        return -- cache.SchemaCache
+        """
+        if not self.schema_cache.loaded():
+            self.load_schema_cache(**kwargs)
+        return self.schema_cache
+
+    def load_schema_cache(self, **kwargs):
+        """fill the schema cache with every table and column in the db using one
+        catalog query"""
+        with self.connection(**kwargs) as connection:
+            kwargs['connection'] = connection
+            self.schema_cache.set_tables(self._get_catalog(**kwargs))
+
+    def _get_catalog(self, **kwargs):
+        """return every table and its columns
+
+        return -- dict -- table name keys with a list of column names values
+        """
+        raise NotImplementedError()
+
     def get_one(self, schema, query=None, **kwargs):
         """
         get one row from the db matching filters set in query
@@ -477,7 +929,10 @@ class Interface(object):
         return -- dict -- the matching row
         """
         ret = self._get_query(self._get_one, schema, query, **kwargs)
-        if not ret: ret = {}
+        if ret:
+            ret = self.convert_row(schema, ret)
+        else:
+            ret = {}
         return ret
 
     def _get_one(self, schema, query, **kwargs): raise NotImplementedError()
@@ -492,26 +947,115 @@ class Interface(object):
         return -- list -- a list of matching dicts
         """
         ret = self._get_query(self._get, schema, query, **kwargs)
-        if not ret: ret = []
+        if kwargs.get("cursor_result", False):
+            ret = self.convert_cursor(schema, ret)
+        elif ret:
+            ret = self.convert_rows(schema, ret)
+        else:
+            ret = []
         return ret
 
     def _get(self, schema, query, **kwargs): raise NotImplementedError()
 
+    def get_converter(self, field):
+        """return the callback that turns a value of field's column, as the db
+        returned it, into the python value, this is where each interface puts
+        the conversions its driver doesn't do
+
+        :param field: config.Field
+        :returns: callable|None, None if the db's values don't need converting
+        """
+        return None
+
+    def get_conversion_plan(self, schema, names):
+        """return the plan that converts the rows of schema that have the columns
+        names, the plan is only built the first time a query shape is seen
+
+        :param schema: config.Schema
+        :param names: tuple, the column names of the rows in the order the db
+            returned them
+        :returns: ConversionPlan
+        """
+        plans = self.conversion_plans.get(schema)
+        if plans is None:
+            plans = self.conversion_plans.setdefault(schema, {})
+
+        plan = plans.get(names)
+        if plan is None:
+            converters = []
+            for name in names:
+                field = schema.fields.get(name)
+                if field:
+                    callback = self.get_converter(field)
+                    if callback:
+                        converters.append((name, callback))
+
+            plan = ConversionPlan(names, converters)
+            plans[names] = plan
+
+        return plan
+
+    def convert_row(self, schema, row):
+        plan = self.get_conversion_plan(schema, tuple(row.keys()))
+        return plan.convert_row(row) if plan else row
+
+    def convert_rows(self, schema, rows):
+        plan = self.get_conversion_plan(schema, tuple(rows[0].keys()))
+        return plan.convert_rows(rows) if plan else rows
+
+    def convert_cursor(self, schema, cursor):
+        if cursor.description:
+            names = tuple(d[0] for d in cursor.description)
+            plan = self.get_conversion_plan(schema, names)
+            if plan:
+                cursor = ConvertedCursor(cursor, plan)
+        return cursor
+
     def count(self, schema, query=None, **kwargs):
         ret = self._get_query(self._count, schema, query, **kwargs)
         return int(ret)
 
     def _count(self, schema, query, **kwargs): raise NotImplementedError()
 
+    def explain(self, schema, query=None, analyze=False, **kwargs):
+        """return how the db will run the get query of query
+
+        schema -- Schema()
+        query -- Query()
+        analyze -- boolean -- True to also run the query and include what actually
+            happened, only some dbs support this
+
+        return -- list -- the plan, its format depends on the db
+        """
+        return self._get_query(self._explain, schema, query, analyze, **kwargs)
+
+    def _explain(self, schema, query, analyze=False, **kwargs): raise NotImplementedError()
+
+    def explain_query(self, query_str, *query_args, **query_options):
+        """return the plan of a raw query, this takes the same arguments as query()
+        and also an analyze=True query option
+
+        return -- list -- the plan, its format depends on the db
+        """
+        raise NotImplementedError()
+
     def delete(self, schema, query, **kwargs):
+        """
+        remove the rows that match query
+
+        return -- int -- how many rows were deleted, or a batch.BatchResult if a
+            batch is active (see batch())
+        """
         if not query or not query.fields_where:
             raise ValueError('aborting delete because there is no where clause')
 
-        with self.transaction(**kwargs) as connection:
-            kwargs['connection'] = connection
-            ret = self._get_query(self._delete, schema, query, **kwargs)
+        batch = self.get_batch()
+        if batch is not None:
+            return batch.add("delete", schema, {}, query, **kwargs)
 
-        return ret
+        # _get_query() already wraps the DELETE in a savepoint when it needs one
+        kwargs.setdefault("readonly", False)
+        return self._get_query(self._delete, schema, query, **kwargs)
 
     def _delete(self, schema, query, **kwargs): raise NotImplementedError()
 
@@ -587,14 +1131,22 @@ class SQLInterface(Interface):
         return True
 
     def _delete(self, schema, query, **kwargs):
+        query_str, query_args = self._delete_SQL(schema, query)
+        ret = self.query(query_str, *query_args, count_result=True, **kwargs)
+        return ret
+
+    def _delete_SQL(self, schema, query):
+        """return the SQL to delete the rows matching query
+
+        :returns: tuple, (query_str, query_args)
+        """
         where_query_str, query_args = self.get_SQL(schema, query, only_where_clause=True)
         query_str = []
         query_str.append('DELETE FROM')
         query_str.append('  {}'.format(schema))
         query_str.append(where_query_str)
         query_str = os.linesep.join(query_str)
-        ret = self.query(query_str, *query_args, count_result=True, **kwargs)
-        return ret
+        return query_str, query_args
 
     def _query(self, query_str, query_args=None, **query_options):
         """
@@ -602,6 +1154,8 @@ class SQLInterface(Interface):
             ignore_result -- boolean -- true to not attempt to fetch results
             fetchone -- boolean -- true to only fetch one result
             count_result -- boolean -- true to return the int count of rows affected
+            timeout -- int -- stop the query if it runs longer than this many milliseconds
+            settings -- dict -- db settings for just this query, see query_settings()
         """
         ret = True
         # http://stackoverflow.com/questions/6739355/dictcursor-doesnt-seem-to-work-under-psycopg2
@@ -613,31 +1167,57 @@ class SQLInterface(Interface):
             one_result = query_options.get('fetchone', query_options.get('one_result', False))
             cursor_result = query_options.get('cursor_result', False)
 
-            try:
-                if query_args:
-                    self.log("{}{}{}", query_str, os.linesep, query_args)
-                    cur.execute(query_str, query_args)
-                else:
-                    self.log(query_str)
-                    cur.execute(query_str)
-
-                if cursor_result:
-                    ret = cur
+            timeout = query_options.get('timeout', None)
+            settings = query_options.get('settings', None)
 
-                elif not ignore_result:
-                    if one_result:
-                        ret = self._normalize_result_dict(cur.fetchone())
-                    elif count_result:
-                        ret = cur.rowcount
+            start = self.start_query()
+            rows = error = None
+            try:
+                with self.query_settings(connection, timeout, settings):
+                    if query_args:
+                        cur.execute(query_str, query_args)
                     else:
-                        ret = self._normalize_result_list(cur.fetchall())
+                        cur.execute(query_str)
+
+                    # the results are fetched in here also since a db like SQLite
+                    # does most of the work of a query as the rows are fetched
+                    if cursor_result:
+                        ret = cur
+
+                    elif not ignore_result:
+                        if one_result:
+                            ret = self._normalize_result_dict(cur.fetchone())
+                            rows = 1 if ret else 0
+                        elif count_result:
+                            ret = rows = cur.rowcount
+                        else:
+                            ret = self._normalize_result_list(cur.fetchall())
+                            rows = len(ret)
 
             except Exception as e:
+                error = e
                 self.log(e)
                 raise
 
+            finally:
+                if start:
+                    event = self.log_query(connection, query_str, query_args, start, rows, error)
+                    if self.plan_log.should_explain(event):
+                        self.capture_plan(connection, event)
+
             return ret
 
+    @contextmanager
+    def query_settings(self, connection, timeout=None, settings=None):
+        """a context manager that a query runs inside of, it applies timeout and
+        settings while the query runs
+
+        :param connection: the connection the query is about to run on
+        :param timeout: int, milliseconds
+        :param settings: dict, interface specific settings names and values
+        """
+        yield connection
+
     def _normalize_result_dict(self, row):
         return row
 
@@ -843,36 +1423,125 @@ class SQLInterface(Interface):
                 ret = self._handle_error(schema, e, **kwargs)
 
         else:
-            # we are unsure of the state of everything since this connection has
-            # closed, go ahead and close out this interface and allow this query
+            # this connection has closed, so get rid of it and allow this query
             # to fail, but subsequent queries should succeed
-            self.close()
+            self.discard_connection(connection)
             ret = True
 
         return ret
 
+    def discard_connection(self, connection):
+        """connection has been found to be closed, by default we are unsure of the
+        state of everything so the whole interface is closed, an interface with a
+        connection pool only needs to get rid of connection"""
+        self.close()
+
     def _handle_error(self, schema, e, **kwargs): raise NotImplemented()
 
+    @contextmanager
+    def schema_lock(self, **kwargs):
+        """
+        start a transaction that holds a lock so only one worker at a time changes
+        the schema, by default this only stops the other threads of the process,
+        the interfaces lock out other processes too
+
+        example --
+            with self.schema_lock(**kwargs) as connection:
+                # add the missing tables and columns
+        """
+        with self.schema_rlock:
+            with self.transaction(**kwargs) as connection:
+                yield connection
+
+    def repair_schema(self, callback, schema, **kwargs):
+        """
+        run callback(schema, **kwargs) to add whatever schema needs that is missing
+        from the db
+
+        when a new table or column is deployed lots of workers can hit the error at
+        the same time, so the threads of this process that need the same repair
+        wait for the one that is running it and use its result, and the repair
+        runs in schema_lock() after loading the schema cache again, so a worker that
+        had to wait for the lock finds the repair was already made and callback
+        has nothing to do, either way the workers just run their query again
+
+        callback -- callable -- eg, _set_missing_tables
+        schema -- Schema()
+        return -- mixed -- whatever callback returns
+        """
+        connection = kwargs.get('connection', None)
+        if connection is not None and connection.in_transaction():
+            # the repair will be part of the transaction, the other threads won't
+            # see it until the transaction is committed so they can't wait for it
+            return self._repair_schema(callback, schema, **kwargs)
+
+        key = (callback.__name__, str(schema))
+        ret, shared = self.schema_flight.do(key, self._repair_schema, callback, schema, **kwargs)
+        if shared:
+            self.log("Used the {} repair of another thread for {}", callback.__name__, schema)
+        return ret
+
+    def _repair_schema(self, callback, schema, **kwargs):
+        with self.schema_lock(**kwargs) as connection:
+            kwargs['connection'] = connection
+            self.load_schema_cache(**kwargs)
+            return callback(schema, **kwargs)
+
     def _set_all_tables(self, schema, **kwargs):
         """
         You can run into a problem when you are trying to set a table and it has a 
         foreign key to a table that doesn't exist, so this method will go through 
         all fk refs and make sure the tables exist
         """
-        with self.transaction(**kwargs) as connection:
-            kwargs['connection'] = connection
-            # go through and make sure all foreign key referenced tables exist
-            for field_name, field_val in schema.fields.items():
-                s = field_val.schema
-                if s:
-                    self._set_all_tables(s, **kwargs)
+        return self.repair_schema(self._set_missing_tables, schema, **kwargs)
 
-            # now that we know all fk tables exist, create this table
+    def _set_missing_tables(self, schema, **kwargs):
+        # go through and make sure all foreign key referenced tables exist
+        for field_name, field_val in schema.fields.items():
+            s = field_val.schema
+            if s:
+                self._set_missing_tables(s, **kwargs)
+
+        # now that we know all fk tables exist, create this table
+        if not self.schema_cache.has_table(schema):
             self.set_table(schema, **kwargs)
 
         return True
 
-    def _update(self, schema, fields, query, **kwargs):
+    def batch_statement(self, method_name, schema, fields, query=None, options=None):
+        if method_name == "insert":
+            query_str, query_args = self._insert_SQL(schema, fields)
+        elif method_name == "delete":
+            query_str, query_args = self._delete_SQL(schema, query)
+        else:
+            query_str, query_args = self._update_SQL(schema, fields, query)
+        return BatchStatement(method_name, schema, fields, query, query_str, query_args, options)
+
+    def _insert_SQL(self, schema, fields):
+        """return the SQL to insert fields into the schema's table
+
+        :returns: tuple, (query_str, query_args)
+        """
+        field_formats = []
+        field_names = []
+        query_args = []
+        for field_name, field_val in fields.items():
+            field_names.append(self._normalize_name(field_name))
+            field_formats.append(self.val_placeholder)
+            query_args.append(field_val)
+
+        query_str = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            self._normalize_table_name(schema),
+            ', '.join(field_names),
+            ', '.join(field_formats)
+        )
+        return query_str, query_args
+
+    def _update_SQL(self, schema, fields, query):
+        """return the SQL to update the fields of the rows matching query
+
+        :returns: tuple, (query_str, query_args)
+        """
         where_query_str, where_query_args = self.get_SQL(schema, query, only_where_clause=True)
         query_str = 'UPDATE {} SET {} {}'
         query_args = []
@@ -888,7 +1557,10 @@ class SQLInterface(Interface):
             where_query_str
         )
         query_args.extend(where_query_args)
+        return query_str, query_args
 
+    def _update(self, schema, fields, query, **kwargs):
+        query_str, query_args = self._update_SQL(schema, fields, query)
         return self.query(query_str, *query_args, count_result=True, **kwargs)
 
     def _get_one(self, schema, query, **kwargs):
@@ -899,6 +1571,10 @@ class SQLInterface(Interface):
         query_str, query_args = self.get_SQL(schema, query)
         return self.query(query_str, *query_args, **kwargs)
 
+    def _explain(self, schema, query, analyze=False, **kwargs):
+        query_str, query_args = self.get_SQL(schema, query)
+        return self.explain_query(query_str, *query_args, analyze=analyze, **kwargs)
+
     def _count(self, schema, query, **kwargs):
         query_str, query_args = self.get_SQL(schema, query, count_query=True)
         ret = self.query(query_str, *query_args, **kwargs)
@@ -915,7 +1591,13 @@ class SQLInterface(Interface):
         the reason they have to be NULL is adding fields to Postgres that can be NULL
         is really light, but if they have a default value, then it can be costly
         """
-        current_fields = self.get_fields(schema, **kwargs)
+        return self.repair_schema(self._set_missing_fields, schema, **kwargs)
+
+    def _set_missing_fields(self, schema, **kwargs):
+        current_fields = self.schema_cache.get_fields(schema)
+        if current_fields is None:
+            return self._set_missing_tables(schema, **kwargs)
+
         for field_name, field in schema.fields.items():
             if field_name not in current_fields:
                 if field.required:
@@ -929,6 +1611,7 @@ class SQLInterface(Interface):
                     query_str.append('  {}'.format(self.get_field_SQL(field_name, field)))
                     query_str = os.linesep.join(query_str)
                     self.query(query_str, ignore_result=True, **kwargs)
+                    self.schema_cache.add_fields(schema, [field_name])
 
         return True
 
@@ -9,19 +9,25 @@ http://pythonhosted.org/psycopg2/
 from __future__ import unicode_literals, division, print_function, absolute_import
 import os
 import sys
+import json
 import decimal
 import datetime
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
 
 # third party
 import psycopg2
 import psycopg2.extras
 import psycopg2.extensions
+from psycopg2.pool import PoolError
 
 # first party
 from .base import SQLInterface, SQLConnection
 from ..compat import *
 from ..utils import get_objects
-from ..exception import UniqueError
+from ..exception import UniqueError, CancelError
 
 
 # class LoggingCursor(psycopg2.extras.RealDictCursor):
@@ -31,6 +37,29 @@ from ..exception import UniqueError
 #         #psycopg2.extensions.cursor.execute(self, sql, args)
 
 
+def register_types(connection):
+    """set up the type conversions every connection (sync or async) needs"""
+    if is_py2:
+        # unicode harden for python 2
+        # http://initd.org/psycopg/docs/usage.html#unicode-handling
+        psycopg2.extensions.register_type(psycopg2.extensions.UNICODE, connection)
+        psycopg2.extensions.register_type(psycopg2.extensions.UNICODEARRAY, connection)
+
+
+def normalize_str(v):
+    """bytes saved to a text column come back as their hex bytea string (eg,
+    \\x6869), this turns them back into the string they were"""
+    if v.startswith("\\x"):
+        try:
+            v = bytearray.fromhex(v[2:]).decode("utf-8")
+
+        except ValueError:
+            # it really was a string that started with \x
+            pass
+
+    return v
+
+
 #class Connection(psycopg2.extensions.connection, SQLConnection):
 class Connection(SQLConnection, psycopg2.extensions.connection):
 #class Connection(SQLConnection, psycopg2.extras.LoggingConnection):
@@ -44,27 +73,7 @@ class Connection(SQLConnection, psycopg2.extensions.connection):
         # http://initd.org/psycopg/docs/connection.html#connection.autocommit
         self.autocommit = True
 
-        if is_py2:
-            # unicode harden for python 2
-            # http://initd.org/psycopg/docs/usage.html#unicode-handling
-            psycopg2.extensions.register_type(psycopg2.extensions.UNICODE, self)
-            psycopg2.extensions.register_type(psycopg2.extensions.UNICODEARRAY, self)
-
-        else:
-            def normalize_str(v, cur):
-                if isinstance(v, str) and v.startswith("\\x"):
-                    buf = psycopg2.BINARY(v, cur)
-                    v = bytes(buf).decode(cur.connection.encoding)
-
-                    #import binascii
-                    #pout.v(binascii.unhexlify(v[2:]))
-                    #v = v.encode(cur.connection.encoding)
-                    #v = bytes(v, encoding=cur.connection.encoding)
-                return v
-            psycopg2.extensions.register_type(
-                psycopg2.extensions.new_type(psycopg2.STRING.values, "STRING", normalize_str)
-            )
-
+        register_types(self)
 
         # http://initd.org/psycopg/docs/connection.html#connection.set_client_encoding
         # https://www.postgresql.org/docs/current/static/multibyte.html
@@ -76,13 +85,262 @@ class Connection(SQLConnection, psycopg2.extensions.connection):
         #self.initialize(logger)
 
 
+class ConnectionPool(object):
+    """A thread safe pool of connections
+
+    connections are created as they are needed up to maxconn, after that getconn()
+    will wait up to timeout seconds for a connection to be returned to the pool
+
+    this has the same interface as the psycopg2.pool classes
+
+    https://github.com/psycopg/psycopg2/blob/master/lib/pool.py
+    """
+    def __init__(self, minconn, maxconn, timeout=30.0, lifetime=0.0, idle=0.0, ping=False, **kwargs):
+        """
+        :param minconn: int, how many connections to keep around even when idle
+        :param maxconn: int, the most connections that can be open at one time
+        :param timeout: float, how long getconn() will wait for a connection before
+            raising a PoolError
+        :param lifetime: float, connections older than this many seconds are closed
+            when they are returned to the pool, 0 to never close them
+        :param idle: float, connections (over minconn) that have not been used for
+            this many seconds are closed, 0 to never close them
+        :param ping: bool, True to make sure a connection works (by running a query)
+            before it is handed out
+        :param **kwargs: passed to psycopg2.connect()
+        """
+        self.minconn = int(minconn)
+        self.maxconn = max(int(maxconn), self.minconn, 1)
+        self.timeout = float(timeout)
+        self.lifetime = float(lifetime)
+        self.idle_timeout = float(idle)
+        self.ping = ping
+        self.closed = False
+
+        self._kwargs = kwargs
+        self._cond = self.create_condition()
+        self._idle = deque() # (connection, last used timestamp), most recent on the right
+        self._created = {} # id(connection) -> created timestamp
+        self._conns = {} # id(connection) -> connection, idle and checked out
+        self.size = 0
+
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.discarded = 0
+
+        for i in range(self.minconn):
+            self.size += 1
+            self.putconn(self._connect())
+
+    def create_condition(self):
+        """return the condition that guards the pool and that getconn() waits on"""
+        return threading.Condition(threading.Lock())
+
+    def _connect(self):
+        """create a connection, self.size should already have been incremented"""
+        try:
+            conn = psycopg2.connect(**self._kwargs)
+
+        except:
+            with self._cond:
+                self.size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self.created += 1
+            self._created[id(conn)] = time.time()
+            self._conns[id(conn)] = conn
+        return conn
+
+    def _discard(self, conn):
+        """close conn and free its spot in the pool, this should be called while
+        holding the lock, a connection closeall() already discarded only gets
+        closed"""
+        if self._conns.pop(id(conn), None) is not None:
+            self.size -= 1
+            self.discarded += 1
+            self._created.pop(id(conn), None)
+
+        try:
+            conn.close()
+
+        except Exception:
+            pass
+
+        self._cond.notify()
+
+    def _is_expired(self, conn, now):
+        if conn.closed: return True
+        if self.lifetime:
+            return (now - self._created.get(id(conn), now)) > self.lifetime
+        return False
+
+    def _is_usable(self, conn):
+        """return True if conn can talk to the db"""
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            return True
+
+        except psycopg2.Error:
+            return False
+
+    def _reap(self, now):
+        """close the connections that have been idle for too long, this should be
+        called while holding the lock"""
+        if self.idle_timeout:
+            while self._idle and self.size > self.minconn:
+                conn, last_used = self._idle[0]
+                if (now - last_used) <= self.idle_timeout: break
+                self._idle.popleft()
+                self._discard(conn)
+
+    def reap(self):
+        """close the idle connections that are past their lifetime or that have
+        been idle for too long, this happens whenever a connection is returned but
+        a quiet pool can call this to close them"""
+        with self._cond:
+            now = time.time()
+            if self.lifetime:
+                for item in list(self._idle):
+                    if self._is_expired(item[0], now):
+                        self._idle.remove(item)
+                        self._discard(item[0])
+
+            self._reap(now)
+
+    def getconn(self, key=None):
+        start = time.time()
+        deadline = start + self.timeout
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                while True:
+                    if self.closed: raise PoolError("connection pool is closed")
+
+                    now = time.time()
+                    while self._idle:
+                        conn, last_used = self._idle.pop()
+                        if self._is_expired(conn, now):
+                            self._discard(conn)
+                            conn = None
+                        else:
+                            break
+
+                    if conn is not None: break
+
+                    if self.size < self.maxconn:
+                        self.size += 1
+                        create = True
+                        break
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolError("timed out after {} seconds waiting for a connection".format(
+                            self.timeout
+                        ))
+
+                    self._cond.wait(remaining)
+
+            if create:
+                conn = self._connect()
+
+            elif self.ping and not self._is_usable(conn):
+                with self._cond:
+                    self._discard(conn)
+                continue
+
+            break
+
+        with self._cond:
+            wait_seconds = time.time() - start
+            self.waits += 1
+            self.wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+        return conn
+
+    def putconn(self, conn=None, key=None, close=False):
+        now = time.time()
+        if not close and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    # never hand a connection in the middle of a transaction to
+                    # another thread
+                    conn.rollback()
+
+            except psycopg2.Error:
+                close = True
+
+            if getattr(conn, "transaction_count", 0):
+                conn.transaction_count = 0
+
+        with self._cond:
+            if close or self.closed or self._is_expired(conn, now) or id(conn) not in self._conns:
+                # a connection this pool didn't create (or already discarded)
+                # is only closed
+                self._discard(conn)
+
+            else:
+                self._idle.append((conn, now))
+                self._cond.notify()
+
+            self._reap(now)
+
+    def closeall(self):
+        """close every connection, including the ones that are checked out, so
+        anything still using one will get an error from the db driver"""
+        with self._cond:
+            self._idle.clear()
+            for conn in list(self._conns.values()):
+                self._discard(conn)
+            self.closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        """return how the pool is doing
+
+        :returns: dict, "wait_seconds" is the total time getconn() has taken,
+            "created" and "discarded" count the connections opened and closed
+        """
+        with self._cond:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "used": self.size - len(self._idle),
+                "maxconn": self.maxconn,
+                "waits": self.waits,
+                "wait_seconds": self.wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+                "timeouts": self.timeouts,
+                "created": self.created,
+                "discarded": self.discarded,
+            }
+
+
 class PostgreSQL(SQLInterface):
 
     val_placeholder = '%s'
 
     connection_pool = None
 
-    _connection = None
+    checkouts = None
+
+    retryable_codes = set(["57P01", "57P02", "57P03"])
+    """besides the connection exception class (08), the error codes of errors that
+    can be retried, see is_retryable_error()"""
+
+    schema_lock_key = 0x70726f6d
+    """the advisory lock every prom process takes before it changes the schema"""
+
+    async_interface_class = "prom.interface.postgres_async.AsyncPostgreSQL"
 
     def _connect(self, connection_config):
         database = connection_config.database
@@ -92,18 +350,27 @@ class PostgreSQL(SQLInterface):
         port = connection_config.port
         if not port: port = 5432
 
-        minconn = int(connection_config.options.get('pool_minconn', 1))
-        maxconn = int(connection_config.options.get('pool_maxconn', 1))
-        pool_class_name = connection_config.options.get(
+        options = connection_config.options
+        minconn = int(options.get('pool_minconn', 1))
+        maxconn = int(options.get('pool_maxconn', 10))
+        pool_class_name = options.get(
             'pool_class',
-            'psycopg2.pool.SimpleConnectionPool'
+            'prom.interface.postgres.ConnectionPool'
         )
-        async_conn = int(connection_config.options.get('async', 0))
 
         _, pool_class = get_objects(pool_class_name)
 
         self.log("connecting using pool class {}".format(pool_class_name))
 
+        pool_kwargs = {}
+        if issubclass(pool_class, ConnectionPool):
+            pool_kwargs = {
+                "timeout": float(options.get('pool_timeout', 30.0)),
+                "lifetime": float(options.get('pool_lifetime', 0.0)),
+                "idle": float(options.get('pool_idle', 0.0)),
+                "ping": bool(int(options.get('pool_ping', 0))),
+            }
+
         # http://initd.org/psycopg/docs/module.html#psycopg2.connect
         self.connection_pool = pool_class(
             minconn,
@@ -116,36 +383,74 @@ class PostgreSQL(SQLInterface):
             cursor_factory=psycopg2.extras.RealDictCursor,
             #cursor_factory=LoggingCursor,
             connection_factory=Connection,
+            **pool_kwargs
         )
 
-        # hack for sync backwards compatibility with transactions
-        if not async_conn:
-            self._connection = self.connection_pool.getconn()
+        # each thread keeps the connection it checked out until it has freed it
+        # as many times as it got it, so nested calls (eg, everything inside a
+        # transaction) will all use the same connection, this outlives a
+        # reconnect so a connection of the old pool is still given back to it
+        if self.checkouts is None:
+            self.checkouts = threading.local()
 
     def free_connection(self, connection):
-        if not self.connected: return
-        if self._connection:
-            self.log("freeing sync connection")
-            return
-        self.log("freeing async connection {}", id(connection))
-        self.connection_pool.putconn(connection)
-
-    def get_connection(self):
+        pool = self.connection_pool
+        checkout = getattr(self.checkouts, "checkout", None)
+        if checkout and checkout[1] is connection:
+            checkout[2] -= 1
+            if checkout[2] > 0: return
+            self.checkouts.checkout = None
+            # the connection goes back to the pool that issued it, another thread
+            # could have closed (or reconnected) this interface since then
+            pool = checkout[0]
+
+        if pool is None: return
+        self.log("freeing connection {}", id(connection))
+        pool.putconn(connection)
+
+    def get_connection(self, readonly=False):
         if not self.connected: self.connect()
-        if self._connection:
-            self.log("getting sync connection")
-            return self._connection
-        connection = self.connection_pool.getconn()
-        self.log("getting async connection {}", id(connection))
+        checkout = getattr(self.checkouts, "checkout", None)
+        if checkout and checkout[0] is self.connection_pool:
+            checkout[2] += 1
+            return checkout[1]
 
+        connection = self.connection_pool.getconn()
+        self.checkouts.checkout = [self.connection_pool, connection, 1]
+        self.log("getting connection {}", id(connection))
         return connection
 
+    def pool_stats(self):
+        """return the stats of the connection pool, an empty dict if the pool
+        doesn't keep stats"""
+        if not self.connected: return {}
+        stats = getattr(self.connection_pool, "stats", None)
+        return stats() if stats else {}
+
     def _close(self):
         self.connection_pool.closeall()
-        if self._connection:
-            self._connection.close()
-            self._connection = None
-            self.connection_pool = None
+        self.connection_pool = None
+
+    def discard_connection(self, connection):
+        """only the closed connection is thrown away, the pool and the connections
+        the other threads have checked out (maybe in the middle of transactions)
+        are kept, the pool discards connection when it is freed"""
+        try:
+            connection.close()
+
+        except Exception:
+            pass
+
+    def explain_query(self, query_str, *query_args, **query_options):
+        """return the EXPLAIN (FORMAT JSON) plan of query_str, with analyze=True the
+        query is also run so the plan has the actual times and rows, careful, this
+        means analyzing an INSERT, UPDATE or DELETE changes the db"""
+        analyze = query_options.pop("analyze", False)
+        query_str = "EXPLAIN ({}FORMAT JSON) {}".format("ANALYZE, " if analyze else "", query_str)
+        ret = self.query(query_str, *query_args, fetchone=True, **query_options)
+        plan = ret["QUERY PLAN"]
+        # psycopg2 only decodes the json if it knows the json type
+        return json.loads(plan) if isinstance(plan, basestring) else plan
 
     def _get_tables(self, table_name, **kwargs):
         query_str = 'SELECT tablename FROM pg_tables WHERE tableowner = %s'
@@ -159,6 +464,40 @@ class PostgreSQL(SQLInterface):
         # http://www.postgresql.org/message-id/CA+mi_8Y6UXtAmYKKBZAHBoY7F6giuT5WfE0wi3hR44XXYDsXzg@mail.gmail.com
         return [r['tablename'] for r in ret]
 
+    def _get_catalog(self, **kwargs):
+        query_str = [
+            'SELECT t.tablename, a.attname',
+            'FROM pg_tables t',
+            'JOIN pg_namespace n ON n.nspname = t.schemaname',
+            'JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = t.tablename',
+            'LEFT JOIN pg_attribute a ON a.attrelid = c.oid',
+            '  AND a.attnum > 0 AND a.attisdropped = False',
+            'WHERE t.tableowner = %s',
+        ]
+        query_str = os.linesep.join(query_str)
+        ret = {}
+        for r in self.query(query_str, self.connection_config.username, **kwargs):
+            fields = ret.setdefault(r['tablename'], [])
+            if r['attname']:
+                fields.append(r['attname'])
+        return ret
+
+    @contextmanager
+    def schema_lock(self, **kwargs):
+        """the lock is a transaction level advisory lock so it is shared by every
+        process using the db and it goes away when the transaction ends
+
+        https://www.postgresql.org/docs/current/explicit-locking.html#ADVISORY-LOCKS
+        """
+        with self.transaction(**kwargs) as connection:
+            self.query(
+                'SELECT pg_advisory_xact_lock(%s)',
+                self.schema_lock_key,
+                ignore_result=True,
+                connection=connection
+            )
+            yield connection
+
     def _set_table(self, schema, **kwargs):
         """
         http://www.postgresql.org/docs/9.1/static/sql-createtable.html
@@ -313,28 +652,96 @@ class PostgreSQL(SQLInterface):
 
         return self.query(query_str, ignore_result=True, **index_options)
 
+    def _insert_SQL(self, schema, fields):
+        query_str, query_args = super(PostgreSQL, self)._insert_SQL(schema, fields)
+        query_str += ' RETURNING {}'.format(self._normalize_name(schema.pk.name))
+        return query_str, query_args
+
     def _insert(self, schema, fields, **kwargs):
+        query_str, query_vals = self._insert_SQL(schema, fields)
+        ret = self.query(query_str, *query_vals, **kwargs)
+        return ret[0][schema.pk.name]
+
+    def _flush_batch(self, statements, **kwargs):
+        """inserts are sent as one multi-row INSERT and updates and deletes are
+        sent together with execute_batch()
+
+        the rows of a multi-row INSERT ... RETURNING aren't guaranteed to come back
+        in the order of the VALUES, so the pks of the inserts are known before
+        they are sent, either the statements have them or they are taken from the
+        pk's sequence, if the pk has no sequence the inserts are sent one at a time
+
+        execute_batch() only knows how many rows the last page changed, so each
+        batched update or delete resolves to None, it only tells you the write
+        succeeded (if it failed the whole batch fails)
 
-        # get the primary key
-        pk_name = schema.pk.name
+        http://initd.org/psycopg/docs/extras.html#fast-execution-helpers
+        """
+        if len(statements) == 1:
+            return super(PostgreSQL, self)._flush_batch(statements, **kwargs)
+
+        statement = statements[0]
+        argslist = [s.query_args for s in statements]
+        with self.connection(**kwargs) as connection:
+            kwargs['connection'] = connection
+            if statement.method_name == "insert":
+                schema = statement.schema
+                pk_name = schema.pk_name
+                field_names = list(statement.fields.keys())
+                if pk_name in statement.fields:
+                    ret = [s.fields[pk_name] for s in statements]
+
+                else:
+                    ret = self._get_batch_pks(schema, len(statements), **kwargs)
+                    if not ret:
+                        return super(PostgreSQL, self)._flush_batch(statements, **kwargs)
+
+                    field_names.append(pk_name)
+                    argslist = [list(args) + [pk] for args, pk in zip(argslist, ret)]
+
+                # the VALUES (...) of the insert becomes VALUES %s
+                query_str = 'INSERT INTO {} ({}) VALUES %s'.format(
+                    self._normalize_table_name(schema),
+                    ', '.join(self._normalize_name(k) for k in field_names),
+                )
+                callback = lambda cur: psycopg2.extras.execute_values(
+                    cur,
+                    query_str,
+                    argslist,
+                    page_size=len(argslist),
+                )
+
+            else:
+                query_str = statement.query_str
+                callback = lambda cur: psycopg2.extras.execute_batch(cur, query_str, argslist)
+                ret = [None] * len(statements)
 
-        field_formats = []
-        field_names = []
-        query_vals = []
-        for field_name, field_val in fields.items():
-            field_names.append(self._normalize_name(field_name))
-            field_formats.append(self.val_placeholder)
-            query_vals.append(field_val)
+            start = self.start_query()
+            with self.query_settings(connection, kwargs.get("timeout"), kwargs.get("settings")):
+                callback(connection.cursor())
 
-        query_str = 'INSERT INTO {} ({}) VALUES ({}) RETURNING {}'.format(
+            if start:
+                self.log_query(connection, query_str, argslist, start, len(ret))
+
+        return ret
+
+    def _get_batch_pks(self, schema, count, **kwargs):
+        """take count values from the sequence of the schema's pk
+
+        :returns: list, empty if the pk doesn't have a sequence
+        """
+        query_str = " ".join([
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) AS pk",
+            "FROM generate_series(1, %s)",
+        ])
+        rows = self.query(
+            query_str,
             self._normalize_table_name(schema),
-            ', '.join(field_names),
-            ', '.join(field_formats),
-            self._normalize_name(pk_name),
+            schema.pk_name,
+            count,
+            **kwargs
         )
-
-        ret = self.query(query_str, *query_vals, **kwargs)
-        return ret[0][pk_name]
+        return [row["pk"] for row in rows] if rows and rows[0]["pk"] is not None else []
 
     def _normalize_field_SQL(self, schema, field_name, symbol):
         format_field_name = self._normalize_name(field_name)
@@ -493,6 +900,11 @@ class PostgreSQL(SQLInterface):
 
         return '{} {}'.format(self._normalize_name(field_name), field_type)
 
+    def get_converter(self, field):
+        # psycopg2 already returns everything else as the right python type
+        if not is_py2 and issubclass(field.type, basestring):
+            return normalize_str
+
     def _handle_error(self, schema, e, **kwargs):
         ret = False
         if isinstance(e, psycopg2.ProgrammingError):
@@ -512,8 +924,90 @@ class PostgreSQL(SQLInterface):
 
         return ret
 
+    def is_retryable_error(self, e):
+        """connection exceptions (class 08) and the db shutting down or starting
+        up (57P01-57P03) can be retried, so can any driver error that doesn't have
+        an error code since those come from the connection and not from the db
+
+        https://www.postgresql.org/docs/current/errcodes-appendix.html
+        """
+        ret = super(PostgreSQL, self).is_retryable_error(e)
+        if not ret and isinstance(e.e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+            pgcode = getattr(e.e, "pgcode", None)
+            if pgcode:
+                ret = pgcode.startswith("08") or pgcode in self.retryable_codes
+            else:
+                ret = True
+
+        return ret
+
+    @contextmanager
+    def query_settings(self, connection, timeout=None, settings=None):
+        """timeout becomes the statement_timeout and each of the settings (eg,
+        work_mem, enable_seqscan) is SET LOCAL, a query that isn't already in a
+        transaction gets one since SET LOCAL only lasts until the end of the
+        transaction
+
+        https://www.postgresql.org/docs/current/runtime-config-client.html#GUC-STATEMENT-TIMEOUT
+        https://www.postgresql.org/docs/current/functions-admin.html#FUNCTIONS-ADMIN-SET
+        """
+        settings = dict(settings or {})
+        if timeout:
+            settings["statement_timeout"] = int(timeout)
+
+        if not settings:
+            yield connection
+
+        elif connection.in_transaction():
+            # put the old values back so the settings don't last for the rest of
+            # the transaction, if the query fails the transaction is done anyway
+            old_settings = self._set_settings(connection, settings)
+            yield connection
+            self._set_settings(connection, old_settings)
+
+        else:
+            with self.transaction(connection):
+                self._set_settings(connection, settings)
+                yield connection
+
+    def _set_settings(self, connection, settings):
+        """SET LOCAL all the settings in one query
+
+        :returns: dict, the values the settings had before
+        """
+        names, query_str, query_args = self._settings_SQL(settings)
+        start = self.start_query()
+        cur = connection.cursor()
+        cur.execute(query_str, query_args)
+        row = cur.fetchone()
+        if start:
+            self.log_query(connection, query_str, query_args, start, 1)
+        return {name: row["s{}".format(i)] for i, name in enumerate(names)}
+
+    def _settings_SQL(self, settings):
+        """return the query that SET LOCALs all the settings, the row it returns
+        has the value each setting had before in the s<index of name> column
+
+        :returns: tuple, (names, query_str, query_args)
+        """
+        names = list(settings.keys())
+        query_str = []
+        query_args = []
+        for i, name in enumerate(names):
+            val = settings[name]
+            if isinstance(val, bool):
+                val = "on" if val else "off"
+            # the current value is selected before it is changed
+            query_str.append("current_setting(%s) AS s{}, set_config(%s, %s, true)".format(i))
+            query_args.extend([name, name, unicode(val)])
+
+        query_str = "SELECT {}".format(", ".join(query_str))
+        return names, query_str, query_args
+
     def _create_error(self, e, exc_info):
-        if isinstance(e, psycopg2.IntegrityError):
+        if isinstance(e, psycopg2.extensions.QueryCanceledError):
+            er = CancelError(e, exc_info)
+        elif isinstance(e, psycopg2.IntegrityError):
             er = UniqueError(e, exc_info)
         else:
             er = super(PostgreSQL, self)._create_error(e, exc_info)
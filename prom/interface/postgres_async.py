@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+The asyncio interface for PostgreSQL, it uses psycopg2's asynchronous mode
+so no other driver is needed
+
+http://initd.org/psycopg/docs/advanced.html#asynchronous-support
+
+This module needs python 3
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import asyncio
+from collections import deque
+
+# third party
+import psycopg2
+import psycopg2.extras
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+# first party
+from .base import Connection
+from .postgres import register_types
+from ..aio import AsyncInterface, asynccontextmanager
+from ..compat import *
+
+
+class AsyncConnection(Connection, psycopg2.extensions.connection):
+    """A connection in asynchronous mode, the db calls return right away and
+    wait() gives the loop back until the db has answered
+
+    async connections are always in autocommit mode so the transactions are
+    started with BEGIN and savepoints just like SQLConnection
+    """
+    broken = False
+    """True if a query was interrupted (eg, its task was cancelled) so the state of
+    the connection isn't known, the pool will close it"""
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncConnection, self).__init__(*args, **kwargs)
+        register_types(self)
+
+    async def wait(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            state = self.poll()
+            if state == psycopg2.extensions.POLL_OK:
+                break
+
+            elif state == psycopg2.extensions.POLL_READ:
+                await self._wait_fileno(loop.add_reader, loop.remove_reader)
+
+            elif state == psycopg2.extensions.POLL_WRITE:
+                await self._wait_fileno(loop.add_writer, loop.remove_writer)
+
+            else:
+                raise psycopg2.OperationalError("poll() returned {}".format(state))
+
+    async def _wait_fileno(self, add, remove):
+        loop = asyncio.get_event_loop()
+        fileno = self.fileno()
+        waiter = loop.create_future()
+        def callback():
+            if not waiter.done():
+                waiter.set_result(None)
+
+        add(fileno, callback)
+        try:
+            await waiter
+
+        finally:
+            remove(fileno)
+
+    async def execute(self, cursor, query_str, query_args=None):
+        """run the query on cursor and wait for it to finish"""
+        try:
+            cursor.execute(query_str, query_args)
+            await self.wait()
+
+        except psycopg2.Error:
+            raise
+
+        except BaseException:
+            self.broken = True
+            raise
+
+    async def run(self, query_str):
+        await self.execute(self.cursor(), query_str)
+
+    async def transaction_start(self, name):
+        if not name:
+            raise ValueError("Transaction name cannot be empty")
+
+        self.transaction_count += 1
+        if self.transaction_count == 1:
+            await self.run("BEGIN")
+        else:
+            await self.run("SAVEPOINT {}".format(name))
+
+        return self.transaction_count
+
+    async def transaction_stop(self):
+        if self.transaction_count > 0:
+            if self.transaction_count == 1:
+                await self.run("COMMIT")
+
+            self.transaction_count -= 1
+
+        return self.transaction_count
+
+    async def transaction_fail(self, name):
+        if not name:
+            raise ValueError("Transaction name cannot be empty")
+
+        if self.transaction_count > 0:
+            try:
+                if self.transaction_count == 1:
+                    await self.run("ROLLBACK")
+                else:
+                    await self.run("ROLLBACK TO SAVEPOINT {}".format(name))
+
+            finally:
+                self.transaction_count -= 1
+
+
+class AsyncConnectionPool(object):
+    """A pool of async connections for one event loop
+
+    connections are created as they are needed up to maxconn, after that getconn()
+    will wait up to timeout seconds for a connection to be returned to the pool
+    """
+    def __init__(self, maxconn, timeout=30.0, **kwargs):
+        """
+        :param maxconn: int, the most connections that can be open at one time
+        :param timeout: float, how long getconn() will wait for a connection
+        :param **kwargs: passed to psycopg2.connect()
+        """
+        self.maxconn = max(int(maxconn), 1)
+        self.timeout = float(timeout)
+        self.closed = False
+
+        kwargs["async_"] = 1
+        self._kwargs = kwargs
+        self._idle = deque()
+        self._slots = asyncio.Semaphore(self.maxconn)
+
+    async def _connect(self):
+        conn = psycopg2.connect(**self._kwargs)
+        try:
+            await conn.wait()
+
+        except BaseException:
+            conn.close()
+            raise
+
+        return conn
+
+    async def getconn(self):
+        if self.closed: raise PoolError("connection pool is closed")
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+
+        except asyncio.TimeoutError:
+            raise PoolError("timed out after {} seconds waiting for a connection".format(
+                self.timeout
+            ))
+
+        try:
+            while self._idle:
+                conn = self._idle.pop()
+                if not conn.closed:
+                    return conn
+
+            return await self._connect()
+
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def putconn(self, conn, close=False):
+        try:
+            if not close:
+                close = self.closed or conn.closed or conn.broken or conn.in_transaction()
+
+            if not close:
+                # never hand out a connection that was left in a transaction
+                status = conn.get_transaction_status()
+                close = status != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+            if close:
+                conn.close()
+            else:
+                self._idle.append(conn)
+
+        finally:
+            self._slots.release()
+
+    async def closeall(self):
+        self.closed = True
+        while self._idle:
+            self._idle.pop().close()
+
+    def stats(self):
+        """return how the pool is doing"""
+        return {
+            "idle": len(self._idle),
+            "maxconn": self.maxconn,
+        }
+
+
+class AsyncPostgreSQL(AsyncInterface):
+    """The async PostgreSQL interface
+
+    it uses the same dsn as PostgreSQL, the pool_maxconn and pool_timeout options
+    configure its pool
+    """
+    connection_pool = None
+
+    async def _connect(self, connection_config):
+        options = connection_config.options
+        self.connection_pool = AsyncConnectionPool(
+            int(options.get('pool_maxconn', 10)),
+            timeout=float(options.get('pool_timeout', 30.0)),
+            dbname=connection_config.database,
+            user=connection_config.username,
+            password=connection_config.password,
+            host=connection_config.host,
+            port=connection_config.port or 5432,
+            cursor_factory=psycopg2.extras.RealDictCursor,
+            connection_factory=AsyncConnection,
+        )
+
+    async def _get_connection(self, readonly=False):
+        return await self.connection_pool.getconn()
+
+    async def _free_connection(self, connection):
+        await self.connection_pool.putconn(connection)
+
+    async def _close(self):
+        await self.connection_pool.closeall()
+        self.connection_pool = None
+
+    def pool_stats(self):
+        if not self.connected: return {}
+        return self.connection_pool.stats()
+
+    async def _query(self, query_str, query_args=None, **query_options):
+        """see SQLInterface._query()"""
+        ret = True
+        connection = query_options['connection']
+        ignore_result = query_options.get('ignore_result', False)
+        count_result = query_options.get('count_result', False)
+        one_result = query_options.get('fetchone', query_options.get('one_result', False))
+
+        timeout = query_options.get('timeout', None)
+        settings = query_options.get('settings', None)
+
+        start = self.interface.start_query()
+        rows = error = None
+        try:
+            async with self.query_settings(connection, timeout, settings):
+                cur = connection.cursor()
+                await connection.execute(cur, query_str, query_args or None)
+
+                if not ignore_result:
+                    if one_result:
+                        ret = cur.fetchone()
+                        rows = 1 if ret else 0
+                    elif count_result:
+                        ret = rows = cur.rowcount
+                    else:
+                        ret = cur.fetchall()
+                        rows = len(ret)
+
+        except Exception as e:
+            error = e
+            self.log(e)
+            raise
+
+        finally:
+            if start:
+                self.interface.log_query(connection, query_str, query_args, start, rows, error)
+
+        return ret
+
+    @asynccontextmanager
+    async def query_settings(self, connection, timeout=None, settings=None):
+        """see PostgreSQL.query_settings()"""
+        settings = dict(settings or {})
+        if timeout:
+            settings["statement_timeout"] = int(timeout)
+
+        if not settings:
+            yield connection
+
+        elif connection.in_transaction():
+            old_settings = await self._set_settings(connection, settings)
+            yield connection
+            await self._set_settings(connection, old_settings)
+
+        else:
+            async with self.transaction(connection):
+                await self._set_settings(connection, settings)
+                yield connection
+
+    async def _set_settings(self, connection, settings):
+        names, query_str, query_args = self.interface._settings_SQL(settings)
+        start = self.interface.start_query()
+        cur = connection.cursor()
+        await connection.execute(cur, query_str, query_args)
+        row = cur.fetchone()
+        if start:
+            self.interface.log_query(connection, query_str, query_args, start, 1)
+        return {name: row["s{}".format(i)] for i, name in enumerate(names)}
+
+    async def _insert(self, schema, fields, **kwargs):
+        query_str, query_args = self.interface._insert_SQL(schema, fields)
+        ret = await self._query(query_str, query_args, fetchone=True, **kwargs)
+        return ret[schema.pk.name]
+
+    async def _handle_error(self, schema, e, **kwargs):
+        """the missing tables and columns are added by the sync interface in a
+        thread using its own connections"""
+        return await self.run_sync(self.interface._handle_error, schema, e)
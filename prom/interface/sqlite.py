@@ -23,22 +23,35 @@ http://www.numericalexpert.com/blog/sqlite_blob_time/
 """
 from __future__ import unicode_literals, division, print_function, absolute_import
 import os
+import sys
 import decimal
 import datetime
 from distutils import dir_util
 import re
 import sqlite3
+import threading
+import weakref
+import uuid
+import time
+from contextlib import contextmanager
 try:
     import thread
 except ImportError:
     thread = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # first party
-from ..exception import UniqueError
+from ..exception import UniqueError, CancelError, TransactionError
 from ..compat import *
 from .base import SQLInterface, SQLConnection
 
 
+UNIXTIME_REGEX = re.compile(r"^\-?\d+(?:\.\d+)?$")
+
+
 class SQLiteRowDict(sqlite3.Row):
     def __getitem__(self, k):
         if is_py2:
@@ -67,6 +80,19 @@ class SQLiteConnection(SQLConnection, sqlite3.Connection):
         self.closed = 1
         return r
 
+    def db_in_transaction(self):
+        """return True if SQLite has a transaction open, this can be False while
+        in_transaction() is True because SQLite ends a transaction on its own
+        when a write in it is interrupted
+
+        https://www.sqlite.org/c3ref/interrupt.html
+        """
+        in_transaction = getattr(sqlite3.Connection, "in_transaction", None)
+        if in_transaction is None:
+            # python 2's sqlite3 can't tell us
+            return self.in_transaction()
+        return in_transaction.__get__(self)
+
 
 class TimestampType(object):
     """External sqlite3 databases can store the TIMESTAMP type as unix timestamps,
@@ -84,19 +110,13 @@ class TimestampType(object):
 
     @staticmethod
     def convert(val):
-        val = StringType.adapt(val)
-        if re.match("^\d+\.\d+$", val):
-            # account for unix timestamps with microseconds
-            val = datetime.datetime.fromtimestamp(float(val))
-
-        elif re.match("^\-?\d+$", val):
-            # account for unix timestamps without microseconds
-            val = int(val)
-
+        """TIMESTAMP has NUMERIC affinity, so SQLite hands back unix timestamps as
+        int or float and everything else as a string"""
+        if isinstance(val, (int, long, float)):
             try:
                 val = datetime.datetime.fromtimestamp(val)
 
-            except ValueError:
+            except (ValueError, OverflowError, OSError):
                 # we're hosed with this unix timestamp, but rather than error
                 # out let's go ahead and return the closest approximation we
                 # can get to the correct timestamp
@@ -106,44 +126,87 @@ class TimestampType(object):
                     val = datetime.datetime.min
 
         else:
-            # this is borrowed from sqlite3.dbapi2.convert_timestamp, sadly it is
-            # burried in a function so I can't wrap it :(
-            datepart, timepart = val.split(" ")
-            year, month, day = map(int, datepart.split("-"))
-            timepart_full = timepart.split(".")
-            hours, minutes, seconds = map(int, timepart_full[0].split(":"))
-            if len(timepart_full) == 2:
-                microseconds = int('{:0<6.6}'.format(timepart_full[1]))
-            else:
-                microseconds = 0
+            val = StringType.adapt(val)
+            try:
+                val = TimestampType.fromisoformat(val)
+
+            except ValueError:
+                val = TimestampType.parse(val)
 
-            val = datetime.datetime(year, month, day, hours, minutes, seconds, microseconds)
         return val
 
+    @staticmethod
+    def fromisoformat(val):
+        """the fast path for the YYYY-MM-DD HH:MM:SS[.SSSSSS] strings adapt()
+        creates, raises ValueError for anything else"""
+        if val[4:5] != "-" or val[10:11] != " " or len(val) not in (19, 26):
+            raise ValueError(val)
+
+        return datetime.datetime(
+            int(val[0:4]),
+            int(val[5:7]),
+            int(val[8:10]),
+            int(val[11:13]),
+            int(val[14:16]),
+            int(val[17:19]),
+            int(val[20:26]) if len(val) == 26 else 0,
+        )
+
+    if hasattr(datetime.datetime, "fromisoformat"):
+        fromisoformat = datetime.datetime.fromisoformat # py3.7+
+
+    @staticmethod
+    def parse(val):
+        """the slow path for any string fromisoformat() can't handle"""
+        if UNIXTIME_REGEX.match(val):
+            return TimestampType.convert(float(val))
+
+        # this is borrowed from sqlite3.dbapi2.convert_timestamp, sadly it is
+        # burried in a function so I can't wrap it :(
+        datepart, timepart = val.split(" ")
+        year, month, day = map(int, datepart.split("-"))
+        timepart_full = timepart.split(".")
+        hours, minutes, seconds = map(int, timepart_full[0].split(":"))
+        if len(timepart_full) == 2:
+            microseconds = int('{:0<6.6}'.format(timepart_full[1]))
+        else:
+            microseconds = 0
+
+        return datetime.datetime(year, month, day, hours, minutes, seconds, microseconds)
+
+
+class DateType(object):
+    @staticmethod
+    def convert(val):
+        val = StringType.adapt(val)
+        return datetime.date(int(val[0:4]), int(val[5:7]), int(val[8:10]))
+
 
 class BooleanType(object):
     @staticmethod
     def adapt(val):
-        return int(str(val))
+        return int(val)
 
     @staticmethod
     def convert(val):
-        return bool(str(val))
+        if isinstance(val, basestring):
+            val = int(val)
+        return bool(val)
 
 
 class NumericType(object):
     @staticmethod
     def adapt(val):
-        return float(str(val))
+        return float(val)
 
     @staticmethod
     def convert(val):
-        if is_py2:
-            ret = decimal.Decimal(str(val))
+        """NUMERIC affinity stores the adapted floats as INTEGER or REAL"""
+        if isinstance(val, float):
+            val = repr(val)
         else:
             val = StringType.adapt(val)
-            ret = decimal.Decimal(val)
-        return ret
+        return decimal.Decimal(val)
 
 
 class StringType(object):
@@ -163,6 +226,55 @@ class SQLite(SQLInterface):
 
     _connection = None
 
+    statement_rollback = True
+
+    schema_lock_file = None
+
+    async_interface_class = "prom.interface.sqlite_async.AsyncSQLite"
+
+    progress_steps = 1000
+    """how many SQLite virtual machine instructions run between each check of a
+    query's timeout"""
+
+    pragma_names = [
+        'journal_mode',
+        'synchronous',
+        'cache_size',
+        'mmap_size',
+        'temp_store',
+        'busy_timeout',
+    ]
+    """the pragmas that can be set with dsn options, these are set on every
+    connection, https://www.sqlite.org/pragma.html"""
+
+    profiles = {
+        # fast writes of a lot of rows, a crash could lose or corrupt the db
+        'bulkload': {
+            'journal_mode': 'MEMORY',
+            'synchronous': 'OFF',
+            'cache_size': -262144, # 256MB
+            'temp_store': 'MEMORY',
+        },
+        # lots of concurrent reads with the occasional write
+        'readheavy': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'cache_size': -65536, # 64MB
+            'mmap_size': 268435456, # 256MB
+            'temp_store': 'MEMORY',
+            'busy_timeout': 5000,
+        },
+        # every commit makes it to disk
+        'durable': {
+            'journal_mode': 'WAL',
+            'synchronous': 'FULL',
+            'busy_timeout': 5000,
+        },
+    }
+    """named sets of pragmas that can be set with the profile dsn option (eg,
+    ?profile=readheavy), any pragma also set in the dsn options will override
+    the profile's value"""
+
     @classmethod
     def configure(cls, connection_config):
         dsn = getattr(connection_config, 'dsn', '')
@@ -193,7 +305,7 @@ class SQLite(SQLInterface):
         # https://docs.python.org/2/library/sqlite3.html#default-adapters-and-converters
         options = {
             'isolation_level': None,
-            'detect_types': sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES,
+            'detect_types': sqlite3.PARSE_COLNAMES,
             'factory': SQLiteConnection,
             'check_same_thread': True, # https://stackoverflow.com/a/2578401/5006
         }
@@ -202,45 +314,161 @@ class SQLite(SQLInterface):
             if k in connection_config.options:
                 options[k] = connection_config.options[k]
 
+        self.readers = bool(int(connection_config.options.get('readers', 0)))
+        self.memory = path == ":memory:"
+        self.pragmas = self.get_pragmas(connection_config)
+
+        # read only dbs can't be written to, an immutable db is also assumed to
+        # never change so sqlite won't do any locking or change detection
+        # https://www.sqlite.org/uri.html#uriimmutable
+        self.immutable = bool(int(connection_config.options.get('immutable', 0)))
+        self.readonly = self.immutable or bool(int(connection_config.options.get('readonly', 0)))
+        if self.readonly:
+            if is_py2:
+                raise ValueError("readonly and immutable dbs need python 3")
+
+            if self.memory:
+                raise ValueError("an in memory db can't be readonly or immutable")
+
+            path = "file:{}?mode=ro".format(urlparse.quote(os.path.abspath(path)))
+            if self.immutable:
+                path += "&immutable=1"
+            options['uri'] = True
+
+        if self.readers:
+            # the writer is shared by all the threads (one at a time), each thread
+            # gets its own reader
+            options['check_same_thread'] = False
+            if self.memory:
+                if is_py2:
+                    raise ValueError("readers with a :memory: db needs python 3")
+
+                # every connection to this uri will see the same in memory db
+                # https://www.sqlite.org/inmemorydb.html
+                path = "file:prom-{}?mode=memory&cache=shared".format(uuid.uuid4().hex)
+                options['uri'] = True
+
+        self.connection_path = path
+        self.connection_options = options
+
+        # values are converted on the way out by the conversion plans (see
+        # get_converter()) instead of by sqlite3 converters, those run for every
+        # value of a declared type, even for raw queries that don't want them
+        sqlite3.register_adapter(decimal.Decimal, NumericType.adapt)
+        sqlite3.register_adapter(bool, BooleanType.adapt)
+        sqlite3.register_adapter(datetime.datetime, TimestampType.adapt)
+
+        self._connection = self._open_connection()
+
+        if self.readers:
+            self.writer_lock = threading.RLock()
+            self.local = threading.local()
+            self.reader_connections = weakref.WeakSet()
+            if not self.memory and not self.readonly and 'journal_mode' not in self.pragmas:
+                # readers never block the writer and the writer never blocks readers
+                # https://www.sqlite.org/wal.html
+                self._connection.execute('PRAGMA journal_mode = WAL')
+
+    def get_pragmas(self, connection_config):
+        """find the pragmas of the profile and pragma dsn options
+
+        :param connection_config: Connection
+        :returns: dict, the pragma names and the values they should be set to
+        """
+        pragmas = {}
+        config_options = connection_config.options
+        profile = config_options.get('profile', '')
+        if profile:
+            if profile not in self.profiles:
+                raise ValueError("unknown sqlite profile {}".format(profile))
+            pragmas.update(self.profiles[profile])
+
+        for k in self.pragma_names:
+            if k in config_options:
+                pragmas[k] = config_options[k]
+
+        for k, v in pragmas.items():
+            # pragma values can't be bound as query params so make sure they
+            # are just names or numbers
+            if not re.match(r"^\-?\w+$", unicode(v)):
+                raise ValueError("invalid value {} for sqlite pragma {}".format(v, k))
+
+        return pragmas
+
+    def _open_connection(self, readonly=False):
+        """open a new connection to the db using the options found in _connect()
+
+        :param readonly: bool, True if this connection will only be used for reading
+        :returns: SQLiteConnection
+        """
+        path = self.connection_path
+        options = self.connection_options
+
         try:
-            self._connection = sqlite3.connect(path, **options)
+            connection = sqlite3.connect(path, **options)
 
         except sqlite3.DatabaseError as e:
             path_d = os.path.dirname(path)
-            if os.path.isdir(path_d):
+            if not path_d or os.path.isdir(path_d) or options.get('uri', False):
                 raise
 
             else:
                 # let's try and make the directory path and connect again
                 dir_util.mkpath(path_d)
-                self._connection = sqlite3.connect(path, **options)
+                connection = sqlite3.connect(path, **options)
 
         # https://docs.python.org/2/library/sqlite3.html#row-objects
-        self._connection.row_factory = SQLiteRowDict
-        # https://docs.python.org/2/library/sqlite3.html#sqlite3.Connection.text_factory
-        self._connection.text_factory = StringType.adapt
+        connection.row_factory = SQLiteRowDict
 
-        # for some reason this is needed in python 3.6 in order for saved bytes
-        # to be ran through the converter, not sure why
-        sqlite3.register_converter('TEXT' if not is_py2 else b'TEXT', StringType.adapt)
+        # turn on foreign keys
+        # http://www.sqlite.org/foreignkeys.html
+        connection.execute('PRAGMA foreign_keys = ON')
 
-        sqlite3.register_adapter(decimal.Decimal, NumericType.adapt)
-        sqlite3.register_converter('NUMERIC' if not is_py2 else b'NUMERIC', NumericType.convert)
+        for k, v in self.pragmas.items():
+            if k == 'journal_mode':
+                # the journal mode is saved in the db so only the writer sets it
+                if readonly or self.readonly or self.memory: continue
+            connection.execute('PRAGMA {} = {}'.format(k, v))
 
-        sqlite3.register_adapter(bool, BooleanType.adapt)
-        sqlite3.register_converter('BOOLEAN' if not is_py2 else b'BOOLEAN', BooleanType.convert)
+        if readonly and self.memory:
+            # shared cache connections lock tables instead of the db, so a reader
+            # would fail while the writer is in a transaction, this means readers
+            # of an in memory db can see uncommitted writes
+            # https://www.sqlite.org/sharedcache.html
+            connection.execute('PRAGMA read_uncommitted = 1')
 
-        sqlite3.register_adapter(datetime.datetime, TimestampType.adapt)
-        sqlite3.register_converter('TIMESTAMP' if not is_py2 else b'TIMESTAMP', TimestampType.convert)
+        return connection
 
-        # turn on foreign keys
-        # http://www.sqlite.org/foreignkeys.html
-        self._query('PRAGMA foreign_keys = ON', ignore_result=True);
-
-    def get_connection(self):
+    def get_connection(self, readonly=False):
         if not self.connected: self.connect()
+        if not self.readers: return self._connection
+
+        writes = getattr(self.local, "writes", 0)
+        if readonly and not writes:
+            return self.get_reader_connection()
+
+        # a thread keeps the writer until it has freed it as many times as it
+        # got it, so everything in a transaction uses the writer
+        self.writer_lock.acquire()
+        self.local.writes = writes + 1
         return self._connection
 
+    def get_reader_connection(self):
+        """return the reader connection of the current thread"""
+        reader = getattr(self.local, "reader", None)
+        if reader is None or reader[0] is not self._connection:
+            connection = self._open_connection(readonly=True)
+            self.reader_connections.add(connection)
+            reader = (self._connection, connection)
+            self.local.reader = reader
+        return reader[1]
+
+    def free_connection(self, connection):
+        if not self.connected: return
+        if self.readers and connection is self._connection:
+            self.local.writes -= 1
+            self.writer_lock.release()
+
     def _get_thread(self):
         if thread:
             ret = str(thread.get_ident())
@@ -249,9 +477,51 @@ class SQLite(SQLInterface):
         return ret
 
     def _close(self):
+        if self.readers:
+            for connection in list(self.reader_connections):
+                connection.close()
+
         self._connection.close()
         self._connection = None
 
+    def _get_catalog(self, **kwargs):
+        """https://www.sqlite.org/pragma.html#pragfunc"""
+        query_str = " ".join([
+            'SELECT m.tbl_name, p.name FROM sqlite_master m',
+            'LEFT JOIN pragma_table_info(m.tbl_name) p',
+            'WHERE m.type = ?',
+        ])
+        ret = {}
+        for r in self._query(query_str, ['table'], **kwargs):
+            fields = ret.setdefault(r['tbl_name'], [])
+            if r['name']:
+                fields.append(r['name'])
+        return ret
+
+    @contextmanager
+    def schema_lock(self, **kwargs):
+        """besides the threads of this process, other processes using the same db
+        file are locked out with a lock file next to the db, an in memory db can't
+        be shared with other processes so it doesn't need one"""
+        with self.schema_rlock:
+            # only the outermost lock of the thread holding schema_rlock takes the
+            # file lock
+            lock_f = None
+            if fcntl and not self.memory and not self.schema_lock_file:
+                lock_f = open("{}.lock".format(self.connection_config.path), "a")
+                fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX)
+                self.schema_lock_file = lock_f
+
+            try:
+                with self.transaction(**kwargs) as connection:
+                    yield connection
+
+            finally:
+                if lock_f:
+                    self.schema_lock_file = None
+                    fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
+                    lock_f.close()
+
     def _get_tables(self, table_name, **kwargs):
         query_str = 'SELECT tbl_name FROM sqlite_master WHERE type = ?'
         query_args = ['table']
@@ -263,6 +533,31 @@ class SQLite(SQLInterface):
         ret = self._query(query_str, query_args, **kwargs)
         return [r['tbl_name'] for r in ret]
 
+    def explain_query(self, query_str, *query_args, **query_options):
+        """return the EXPLAIN QUERY PLAN rows of query_str, SQLite can't analyze
+        so analyze=True is ignored"""
+        query_options.pop("analyze", None)
+        ret = self.query("EXPLAIN QUERY PLAN {}".format(query_str), *query_args, **query_options)
+        return [dict(r) for r in ret]
+
+    def get_converter(self, field):
+        field_type = field.type
+        if issubclass(field_type, bool):
+            return BooleanType.convert
+
+        elif issubclass(field_type, datetime.datetime):
+            return TimestampType.convert
+
+        elif issubclass(field_type, datetime.date):
+            return DateType.convert
+
+        elif issubclass(field_type, decimal.Decimal):
+            return NumericType.convert
+
+        elif issubclass(field_type, basestring):
+            # saved bytes come back as bytes since SQLite keeps them as a BLOB
+            return StringType.adapt
+
     def get_field_SQL(self, field_name, field):
         """
         returns the SQL for a given field with full type information
@@ -412,20 +707,7 @@ class SQLite(SQLInterface):
         """
         http://www.sqlite.org/lang_insert.html
         """
-        field_formats = []
-        field_names = []
-        query_vals = []
-        for field_name, field_val in fields.items():
-            field_names.append(self._normalize_name(field_name))
-            field_formats.append(self.val_placeholder)
-            query_vals.append(field_val)
-
-        query_str = "INSERT INTO {} ({}) VALUES ({})".format(
-            self._normalize_table_name(schema),
-            ', '.join(field_names),
-            ', '.join(field_formats)
-        )
-
+        query_str, query_vals = self._insert_SQL(schema, fields)
         ret = self._query(query_str, query_vals, cursor_result=True, **kwargs)
 
         pk_name = schema.pk.name
@@ -463,8 +745,50 @@ class SQLite(SQLInterface):
 
         return ret
 
+    def is_retryable_error(self, e):
+        """besides a closed connection, a db that is locked by another connection
+        (that didn't finish in timeout seconds) can be retried
+
+        https://www.sqlite.org/rescode.html#busy
+        """
+        ret = super(SQLite, self).is_retryable_error(e)
+        if not ret and isinstance(e.e, sqlite3.OperationalError):
+            e_msg = str(e.e)
+            ret = "database is locked" in e_msg or "database is busy" in e_msg
+        return ret
+
+    @contextmanager
+    def query_settings(self, connection, timeout=None, settings=None):
+        """a progress handler stops the query once it has run past timeout, the
+        settings are for Postgres so they are ignored
+
+        https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.set_progress_handler
+        """
+        if timeout:
+            stop = time.time() + (float(timeout) / 1000.0)
+            connection.set_progress_handler(lambda: int(time.time() > stop), self.progress_steps)
+            try:
+                yield connection
+
+            except sqlite3.OperationalError as e:
+                if "interrupted" in str(e) and connection.in_transaction() and not connection.db_in_transaction():
+                    # SQLite rolled back the whole transaction, so prom's
+                    # transaction is over too and the error has to take the
+                    # transaction() block down with it
+                    connection.transaction_count = 0
+                    raise TransactionError(e, sys.exc_info())
+                raise
+
+            finally:
+                connection.set_progress_handler(None, self.progress_steps)
+
+        else:
+            yield connection
+
     def _create_error(self, e, exc_info):
-        if isinstance(e, sqlite3.IntegrityError):
+        if isinstance(e, sqlite3.OperationalError) and "interrupted" in str(e):
+            er = CancelError(e, exc_info)
+        elif isinstance(e, sqlite3.IntegrityError):
             er = UniqueError(e, exc_info)
         else:
             er = super(SQLite, self)._create_error(e, exc_info)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+The asyncio interface for SQLite
+
+sqlite3 can't do anything without blocking, so every call runs on a thread that
+only this interface uses, the thread opens its own connection so the SQLite
+connection is only ever touched by that thread
+
+This module needs python 3
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# first party
+from .base import Connection
+from ..aio import AsyncInterface
+from ..compat import *
+
+
+class AsyncSQLiteConnection(Connection):
+    """Wraps the SQLite connection of the interface's thread so the transaction
+    methods can be awaited"""
+    def __init__(self, interface, connection):
+        self.interface = interface
+        self.connection = connection
+
+    @property
+    def closed(self):
+        return self.connection.closed
+
+    def in_transaction(self):
+        return self.connection.in_transaction()
+
+    async def transaction_start(self, name):
+        return await self.interface.run_sync(self.connection.transaction_start, name)
+
+    async def transaction_stop(self):
+        return await self.interface.run_sync(self.connection.transaction_stop)
+
+    async def transaction_fail(self, name):
+        return await self.interface.run_sync(self.connection.transaction_fail, name)
+
+
+class AsyncSQLite(AsyncInterface):
+    """The async SQLite interface
+
+    there is only one connection, so a task holds it (and every other task
+    waits) from the time it gets the connection until it frees it, for a
+    transaction that is until the transaction ends
+
+    the thread opens a new connection to the db, so a :memory: db can't be used,
+    the thread would get its own empty db instead of the sync interface's
+    """
+    executor = None
+
+    def __init__(self, interface):
+        if interface.connection_config.path == ":memory:":
+            raise ValueError(
+                "{} can't use a :memory: db, its thread would get a separate empty db, use a file instead".format(
+                    type(self).__name__
+                )
+            )
+
+        super(AsyncSQLite, self).__init__(interface)
+        # the configured interface could already be connected on another thread
+        self.interface = interface.spawn()
+
+    async def _connect(self, connection_config):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.lock = asyncio.Lock()
+        await self.run_sync(self.interface.connect)
+
+    async def run_sync(self, callback, *args, **kwargs):
+        """run callback(*args, **kwargs) on the interface's thread"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            functools.partial(callback, *args, **kwargs)
+        )
+
+    async def _get_connection(self, readonly=False):
+        await self.lock.acquire()
+        try:
+            connection = await self.run_sync(self.interface.get_connection)
+
+        except BaseException:
+            self.lock.release()
+            raise
+
+        return AsyncSQLiteConnection(self, connection)
+
+    async def _free_connection(self, connection):
+        try:
+            await self.run_sync(self.interface.free_connection, connection.connection)
+
+        finally:
+            self.lock.release()
+
+    async def _close(self):
+        await self.run_sync(self.interface.close)
+        self.executor.shutdown(wait=False)
+        self.executor = None
+
+    async def _query(self, query_str, query_args=None, **query_options):
+        query_options['connection'] = query_options['connection'].connection
+        return await self.run_sync(self.interface._query, query_str, query_args, **query_options)
+
+    async def _insert(self, schema, fields, **kwargs):
+        kwargs['connection'] = kwargs['connection'].connection
+        return await self.run_sync(self.interface._insert, schema, fields, **kwargs)
+
+    async def _handle_error(self, schema, e, **kwargs):
+        kwargs['connection'] = kwargs['connection'].connection
+        return await self.run_sync(self.interface._handle_error, schema, e, **kwargs)
@@ -6,11 +6,18 @@ import datetime
 
 # first party
 from .query import Query, Iterator
+from .batch import BatchResult
+from .session import get_session
 from . import decorators, utils
 from .interface import get_interface
 from .config import Schema, Field, ObjectField, Index
 from .compat import *
 
+if is_py3:
+    from .aio import AsyncOrmMixin
+else:
+    AsyncOrmMixin = object
+
 
 class OrmPool(utils.Pool):
     """
@@ -36,7 +43,7 @@ class OrmPool(utils.Pool):
         return self.orm_class.query.get_pk(pk)
 
 
-class Orm(object):
+class Orm(AsyncOrmMixin):
     """
     this is the parent class of any model Orm class you want to create that can access the db
 
@@ -100,8 +107,18 @@ class Orm(object):
 
     @decorators.classproperty
     def schema(cls):
-        """the Schema() instance that this class will derive all its db info from"""
-        return Schema.get_instance(cls)
+        """the Schema() instance that this class will derive all its db info from,
+        it is only looked up the first time it is needed by each class"""
+        schema = cls.__dict__.get("_schema_instance")
+        if schema is None:
+            schema = Schema.get_instance(cls)
+            cls._schema_instance = schema
+
+        elif schema.orm_class is not cls:
+            # another class with the same table name used the schema
+            schema.orm_class = cls
+
+        return schema
 
     @decorators.classproperty
     def interface(cls):
@@ -128,7 +145,7 @@ class Orm(object):
     @property
     def pk(self):
         """wrapper method to return the primary key, None if the primary key is not set"""
-        return getattr(self, self.schema.pk.name, None)
+        return getattr(self, self.schema.compiled.pk_name, None)
 
     @property
     def created(self):
@@ -168,6 +185,9 @@ class Orm(object):
 
         else:
             self.modify(fields, **fields_kwargs)
+            session = get_session()
+            if session is not None:
+                session.add(self, written=False)
 
     @classmethod
     def pool(cls, size=0):
@@ -241,11 +261,8 @@ class Orm(object):
 
         # this will run all the fields of the Orm, not just the fields in fields
         # dict, another name would be hydrate
-        pop_fields = {}
         fields = self.make_dict(fields, fields_kwargs)
-        for k in self.schema.fields.keys():
-            pop_fields[k] = fields.get(k, None)
-
+        pop_fields = {k: fields.get(k, None) for k in self.schema.compiled.field_names}
         self._populate(pop_fields)
 
     def _populate(self, fields):
@@ -254,13 +271,19 @@ class Orm(object):
 
         :param fields: dict, the fields that were passed in
         """
-        schema = self.schema
+        igets = self.schema.compiled.igets
         for k, v in fields.items():
-            fields[k] = schema.fields[k].iget(self, v)
+            iget = igets[k]
+            if iget:
+                fields[k] = iget(self, v)
 
         self.modify(fields)
         self.reset_modified()
 
+        session = get_session()
+        if session is not None:
+            session.add(self)
+
     def depopulate(self, is_update):
         """Get all the fields that need to be saved
 
@@ -268,26 +291,32 @@ class Orm(object):
         :returns: dict, key is field_name and val is the field value to be saved
         """
         fields = {}
-        schema = self.schema
-        for k, field in schema.fields.items():
-            is_modified = k in self.modified_fields
+        compiled = self.schema.compiled
+        pk_name = compiled.pk_name
+        modified_fields = self.modified_fields
+        for k, iset in compiled.isets.items():
+            is_modified = k in modified_fields
             orig_v = getattr(self, k)
-            v = field.iset(
-                self,
-                orig_v,
-                is_update=is_update,
-                is_modified=is_modified
-            )
+            if iset:
+                v = iset(
+                    self,
+                    orig_v,
+                    is_update=is_update,
+                    is_modified=is_modified
+                )
+
+            else:
+                v = orig_v
 
             if is_modified or v is not None:
-                if is_update and field.is_pk() and v == orig_v:
+                if is_update and k == pk_name and v == orig_v:
                     continue
 
                 else:
                     fields[k] = v
 
         if not is_update:
-            for field_name in schema.required_fields.keys():
+            for field_name in compiled.required_field_names:
                 if field_name not in fields:
                     raise KeyError("Missing required field {}".format(field_name))
 
@@ -303,9 +332,14 @@ class Orm(object):
         q = self.query
         q.set_fields(fields)
         pk = q.insert()
-        if pk:
+        if isinstance(pk, BatchResult):
+            # the insert is in a batch, the pk will be set when it is flushed
             fields = q.fields
-            fields[schema.pk.name] = pk
+            pk.on_result(lambda pk: self._populate(dict(fields, **{schema.pk_name: pk})))
+
+        elif pk:
+            fields = q.fields
+            fields[schema.pk_name] = pk
             self._populate(fields)
 
         else:
@@ -322,12 +356,18 @@ class Orm(object):
 
         pk = self.pk
         if pk:
-            q.is_field(self.schema.pk.name, pk)
+            q.is_field(self.schema.pk_name, pk)
 
         else:
             raise ValueError("You cannot update without a primary key")
 
-        if q.update():
+        r = q.update()
+        if isinstance(r, BatchResult):
+            # the update is in a batch, the fields aren't saved until it is flushed
+            fields = q.fields
+            r.on_result(lambda r: self._populate(fields))
+
+        elif r:
             fields = q.fields
             self._populate(fields)
 
@@ -348,7 +388,7 @@ class Orm(object):
 
         # we will only use the primary key if it hasn't been modified
         pk = None
-        if self.schema.pk.name not in self.modified_fields:
+        if self.schema.pk_name not in self.modified_fields:
             pk = self.pk
 
         if pk:
@@ -364,20 +404,33 @@ class Orm(object):
         q = self.query
         pk = self.pk
         if pk:
-            pk_name = self.schema.pk.name
-            self.query.is_field(pk_name, pk).delete()
-            setattr(self, pk_name, None)
-
-            # mark all the fields that still exist as modified
-            self.reset_modified()
-            for field_name in self.schema.fields:
-                if getattr(self, field_name, None) != None:
-                    self.modified_fields.add(field_name)
+            pk_name = self.schema.pk_name
+            r = self.query.is_field(pk_name, pk).delete()
+            if isinstance(r, BatchResult):
+                # the delete is in a batch, the row is still there until it is flushed
+                r.on_result(lambda r: self.deleted())
 
+            else:
+                self.deleted()
             ret = True
 
         return ret
 
+    def deleted(self):
+        """the row of this orm was deleted from the db, so this becomes a new orm
+        that could be inserted again"""
+        setattr(self, self.schema.pk_name, None)
+
+        session = get_session()
+        if session is not None:
+            session.discard(self)
+
+        # mark all the fields that still exist as modified
+        self.reset_modified()
+        for field_name in self.schema.fields:
+            if getattr(self, field_name, None) != None:
+                self.modified_fields.add(field_name)
+
     def is_modified(self):
         """true if a field has been changed from its original value, false otherwise"""
         return len(self.modified_fields) > 0
@@ -390,12 +443,8 @@ class Orm(object):
         you don't want set() to do anything, you can Orm(**fields) and then orm.reset_modified() to
         clear all the passed in fields from the modified list
         """
-        self.modified_fields = set()
-
         # compensate for us not having knowledge of certain fields changing
-        for field_name, field in self.schema.normal_fields.items():
-            if isinstance(field, ObjectField):
-                self.modified_fields.add(field_name)
+        self.modified_fields = set(self.schema.compiled.object_field_names)
 
     def modify(self, fields=None, **fields_kwargs):
         """update the fields of this instance with the values in dict fields
@@ -411,9 +460,9 @@ class Orm(object):
         modified_fields = set()
         fields = self.make_dict(fields, fields_kwargs)
         fields = self._modify(fields)
+        schema_fields = self.schema.fields
         for field_name, field_val in fields.items():
-            in_schema = field_name in self.schema.fields
-            if in_schema:
+            if field_name in schema_fields:
                 setattr(self, field_name, field_val)
                 modified_fields.add(field_name)
 
@@ -430,12 +479,13 @@ class Orm(object):
         return fields
 
     def __setattr__(self, field_name, field_val):
-        if field_name in self.schema.fields:
-            if field_name == self.schema.pk.name:
+        compiled = self.schema.compiled
+        if field_name in compiled.fields:
+            if field_name == compiled.pk_name:
                 # we mark everything as dirty because the primary key has changed
                 # and so a new row would be inserted into the db
                 self.modified_fields.add(field_name)
-                self.modified_fields.update(self.schema.normal_fields.keys())
+                self.modified_fields.update(compiled.normal_field_names)
 
             else:
                 self.modified_fields.add(field_name)
@@ -5,7 +5,6 @@ Classes and stuff that handle querying the interface for a passed in Orm class
 from __future__ import unicode_literals, division, print_function, absolute_import
 import copy
 from collections import defaultdict, Mapping
-import datetime
 import logging
 import os
 from contextlib import contextmanager
@@ -14,18 +13,23 @@ from multiprocessing import queues
 import math
 import inspect
 import time
-
+import random
 import threading
-try:
-    import thread
-except ImportError:
-    thread = None
 
 from . import decorators
-from .utils import make_list, get_objects, make_dict, make_hash
+from .utils import make_list, get_objects, make_dict, make_hashable
 from .interface import get_interfaces
+from .cache import CacheNamespace, SingleFlight, get_identity_map, get_identity_maps
+from .batch import BatchResult
+from .session import get_session, hydrate
+from .instrument import timer, take_stats, add_hydration, get_listeners, querying
 from .compat import *
 
+if is_py3:
+    from .aio import AsyncQueryMixin
+else:
+    AsyncQueryMixin = object
+
 
 logger = logging.getLogger(__name__)
 
@@ -199,6 +203,8 @@ class ResultsIterator(BaseIterator):
         self.has_more = has_more
         self.query = query.copy()
         self._values = False
+        # the stats of the query that fetched results if it is being profiled
+        self.stats = take_stats()
         self.reset()
 
     def reset(self):
@@ -268,7 +274,14 @@ class ResultsIterator(BaseIterator):
 
         else:
             if self.orm_class:
-                r = self.orm_class(d, hydrate=True)
+                if self.stats:
+                    start = timer()
+                    r = hydrate(self.orm_class, d)
+                    add_hydration(self.stats, start)
+
+                else:
+                    r = hydrate(self.orm_class, d)
+
             else:
                 r = d
 
@@ -402,6 +415,10 @@ class AllIterator(ResultsIterator):
 
 
 class Fields(object):
+
+    value_index = None
+    """the index of field_args that holds the value, it is left out of the shape"""
+
     def __init__(self):
         self.reset()
 
@@ -409,12 +426,35 @@ class Fields(object):
         self.fields = []
         self.fields_map = defaultdict(list)
         self.options = {}
+        self.fingerprints = []
+        self.shapes = []
 
     def append(self, field_name, field_args):
         index = len(self.fields)
         self.fields.append(field_args)
         self.fields_map[field_name].append(index)
 
+        # the fingerprints are figured out as fields are added so they don't
+        # have to be when the query is run
+        fingerprint = make_hashable(field_args)
+        self.fingerprints.append(fingerprint)
+        i = self.value_index
+        if i is None:
+            self.shapes.append(fingerprint)
+        else:
+            # a None value usually changes the query (eg, IS NULL) so it is kept
+            val = None if field_args[i] is None else "?"
+            self.shapes.append(fingerprint[:i] + (val,) + fingerprint[i + 1:])
+
+    def fingerprint(self):
+        """return a hashable value that is equal for Fields with the same fields
+        and options"""
+        return (tuple(self.fingerprints), make_hashable(self.options))
+
+    def shape(self):
+        """same as fingerprint() but without the values"""
+        return (tuple(self.shapes), make_hashable(self.options))
+
     def __iter__(self):
         for field in self.fields:
             yield field
@@ -448,9 +488,25 @@ class Fields(object):
         return "{}-{}".format(self.fields, self.options)
 
 
+class FieldsSet(Fields):
+    """the fields that will be selected, inserted, or updated, each field_args is
+    [field_name, field_val]"""
+    value_index = 1
+
+
+class FieldsSort(Fields):
+    """each field_args is [direction, field_name, field_vals]"""
+    value_index = 2
+
+
 class FieldsWhere(Fields):
     """A wrapper around the Fields class that assures fields are only set once, unless
-    they are less than or greater than settings"""
+    they are less than or greater than settings
+
+    each field_args is [command, field_name, field_val, field_kwargs]
+    """
+    value_index = 2
+
     def append(self, field_name, field_args):
         if field_name in self.fields_map:
             cmd_old = self.fields[self.fields_map[field_name][0]][0]
@@ -557,11 +613,17 @@ class Limit(object):
     def has_limit(self):
         return self.limit > 0
 
+    def fingerprint(self):
+        return (self.limit, self.offset)
+
+    def shape(self):
+        return (self.limit > 0, self.offset > 0)
+
     def __str__(self):
         return "limit: {}, offset: {}".format(self.limit, self.offset)
 
 
-class Query(object):
+class Query(AsyncQueryMixin):
     """
     Handle standard query creation and allow interface querying
 
@@ -569,9 +631,9 @@ class Query(object):
         q = Query(orm_class)
         q.is_foo(1).desc_bar().set_limit(10).set_page(2).get()
     """
-    fields_set_class = Fields
+    fields_set_class = FieldsSet
     fields_where_class = FieldsWhere
-    fields_sort_class = Fields
+    fields_sort_class = FieldsSort
     bounds_class = Limit
 
     @property
@@ -634,6 +696,8 @@ class Query(object):
         # be raised because a common case is: self.if_foo(Bar.query.is_che(True).pks).get()
         # which should result in an empty set if there are no rows where che = TRUE
         self.can_get = True
+        self.query_timeout = None
+        self.query_settings = {}
 
     def ref(self, orm_classpath, cls_pk=None):
         """
@@ -992,12 +1056,46 @@ class Query(object):
         self.bounds.page = page
         return self
 
+    def timeout(self, timeout):
+        """stop the query if it runs longer than timeout
+
+        :param timeout: int, milliseconds, None for no timeout
+        :returns: self, for fluid interface
+        """
+        self.query_timeout = timeout
+        return self
+
+    def settings(self, **settings):
+        """set db settings that will only be used for this query's db calls
+
+        example --
+            Foo.query.settings(work_mem="256MB", enable_seqscan=False).get()
+
+        these are db specific, on Postgres they are SET LOCAL inside the query's
+        transaction, SQLite ignores them
+
+        :param **settings: the setting names and their values
+        :returns: self, for fluid interface
+        """
+        self.query_settings.update(settings)
+        return self
+
+    def query_options(self, **kwargs):
+        """return kwargs with the timeout and settings of this query that are
+        passed to the interface"""
+        if self.query_timeout:
+            kwargs.setdefault("timeout", self.query_timeout)
+        if self.query_settings:
+            kwargs.setdefault("settings", self.query_settings)
+        return kwargs
+
     def cursor(self, limit=None, page=None):
         # TODO -- combine the common parts of this method and get()
         has_more = False
         self.bounds.paginate = True
         limit_paginate, offset = self.bounds.get(limit, page)
         self.default_val = []
+        take_stats()
         results = self._query('get', cursor_result=True)
 
         if limit_paginate:
@@ -1020,6 +1118,9 @@ class Query(object):
         self.bounds.paginate = True
         limit_paginate, offset = self.bounds.get(limit, page)
         self.default_val = []
+        im = self._get_identity_map()
+        token = None if im is None else im.token(self.schema)
+        take_stats() # so a cache hit isn't given an earlier query's stats
         results = self._query('get')
 
         if limit_paginate:
@@ -1028,6 +1129,9 @@ class Query(object):
                 has_more = True
                 results.pop(-1)
 
+        if im is not None and results:
+            im.set_many(self.schema, results, token=token)
+
         it = ResultsIterator(results, orm_class=self.orm_class, has_more=has_more, query=self)
         return self.iterator_class(it)
 
@@ -1049,9 +1153,22 @@ class Query(object):
         """get one row from the db"""
         self.default_val = None
         o = self.default_val
+        im = self._get_identity_map()
+        token = None if im is None else im.token(self.schema)
+        take_stats()
         d = self._query('get_one')
         if d:
-            o = self.orm_class(d, hydrate=True)
+            if im is not None:
+                im.set(self.schema, d[self.schema.pk_name], d, token=token)
+
+            stats = take_stats()
+            if stats:
+                start = timer()
+                o = hydrate(self.orm_class, d)
+                add_hydration(stats, start)
+
+            else:
+                o = hydrate(self.orm_class, d)
         return o
 
     def values(self, limit=None, page=None):
@@ -1090,13 +1207,62 @@ class Query(object):
         return self.select_pk().value()
 
     def get_pks(self, field_vals):
-        """convenience method for running in__id([...]).get() since this is so common"""
-        field_name = self.schema.pk.name
+        """convenience method for running in__id([...]).get() since this is so common
+
+        if there is an active identity map then only the primary keys that aren't
+        in the map will be fetched from the db
+        """
+        field_name = self.schema.pk_name
+        im = self._get_identity_map(lookup=True)
+        if im is not None:
+            pks = make_list(field_vals)
+            found = im.get_many(self.schema, pks)
+            if found:
+                take_stats()
+                results = []
+                missing = []
+                seen = set()
+                for pk in pks:
+                    if pk not in seen:
+                        seen.add(pk)
+                        if pk in found:
+                            results.append(found[pk])
+                        else:
+                            missing.append(pk)
+
+                if missing:
+                    self.default_val = []
+                    token = im.token(self.schema)
+                    rows = self.in_field(field_name, missing)._query('get')
+                    im.set_many(self.schema, rows, token=token)
+                    results.extend(rows)
+
+                it = ResultsIterator(results, orm_class=self.orm_class, query=self)
+                return self.iterator_class(it)
+
         return self.in_field(field_name, field_vals).get()
 
     def get_pk(self, field_val):
-        """convenience method for running is_pk(_id).get_one() since this is so common"""
-        field_name = self.schema.pk.name
+        """convenience method for running is_pk(_id).get_one() since this is so common
+
+        if there is an active identity map then the db will only be queried if
+        the primary key isn't in the map, and if there is an active session the
+        instance it holds is returned without going to the db
+        """
+        session = get_session()
+        if session is not None and self.orm_class:
+            if not (self.fields_set or self.fields_where or self.bounds):
+                o = session.get(self.orm_class, field_val)
+                if o is not None:
+                    return o
+
+        im = self._get_identity_map(lookup=True)
+        if im is not None:
+            d, hit = im.get(self.schema, field_val)
+            if hit:
+                return hydrate(self.orm_class, d)
+
+        field_name = self.schema.pk_name
         return self.is_field(field_name, field_val).get_one()
 
     def first(self):
@@ -1122,6 +1288,18 @@ class Query(object):
 
         return ret
 
+    def explain(self, analyze=False):
+        """return how the db will run get() for this query, this goes straight to
+        the db so it is never cached
+
+        analyze -- boolean -- also run the query so the plan has what actually
+            happened, SQLite can't analyze
+        return -- list -- on PostgreSQL the EXPLAIN (FORMAT JSON) plan, on SQLite
+            the EXPLAIN QUERY PLAN rows as dicts
+        """
+        if not self.can_get: return []
+        return self.interface.explain(self.schema, self, analyze=analyze, **self.query_options())
+
     def has(self):
         """returns true if there is atleast one row in the db matching the query, False otherwise"""
         v = self.get_one()
@@ -1135,7 +1313,8 @@ class Query(object):
         #self.set_fields(fields)
         return self.interface.insert(
             self.schema,
-            self.fields
+            self.fields,
+            **self.query_options()
         )
 
         return self.interface.insert(self.schema, self.fields)
@@ -1146,17 +1325,22 @@ class Query(object):
         #fields = self.fields
         #fields = self.orm_class.depart(self.fields, is_update=True)
         #self.set_fields(fields)
-        return self.interface.update(
+        ret = self.interface.update(
             self.schema,
             self.fields,
-            self
+            self,
+            **self.query_options()
         )
+        self.written(ret, self._invalidate_identity_maps)
+        return ret
         #return self._query('update')
 
     def delete(self):
         """remove fields matching the where criteria"""
         self.default_val = None
-        return self._query('delete')
+        ret = self._query('delete')
+        self.written(ret, self._invalidate_identity_maps)
+        return ret
 
     def raw(self, query_str, *query_args, **query_options):
         """
@@ -1173,7 +1357,7 @@ class Query(object):
         return -- mixed -- depends on the backend and the type of query
         """
         i = self.interface
-        return i.query(query_str, *query_args, **query_options)
+        return i.query(query_str, *query_args, **self.query_options(**query_options))
 
     def reduce(self, target_map, target_reduce, threads=0):
         """map/reduce this query among a bunch of processes
@@ -1270,12 +1454,92 @@ class Query(object):
         finally:
             inter.close()
 
+    def _get_identity_map(self, lookup=False):
+        """return the identity map this query should use, None if it shouldn't use one
+
+        :param lookup: bool, True if the map will be used to find rows instead of
+            the db, this can only happen if there is nothing besides the primary
+            key that would filter the rows
+        :returns: cache.IdentityMap
+        """
+        if not self.orm_class or self.fields_set: return None
+        if lookup and (self.fields_where or self.bounds): return None
+        return get_identity_map()
+
+    def _get_where_pks(self):
+        """return the primary keys this query is limited to, None if the where
+        clause is anything more than an is or in on the primary key"""
+        ret = None
+        if len(self.fields_where) == 1:
+            command, field_name, field_val, field_kwargs = self.fields_where[0]
+            if field_name == self.schema.pk_name and not field_kwargs:
+                if command == "is":
+                    ret = [field_val]
+                elif command == "in":
+                    ret = list(field_val)
+        return ret
+
+    def written(self, ret, callback):
+        """call callback() once the write that returned ret is in the db, if the
+        write was queued in a batch (see Interface.batch()) that is after the
+        batch has been flushed
+
+        :param ret: mixed, what the write returned
+        :param callback: callable
+        """
+        if isinstance(ret, BatchResult):
+            ret.on_result(lambda value: callback())
+        else:
+            callback()
+
+    def _invalidate_identity_maps(self):
+        """a write has happened, so any rows it could have touched can't be trusted"""
+        ims = get_identity_maps()
+        if ims and self.orm_class:
+            pks = self._get_where_pks()
+            for im in ims:
+                im.invalidate(self.schema, pks)
+
     def _query(self, method_name, **kwargs):
         if not self.can_get: return self.default_val
         i = self.interface
         s = self.schema
+        kwargs = self.query_options(**kwargs)
+        if get_listeners():
+            with querying(self):
+                return getattr(i, method_name)(s, self, **kwargs)
         return getattr(i, method_name)(s, self, **kwargs) # i.method_name(schema, query)
 
+    def fingerprint(self):
+        """return a hashable value that will be equal for any two queries that
+        select, filter, sort, and bound the same table the same way with the
+        same values
+
+        :returns: tuple
+        """
+        return (
+            self.orm_class.table_name if self.orm_class else None,
+            self.fields_set.fingerprint(),
+            self.fields_where.fingerprint(),
+            self.fields_sort.fingerprint(),
+            self.bounds.fingerprint(),
+        )
+
+    def shape(self):
+        """same as fingerprint() but without any of the values, so all the queries
+        that only differ by their values (eg, is_pk(1) and is_pk(2)) have the same
+        shape
+
+        :returns: tuple
+        """
+        return (
+            self.orm_class.table_name if self.orm_class else None,
+            self.fields_set.shape(),
+            self.fields_where.shape(),
+            self.fields_sort.shape(),
+            self.bounds.shape(),
+        )
+
     def copy(self):
         """nice handy wrapper around the deepcopy"""
         return copy.deepcopy(self)
@@ -1347,7 +1611,15 @@ class BaseCacheQuery(Query):
 
     A child class will have to implement the methods that raise NotImplementedError
     in order to have a valid CacheQuery child
+
+    concurrent misses for the same key are coalesced, so only one thread will
+    query the db and the others will wait for its result. If cache_get() returns
+    a value and sets self.cache_stale to True then the value will be returned
+    while it is refreshed in a background thread (self.cache_refresh_thread)
     """
+    cache_flight = SingleFlight()
+    """coalesces the db queries of concurrent cache misses"""
+
     def cache_delete(self, method_name):
         method = getattr(self, "cache_delete_{}".format(method_name), None)
         if method:
@@ -1371,8 +1643,41 @@ class BaseCacheQuery(Query):
         the cache, otherwise False"""
         raise NotImplementedError()
 
+    def cache_fetch(self, method_name, key):
+        """query the db and cache the result"""
+        result = super(BaseCacheQuery, self)._query(method_name)
+        self.cache_set(key, result)
+        return result
+
+    def cache_refresh(self, method_name, key):
+        """refresh the value at key in a background thread
+
+        :returns: threading.Thread, None if the key is already being refreshed
+        """
+        flight_key = (str(self.schema), key)
+        if self.cache_flight.busy(flight_key): return None
+
+        query = self.copy()
+        def target():
+            try:
+                self.cache_flight.do(flight_key, query.cache_fetch, method_name, key)
+
+            except Exception as e:
+                logger.warning("Cache refresh on {} for key {} failed: {}".format(
+                    self.schema,
+                    key,
+                    e
+                ))
+
+        t = threading.Thread(target=target)
+        t.daemon = True
+        t.start()
+        return t
+
     def _query(self, method_name):
         cache_hit = False
+        self.cache_stale = False
+        self.cache_refresh_thread = None
         cache_key = self.cache_key(method_name)
         table_name = str(self.schema)
         if cache_key:
@@ -1381,12 +1686,25 @@ class BaseCacheQuery(Query):
 
         if not cache_hit:
             logger.debug("Cache miss on {} for key {}".format(table_name, cache_key))
-            result = super(BaseCacheQuery, self)._query(method_name)
             if cache_key:
-                self.cache_set(cache_key, result)
+                result, cache_hit = self.cache_flight.do(
+                    (table_name, cache_key),
+                    self.cache_fetch,
+                    method_name,
+                    cache_key
+                )
+                if isinstance(result, list):
+                    # every caller got the same list and the caller is free to
+                    # change it (eg, get() pops the pagination row)
+                    result = list(result)
+
+            else:
+                result = super(BaseCacheQuery, self)._query(method_name)
 
         else:
             logger.debug("Cache hit on {} for key {}".format(table_name, cache_key))
+            if self.cache_stale:
+                self.cache_refresh_thread = self.cache_refresh(method_name, cache_key)
 
         self.cache_hit = cache_hit
         return result
@@ -1394,95 +1712,36 @@ class BaseCacheQuery(Query):
     def update(self):
         ret = super(BaseCacheQuery, self).update()
         if ret:
-            logger.debug("Cache delete on {} update".format(self.schema))
-            self.cache_delete("update")
+            self.written(ret, lambda: self.cache_written("update"))
         return ret
 
     def insert(self):
         ret = super(BaseCacheQuery, self).insert()
         if ret:
-            logger.debug("Cache delete on {} insert".format(self.schema))
-            self.cache_delete("insert")
+            self.written(ret, lambda: self.cache_written("insert"))
         return ret
 
+    def cache_written(self, method_name):
+        logger.debug("Cache delete on {} {}".format(self.schema, method_name))
+        self.cache_delete(method_name)
+
     def delete(self):
         ret = super(BaseCacheQuery, self).delete()
         if ret:
-            logger.debug("Cache delete on {} delete".format(self.schema))
-            self.cache_delete("delete")
-        return ret
-
-
-class CacheNamespace(defaultdict):
-    """This is what actually does the memory processing caching of CacheQuery, it
-    namespaces by process_id -> thread_id -> table, otherwise it is identical to
-    any other default dict that sets default_factory to itself
-    """
-
-    @property
-    def active(self):
-        ret = False
-        cn = self.get_process()
-        if "active" in cn:
-            ret = cn["active"]
-        return ret
-
-    @active.setter
-    def active(self, v):
-        cn = self.get_process()
-        cn["active"] = bool(v)
-
-    @active.deleter
-    def active(self):
-        self.get_process().pop("active", None)
-
-    @property
-    def ttl(self):
-        """how long you should cache results for cacheable queries"""
-        ret = 3600
-        cn = self.get_process()
-        if "ttl" in cn:
-            ret = cn["ttl"]
+            self.written(ret, lambda: self.cache_written("delete"))
         return ret
 
-    @ttl.setter
-    def ttl(self, ttl):
-        cn = self.get_process()
-        cn["ttl"] = int(ttl)
 
-    @ttl.deleter
-    def ttl(self):
-        self.get_process().pop("ttl", None)
-
-    @property
-    def process_id(self):
-        ret = ""
-        if thread:
-            f = getattr(os, 'getpid', None)
-            if f:
-                ret = str(f())
-        return ret
-
-    @property
-    def thread_id(self):
-        ret = ""
-        if thread:
-            ret = str(thread.get_ident())
-        return ret
-
-    def __init__(self):
-        super(CacheNamespace, self).__init__(CacheNamespace)
-
-    def get_process(self):
-        return self[self.process_id][self.thread_id]
+class CacheQuery(BaseCacheQuery):
+    """a simple in-memory cache that is shared by all the threads of the process,
+    writes to a table will invalidate all the cached results of that table
 
-    def get_table(self, schema):
-        return self.get_process()[str(schema)]
+    to share the cached results with the other processes on the host set a backend:
 
+        CacheQuery.cache_namespace.backend = cache.SQLiteCacheBackend(path)
 
-class CacheQuery(BaseCacheQuery):
-    """a simple in-memory cache, ttls should be short since this has
-    a very naive invalidation mechanism"""
+    see -- cache.CacheNamespace
+    """
 
     _cache_namespace = CacheNamespace()
     """store the cached values in memory"""
@@ -1495,15 +1754,35 @@ class CacheQuery(BaseCacheQuery):
     def cache_activate(cls, v):
         cls.cache_namespace.active = bool(v)
 
-    @property
-    def cache_table(self):
-        return self.cache_namespace.get_table(self.schema)
+    @classmethod
+    def cache_stats(cls):
+        """return what the cache has been doing
+
+        see -- cache.CacheStats.snapshot()
+        """
+        return cls.cache_namespace.stats.snapshot()
 
     @classmethod
     @contextmanager
-    def cache(cls, ttl=60):
+    def cache(cls, ttl=60, stale_ttl=0, jitter=0.0):
+        """activate caching for the current thread while in the with block
+
+        the cached values are not cleared when the with block ends, they will be
+        available to any other thread with activated caching until they expire
+        or are invalidated by a write to the table
+
+        :param ttl: float, how many seconds results should be cached
+        :param stale_ttl: float, for how many seconds after a result has expired it
+            can still be returned while it is refreshed in the background
+        :param jitter: float, between 0.0 and 1.0, the ttl of each result will be
+            randomly changed by up to this fraction so results cached at the same
+            time don't all expire at the same time
+        """
         cn = cls.cache_namespace
+        prev = (cn.active, cn.ttl, cn.stale_ttl, cn.jitter)
         cn.ttl = ttl
+        cn.stale_ttl = stale_ttl
+        cn.jitter = jitter
         cls.cache_activate(True)
 
         try:
@@ -1511,27 +1790,20 @@ class CacheQuery(BaseCacheQuery):
 
         finally:
             # cleanup
-            cn.clear()
-            cls.cache_activate(False)
+            active, cn.ttl, cn.stale_ttl, cn.jitter = prev
+            cls.cache_activate(active)
 
     def cache_delete_update(self):
-        self.cache_table.clear()
+        self.cache_namespace.invalidate(self.schema)
 
     def cache_delete_insert(self):
-        self.cache_table.clear()
+        self.cache_namespace.invalidate(self.schema)
 
     def cache_delete_delete(self):
-        self.cache_table.clear()
+        self.cache_namespace.invalidate(self.schema)
 
     def cache_hash(self, method_name):
-        key = make_hash(
-            method_name,
-            self.fields_set,
-            self.fields_where,
-            self.fields_sort,
-            self.bounds
-        )
-        return key
+        return (method_name,) + self.fingerprint()
 
     def cache_key_get_one(self):
         return self.cache_hash("get_one")
@@ -1543,26 +1815,61 @@ class CacheQuery(BaseCacheQuery):
         return self.cache_hash("count")
 
     def cache_set(self, key, result):
+        if isinstance(result, list):
+            # the caller is free to change the list it gets (eg, get() pops the
+            # pagination row) so the cache holds its own copy
+            result = list(result)
+
         cn = self.cache_namespace
-        now = datetime.datetime.utcnow()
-        self.cache_table[key] = {
-            "ttl": cn.ttl,
-            "datetime": now,
-            "result": result
-        }
+        ttl, stale_ttl, jitter = getattr(
+            self,
+            "_cache_settings",
+            (cn.ttl, cn.stale_ttl, cn.jitter)
+        )
+        if jitter:
+            ttl *= 1.0 + random.uniform(-jitter, jitter)
+
+        cn.set(
+            self.schema,
+            key,
+            {
+                "ttl": ttl,
+                "timestamp": time.time(),
+                "result": result
+            },
+            generation=getattr(self, "_cache_generation", None),
+            ttl=ttl + stale_ttl,
+        )
 
     def cache_get(self, key):
         result = None
         cache_hit = False
-        ct = self.cache_table
-        now = datetime.datetime.utcnow()
-        if key in ct:
-            val = ct[key]
-            td = now - val["datetime"]
-            if td.total_seconds() < val["ttl"]:
+        cn = self.cache_namespace
+        # the generation has to be checked before the db is queried on a miss
+        # so a write that happens while the query is running isn't masked
+        self._cache_generation = cn.generation(self.schema)
+        # a stale value is refreshed in another thread, which needs to use the
+        # settings of this thread
+        self._cache_settings = (cn.ttl, cn.stale_ttl, cn.jitter)
+        val, hit = cn.get(self.schema, key, generation=self._cache_generation)
+        counter = "misses"
+        if hit:
+            age = time.time() - val["timestamp"]
+            if age < val["ttl"]:
                 cache_hit = True
+                counter = "hits"
+
+            elif age < val["ttl"] + cn.stale_ttl:
+                cache_hit = True
+                self.cache_stale = True
+                counter = "stale"
+
+            if cache_hit:
                 result = val["result"]
+                if isinstance(result, list):
+                    result = list(result)
 
+        cn.stats.incr(str(self.schema), counter, self.shape())
         return result, cache_hit
 
     def cache_key(self, method_name):
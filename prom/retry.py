@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+How an Interface retries a call that failed because the db went away
+
+An Interface has a RetryPolicy (Interface.retry_policy) that decorators.reconnecting
+uses to run the wrapped method. The policy asks the interface if the error can be
+retried (Interface.is_retryable_error), sleeps an exponentially growing and
+randomized amount of time between attempts so a bunch of workers don't all hit the
+db at the same moment, and gives up once the attempts or the deadline run out.
+
+Each policy also has a CircuitBreaker, after enough calls in a row have failed the
+breaker opens and every call fails right away with a CircuitOpenError instead of
+piling onto a db that is down, after a while the breaker lets calls through again
+to see if the db has come back
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import time
+import random
+import threading
+import logging
+
+from .exception import InterfaceError
+from .compat import *
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(InterfaceError):
+    """raised when a call isn't even tried because the circuit breaker is open"""
+    pass
+
+
+class CircuitBreaker(object):
+    """Keeps track of consecutive failures and fails fast once there are too many
+
+    closed -- calls go through, this is the normal state
+    open -- calls fail right away, after timeout seconds the breaker goes half open
+    half_open -- calls go through, the first one to finish will close the breaker
+        if it succeeded or open it again if it failed
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold=5, timeout=30.0):
+        """
+        :param threshold: int, how many failures in a row open the breaker, 0 to
+            never open it
+        :param timeout: float, how many seconds the breaker stays open
+        """
+        self.threshold = int(threshold)
+        self.timeout = float(timeout)
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened = 0.0
+        self._state = self.CLOSED
+
+    @property
+    def state(self):
+        with self.lock:
+            return self.get_state()
+
+    def get_state(self):
+        """return the current state, this should be called while holding the lock"""
+        if self._state == self.OPEN and time.time() - self.opened >= self.timeout:
+            self._state = self.HALF_OPEN
+            logger.info("Circuit breaker half open")
+        return self._state
+
+    def allow(self):
+        """return True if a call should be tried"""
+        with self.lock:
+            return self.get_state() != self.OPEN
+
+    def success(self):
+        with self.lock:
+            if self._state != self.CLOSED:
+                logger.info("Circuit breaker closed")
+            self._state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        """record a failure
+
+        :returns: bool, True if this failure opened the breaker
+        """
+        with self.lock:
+            self.failures += 1
+            state = self.get_state()
+            if self.threshold > 0 and state != self.OPEN:
+                if state == self.HALF_OPEN or self.failures >= self.threshold:
+                    self._state = self.OPEN
+                    self.opened = time.time()
+                    logger.warning("Circuit breaker open after {} failures".format(self.failures))
+                    return True
+        return False
+
+
+class RetryPolicy(object):
+    """Runs interface calls, retrying the ones that fail because of the connection
+
+    example --
+        # all the values can also be set with dsn options, see create()
+        interface.retry_policy = RetryPolicy(attempts=5, backoff=0.5, deadline=10)
+        interface.retry_policy.stats() # {"calls": ..., "retries": ..., ...}
+    """
+    counter_names = ("calls", "retries", "failures", "rejected", "opened")
+    """calls -- every call, retries -- every attempt after the first,
+    failures -- calls that failed with a retryable error after all their attempts,
+    rejected -- calls the open breaker didn't let through,
+    opened -- how many times the breaker opened"""
+
+    @classmethod
+    def create(cls, connection_config):
+        """create a policy using the options of the connection_config, this is how
+        an Interface gets its policy
+
+        :param connection_config: config.Connection
+        :returns: RetryPolicy
+        """
+        options = connection_config.options if connection_config else {}
+        return cls(
+            attempts=options.get("reconnect_attempts", 3),
+            backoff=options.get("reconnect_backoff", 1.0),
+            max_backoff=options.get("reconnect_max_backoff", 30.0),
+            jitter=options.get("reconnect_jitter", 1),
+            deadline=options.get("reconnect_deadline", 0.0),
+            breaker=CircuitBreaker(
+                threshold=options.get("breaker_threshold", 0),
+                timeout=options.get("breaker_timeout", 30.0),
+            ),
+        )
+
+    def __init__(self, attempts=3, backoff=1.0, max_backoff=30.0, jitter=True, deadline=0.0, breaker=None):
+        """
+        :param attempts: int, how many times a call can be tried
+        :param backoff: float, the seconds to wait before the first retry, every
+            retry after that will wait twice as long as the one before it
+        :param max_backoff: float, the most seconds to wait before a retry
+        :param jitter: bool, True to wait a random amount between zero and the
+            backoff so retrying clients spread out
+        :param deadline: float, the most seconds a call can take with all its
+            retries, 0 for no deadline
+        :param breaker: CircuitBreaker
+        """
+        self.attempts = int(attempts)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.jitter = bool(int(jitter))
+        self.deadline = float(deadline)
+        self.breaker = breaker if breaker else CircuitBreaker(threshold=0)
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(self.counter_names, 0)
+
+    def incr(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        """return a copy of the counters and the state of the breaker"""
+        with self.lock:
+            ret = dict(self.counters)
+        ret["state"] = self.breaker.state
+        return ret
+
+    def get_backoff(self, attempt, backoff=None):
+        """return how many seconds to wait before attempt
+
+        :param attempt: int, the attempt that is about to be tried, starts at 1
+        :param backoff: float, overrides self.backoff
+        :returns: float
+        """
+        if attempt <= 1: return 0.0
+        backoff = self.backoff if backoff is None else float(backoff)
+        ret = min(self.max_backoff, backoff * (2 ** (attempt - 2)))
+        if self.jitter:
+            ret = random.uniform(0, ret)
+        return ret
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def call(self, interface, callback, args=None, kwargs=None, attempts=None, backoff=None):
+        """run callback(*args, **kwargs), retrying it if it fails in a way
+        interface says can be retried
+
+        :param interface: Interface
+        :param callback: callable, usually an interface method
+        :param args: list, the positional arguments of callback
+        :param kwargs: dict, the keyword arguments of callback
+        :param attempts: int, overrides self.attempts
+        :param backoff: float, overrides self.backoff
+        :returns: whatever callback returns
+        """
+        args = args or ()
+        kwargs = kwargs or {}
+        attempts = self.attempts if attempts is None else int(attempts)
+
+        # if the call was given a connection that is in a transaction there is no
+        # point in retrying, the transaction is gone with the connection
+        connection = kwargs.get("connection", None)
+        if connection is not None and connection.in_transaction():
+            attempts = 1
+
+        self.incr("calls")
+        start = time.time()
+        for attempt in range(1, attempts + 1):
+            if attempt > 1:
+                logger.debug("sleeping {} seconds before attempt {}".format(
+                    backoff_seconds,
+                    attempt
+                ))
+                self.sleep(backoff_seconds)
+
+            if not self.breaker.allow():
+                self.incr("rejected")
+                raise CircuitOpenError("circuit breaker is open, not calling the db")
+
+            if attempt > 1:
+                self.incr("retries")
+
+            try:
+                ret = callback(*args, **kwargs)
+
+            except InterfaceError as e:
+                if not interface.is_retryable_error(e):
+                    raise
+
+                if self.breaker.failure():
+                    self.incr("opened")
+
+                if attempt == attempts:
+                    logger.debug("all {} attempts failed".format(attempts))
+                    self.incr("failures")
+                    raise
+
+                backoff_seconds = self.get_backoff(attempt + 1, backoff)
+                if self.deadline and (time.time() - start + backoff_seconds) > self.deadline:
+                    logger.debug("deadline of {} seconds reached after {} attempts".format(
+                        self.deadline,
+                        attempt
+                    ))
+                    self.incr("failures")
+                    raise
+
+                logger.debug("attempt {}/{} failed, retrying".format(attempt, attempts))
+
+            else:
+                self.breaker.success()
+                return ret
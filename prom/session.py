@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+A unit of work for Orm instances
+
+    with prom.session():
+        foo = Foo.query.get_pk(1)
+        foo.bar = 2
+        Foo(bar=3)
+    # foo is updated and the new Foo is inserted here
+
+While a session is active every Orm instance that is created or loaded by the
+thread is tracked, the instances that really changed are written when the with
+block ends (or when flush() is called) using Interface.batch(), so they go to the
+db in one transaction and writes to the same table with the same fields are sent
+together. The session is also an identity map, Query.get_pk() and every query
+that returns a row the session already holds return the held instance
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import copy
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+import logging
+
+from .compat import *
+
+
+logger = logging.getLogger(__name__)
+
+
+class Session(object):
+    """Tracks Orm instances and writes the ones that changed with flush()
+
+    an instance is dirty if it has never been written (it was created in the
+    session) or if any of its field values differ from the values it had when it
+    was loaded or last written, an instance that had a field set to the value it
+    already had won't be written
+    """
+    def __init__(self):
+        self.clear()
+
+    def __len__(self):
+        return len(self.tracked)
+
+    def __contains__(self, orm):
+        return id(orm) in self.tracked
+
+    def clear(self):
+        """stop tracking everything, nothing is written"""
+        self.tracked = OrderedDict()
+        self.orms = {}
+
+    def get_snapshot(self, orm):
+        """return a copy of the field values of orm that can be compared to the
+        values when the session is flushed"""
+        return {k: copy.deepcopy(getattr(orm, k, None)) for k in orm.schema.fields}
+
+    def add(self, orm, written=True):
+        """track orm
+
+        :param orm: Orm
+        :param written: bool, True if orm holds what is in the db (it was just
+            loaded or saved), False if it is new
+        """
+        snapshot = self.get_snapshot(orm) if written else None
+        self.tracked[id(orm)] = (orm, snapshot)
+
+        if written:
+            pk = orm.pk
+            if pk is not None:
+                self.orms[(str(orm.schema), pk)] = orm
+
+    def discard(self, orm):
+        """stop tracking orm (eg, it was deleted)"""
+        self.tracked.pop(id(orm), None)
+        for key, o in list(self.orms.items()):
+            if o is orm:
+                self.orms.pop(key)
+
+    def get(self, orm_class, pk):
+        """return the held instance of orm_class with primary key pk, None if the
+        session doesn't have it"""
+        return self.orms.get((str(orm_class.schema), pk), None)
+
+    def is_dirty(self, orm):
+        """return True if orm needs to be written"""
+        ret = True
+        orm, snapshot = self.tracked.get(id(orm), (orm, None))
+        if snapshot is not None:
+            ret = any(getattr(orm, k, None) != v for k, v in snapshot.items())
+        return ret
+
+    def dirty(self):
+        """return all the tracked instances that need to be written, in the order
+        they started being tracked"""
+        return [orm for orm, snapshot in self.tracked.values() if self.is_dirty(orm)]
+
+    def get_groups(self, orms):
+        """group orms by interface and then by the table and fields of their write,
+        the groups are in the order their first instance was tracked so a row
+        created before another row is still inserted first
+
+        :returns: list, tuples of (interface, orms)
+        """
+        interfaces = OrderedDict()
+        for orm in orms:
+            interface = orm.interface
+            is_update = orm.schema.pk_name not in orm.modified_fields and orm.pk
+            key = (
+                str(orm.schema),
+                bool(is_update),
+                tuple(sorted(orm.depopulate(bool(is_update)).keys())),
+            )
+            groups = interfaces.setdefault(id(interface), (interface, OrderedDict()))[1]
+            groups.setdefault(key, []).append(orm)
+
+        return [
+            (interface, [orm for group in groups.values() for orm in group])
+            for interface, groups in interfaces.values()
+        ]
+
+    def flush(self):
+        """write every dirty instance, each interface's writes go in one batch"""
+        orms = self.dirty()
+        if not orms: return
+
+        logger.debug("Flushing session with {} dirty instances".format(len(orms)))
+        for interface, group in self.get_groups(orms):
+            try:
+                with interface.batch():
+                    for orm in group:
+                        orm.save()
+
+            except Exception:
+                # nothing made it to the db so these have to be written again
+                for orm in group:
+                    self.tracked[id(orm)] = (orm, None)
+                raise
+
+
+sessions = threading.local()
+"""holds the active session for each thread"""
+
+
+def get_session():
+    """return the session of the current thread, None if there isn't one"""
+    return getattr(sessions, "session", None)
+
+
+def hydrate(orm_class, fields):
+    """create an orm_class instance from a row from the db, if a session is active
+    and already has the row then the instance it holds is returned instead
+
+    :param orm_class: Orm
+    :param fields: dict, the row
+    :returns: Orm
+    """
+    s = get_session()
+    if s is not None:
+        orm = s.get(orm_class, fields.get(orm_class.schema.pk_name, None))
+        if orm is not None:
+            return orm
+
+    return orm_class(fields, hydrate=True)
+
+
+@contextmanager
+def session():
+    """activate a session for the current thread while in the with block, it is
+    flushed when the block ends unless the block raised an error, a session
+    inside another session is the same session
+
+    example --
+        with prom.session() as s:
+            foo = Foo.query.get_pk(1)
+            foo.bar = 2
+            s.flush() # foo is written now instead of when the block ends
+
+    :returns: Session
+    """
+    s = get_session()
+    if s is not None:
+        yield s
+
+    else:
+        s = Session()
+        sessions.session = s
+        try:
+            yield s
+            s.flush()
+
+        finally:
+            sessions.session = None
@@ -261,3 +261,63 @@ def make_hash(*mixed):
     # http://stackoverflow.com/questions/5297448/how-to-get-md5-sum-of-a-string
     return md5(s)
 
+
+def make_hashable(val):
+    """return a hashable version of val, two equal values will always have equal
+    hashable versions
+
+    this is used instead of make_hash() when a value needs to be compared or used
+    as a dict key since it doesn't depend on str() of the value
+
+    val -- mixed -- usually a query value, eg, an int or a list of ints
+    return -- hashable -- lists become tuples and dicts and sets become sorted
+        tuples, values that can't be compared with each other are sorted by their
+        type name and repr()
+    """
+    if isinstance(val, (list, tuple)):
+        val = tuple(make_hashable(v) for v in val)
+
+    elif isinstance(val, (set, frozenset, dict)):
+        if isinstance(val, dict):
+            vals = [(k, make_hashable(v)) for k, v in val.items()]
+        else:
+            vals = [make_hashable(v) for v in val]
+
+        try:
+            val = tuple(sorted(vals))
+        except TypeError:
+            val = tuple(sorted(vals, key=lambda v: (type(v).__name__, repr(v))))
+
+    else:
+        try:
+            hash(val)
+        except TypeError:
+            val = (type(val).__name__, repr(val))
+
+    return val
+
+
+def make_key(val):
+    """return a str version of val that is the same in every process, unlike
+    hash() or the iteration order of a set, which both change with the per-process
+    hash randomization
+
+    val -- mixed -- usually a cache key, eg, a tuple from make_hashable()
+    return -- str -- containers are serialized recursively, the members of sets
+        and dicts are sorted, everything else is its type name and repr()
+    """
+    if isinstance(val, (list, tuple)):
+        val = "({})".format(", ".join(make_key(v) for v in val))
+
+    elif isinstance(val, (set, frozenset)):
+        val = "{{{}}}".format(", ".join(sorted(make_key(v) for v in val)))
+
+    elif isinstance(val, dict):
+        val = "{{{}}}".format(", ".join(sorted(
+            "{}: {}".format(make_key(k), make_key(v)) for k, v in val.items()
+        )))
+
+    else:
+        val = "{}:{}".format(type(val).__name__, repr(val))
+
+    return val
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import asyncio
+
+from . import BaseTestCase, EnvironTestCase
+from prom.compat import *
+from prom import InterfaceError
+from prom.config import DsnConnection
+
+
+class AsyncTest(EnvironTestCase):
+    def run_async(self, orm_class, callback):
+        """run callback(orm_class) until it finishes, the async interface of
+        orm_class is closed afterwards"""
+        async def target():
+            try:
+                return await callback(orm_class)
+            finally:
+                await orm_class.async_interface.close()
+
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(target())
+
+    def test_crud(self):
+        orm_class = self.get_orm_class()
+
+        async def callback(orm_class):
+            # the table doesn't exist yet so this also tests the schema repair
+            o = await orm_class.acreate(foo=1, bar="v1")
+            self.assertLess(0, o.pk)
+
+            o2 = await orm_class.query.is_foo(1).aget_one()
+            self.assertEqual(o.pk, o2.pk)
+            self.assertEqual("v1", o2.bar)
+
+            o.foo = 2
+            self.assertTrue(await o.asave())
+            o2 = await orm_class.query.aget_pk(o.pk)
+            self.assertEqual(2, o2.foo)
+
+            for i in range(3, 6):
+                await orm_class(foo=i, bar="v{}".format(i)).asave()
+            self.assertEqual(4, await orm_class.query.acount())
+            self.assertTrue(await orm_class.query.is_foo(5).ahas())
+            self.assertIsNone(await orm_class.query.is_foo(1).aget_one())
+
+            os = await orm_class.query.asc_foo().aget(2)
+            self.assertEqual([2, 3], [o.foo for o in os])
+            self.assertTrue(os.has_more)
+
+            foos = [o.foo async for o in orm_class.query.desc_foo().aall()]
+            self.assertEqual([5, 4, 3, 2], foos)
+
+            it = orm_class.query.asc_foo().aall()
+            it.chunk_limit = 3
+            foos = [o.foo async for o in it]
+            self.assertEqual([2, 3, 4, 5], foos)
+
+            self.assertTrue(await o.adelete())
+            self.assertIsNone(o.pk)
+            self.assertEqual(3, await orm_class.query.acount())
+            self.assertEqual(2, await orm_class.query.gte_foo(4).adelete())
+
+        self.run_async(orm_class, callback)
+        self.assertEqual(1, orm_class.query.count())
+
+    def test_transaction(self):
+        orm_class = self.get_orm_class()
+        orm_class.install()
+
+        async def callback(orm_class):
+            ai = orm_class.async_interface
+            async with ai.transaction() as connection:
+                await orm_class.acreate(foo=1, bar="v1")
+                await orm_class.acreate(foo=2, bar="v2")
+                self.assertTrue(connection.in_transaction())
+
+            self.assertEqual(2, await orm_class.query.acount())
+
+            with self.assertRaises(ValueError):
+                async with ai.transaction():
+                    await orm_class.acreate(foo=3, bar="v3")
+                    raise ValueError()
+            self.assertEqual(2, await orm_class.query.acount())
+
+            # a failed query in a transaction doesn't take the transaction down
+            # with it when there is a savepoint
+            async with ai.transaction():
+                await orm_class.acreate(foo=4, bar="v4")
+                with self.assertRaises(InterfaceError):
+                    await orm_class.acreate(_id=1, foo=5, bar="v5")
+            self.assertEqual(3, await orm_class.query.acount())
+
+        self.run_async(orm_class, callback)
+        self.assertEqual(3, orm_class.query.count())
+
+    def test_concurrent(self):
+        orm_class = self.get_orm_class()
+        self.insert(orm_class, 10)
+
+        async def callback(orm_class):
+            async def target(foo):
+                async with orm_class.async_interface.transaction():
+                    o = await orm_class.acreate(foo=foo, bar="v{}".format(foo))
+                    return await orm_class.query.aget_pk(o.pk)
+
+            os = await asyncio.gather(*[target(foo) for foo in range(100, 105)])
+            self.assertEqual(list(range(100, 105)), [o.foo for o in os])
+            return await orm_class.query.acount()
+
+        self.assertEqual(15, self.run_async(orm_class, callback))
+
+
+class AsyncSQLiteTest(BaseTestCase):
+    def test_memory(self):
+        i = DsnConnection("prom.interface.sqlite.SQLite://:memory:").interface
+        with self.assertRaises(ValueError):
+            i.get_async_interface()
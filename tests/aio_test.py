@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+The async tests are in tests/aio.py because python 2 can't parse async def, so
+they are only loaded on python 3
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+from prom.compat import *
+
+if not is_py2:
+    from .aio import *
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import json
+
+from . import TestCase
+from prom.bench import Benchmark, Result, percentile
+from prom.interface import get_interfaces
+from prom.compat import *
+
+
+class ResultTest(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, percentile(values, 50))
+        self.assertEqual(95, percentile(values, 95))
+        self.assertEqual(100, percentile(values, 100))
+        self.assertEqual(0.0, percentile([], 50))
+
+    def test_jsonable(self):
+        r = Result("foo", 10, [1.0, 2.0, 1.0, 4.0], 1024)
+        d = r.jsonable()
+        self.assertEqual(5.0, d["ops_per_sec"])
+        self.assertEqual(0.2, d["mean"])
+        self.assertEqual(0.1, d["call_p50"])
+        self.assertEqual(0.4, d["call_p99"])
+        self.assertEqual(1024, d["peak_memory"])
+
+
+class BenchmarkTest(TestCase):
+    def test_run(self):
+        names = ["insert", "get_pk", "get_20", "raw_get_20", "values", "cache_hit", "new_orm", "jsonable"]
+        with Benchmark(rows=20) as bench:
+            self.assertEqual(20, bench.orm_class.query.count())
+            results = bench.run(names)
+            d = json.loads(json.dumps(bench.jsonable()))
+
+        self.assertEqual(names, [r.name for r in results])
+        self.assertEqual(names, [r["name"] for r in d["results"]])
+        self.assertEqual(20, d["environment"]["rows"])
+        self.assertLess(0.0, d["summary"]["orm_overhead"])
+        for r in d["results"]:
+            self.assertLess(0.0, r["ops_per_sec"])
+
+        self.assertFalse(bench.connection_name in get_interfaces())
+
+    def test_rows(self):
+        """the same seed creates the same rows"""
+        b1 = Benchmark(rows=5, seed=3)
+        b2 = Benchmark(rows=5, seed=3)
+        self.assertEqual(list(b1.create_rows(5)), list(b2.create_rows(5)))
+        b1.teardown()
+        b2.teardown()
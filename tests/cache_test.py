@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+from threading import Thread
+import os
+import sys
+import time
+import subprocess
+
+import testdata
+
+from . import TestCase
+from prom.cache import LRUCache, CacheNamespace, IdentityMap, sizeof, \
+    identity_map, get_identity_map, SQLiteCacheBackend
+from prom.compat import *
+
+
+class LRUCacheTest(TestCase):
+    def test_max_entries(self):
+        c = LRUCache(max_entries=2)
+        c.set("foo", 1)
+        c.set("bar", 2)
+        c.get("foo") # bar is now the least recently used
+        c.set("che", 3)
+
+        self.assertEqual(2, len(c))
+        self.assertTrue("foo" in c)
+        self.assertFalse("bar" in c)
+        self.assertTrue("che" in c)
+
+    def test_max_bytes(self):
+        c = LRUCache(max_bytes=100)
+        c.set("foo", 1, size=40)
+        c.set("bar", 2, size=40)
+        self.assertEqual(80, c.bytes)
+
+        c.set("che", 3, size=40)
+        self.assertEqual(80, c.bytes)
+        self.assertFalse("foo" in c)
+
+        # a value that can never fit shouldn't flush everything else out
+        self.assertFalse(c.set("baz", 4, size=101))
+        self.assertEqual(2, len(c))
+
+    def test_set_replace(self):
+        c = LRUCache()
+        c.set("foo", 1, size=10)
+        c.set("foo", 2, size=20)
+        self.assertEqual(20, c.bytes)
+        self.assertEqual((2, True), c.get("foo"))
+
+        self.assertTrue(c.delete("foo"))
+        self.assertEqual(0, c.bytes)
+        self.assertEqual((None, False), c.get("foo"))
+
+    def test_sizeof(self):
+        rows = [{"foo": 1, "bar": "che"} for _ in range(10)]
+        self.assertLess(sizeof(rows[0]), sizeof(rows))
+
+
+class CacheNamespaceTest(TestCase):
+    def test_generation(self):
+        cn = CacheNamespace()
+        cn.set("foo_table", "key", 1)
+        self.assertEqual((1, True), cn.get("foo_table", "key"))
+
+        cn.invalidate("foo_table")
+        self.assertEqual((None, False), cn.get("foo_table", "key"))
+
+        # values fetched under an older generation can't be cached
+        self.assertFalse(cn.set("foo_table", "key", 2, generation=0))
+        self.assertTrue(cn.set("foo_table", "key", 2, generation=1))
+
+    def test_threads(self):
+        cn = CacheNamespace()
+        cn.active = True
+
+        def target():
+            self.assertFalse(cn.active)
+            cn.set("foo_table", "key", 1)
+
+        t = Thread(target=target)
+        t.start()
+        t.join()
+
+        self.assertTrue(cn.active)
+        self.assertEqual((1, True), cn.get("foo_table", "key"))
+
+    def test_process(self):
+        cn = CacheNamespace()
+        cn.set("foo_table", "key", 1)
+        cn.pid = -1 # pretend we are now in a forked child process
+        self.assertEqual((None, False), cn.get("foo_table", "key"))
+
+    def test_backend_key(self):
+        """the backend key can't depend on the per-process hash randomization"""
+        code = "\n".join([
+            "from prom.cache import CacheNamespace",
+            "from prom.utils import make_hashable",
+            "key = (frozenset(['foo', 1, 2.5, 'bar', ('che', 3)]), {'baz': set(['a', 'b', 4])})",
+            "print(CacheNamespace().backend_key('foo_table', make_hashable(key)))",
+            "print(CacheNamespace().backend_key('foo_table', key))",
+        ])
+
+        keys = set()
+        for seed in ["1", "2", "3", "4"]:
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            output = subprocess.check_output([sys.executable, "-c", code], env=env)
+            keys.add(tuple(output.split()))
+
+        self.assertEqual(1, len(keys))
+
+
+class SQLiteCacheBackendTest(TestCase):
+    def get_backend(self, **kwargs):
+        path = os.path.join(testdata.create_dir(), "cache.db")
+        return SQLiteCacheBackend(path, **kwargs)
+
+    def test_get_set(self):
+        b = self.get_backend()
+        self.assertEqual((None, False), b.get("foo"))
+
+        b.set("foo", [{"bar": 1}], 10)
+        self.assertEqual(([{"bar": 1}], True), b.get("foo"))
+
+        b.set("foo", 2, -1)
+        self.assertEqual((None, False), b.get("foo"))
+
+    def test_prune(self):
+        b = self.get_backend(prune_interval=2)
+        b.set("foo", 1, -1)
+        b.set("bar", 2, 10)
+        count = b.get_connection().execute("SELECT COUNT(*) FROM prom_cache").fetchone()[0]
+        self.assertEqual(1, count)
+
+    def test_generation(self):
+        b = self.get_backend()
+        self.assertEqual(0, b.generation("foo_table"))
+        self.assertEqual(1, b.invalidate("foo_table"))
+        self.assertEqual(2, b.invalidate("foo_table"))
+
+        b.clear()
+        self.assertEqual(2, b.generation("foo_table"))
+
+    def test_namespaces(self):
+        """two namespaces sharing a backend is the same as two processes sharing it"""
+        b1 = self.get_backend()
+        b2 = SQLiteCacheBackend(b1.path)
+        cn1 = CacheNamespace(backend=b1, generation_ttl=0)
+        cn2 = CacheNamespace(backend=b2)
+
+        cn1.set("foo_table", "key", {"bar": 1})
+        self.assertEqual(({"bar": 1}, True), cn2.get("foo_table", "key"))
+
+        cn2.invalidate("foo_table")
+        self.assertEqual((None, False), cn1.get("foo_table", "key"))
+        self.assertEqual((None, False), cn2.get("foo_table", "key"))
+
+    def test_generation_ttl(self):
+        b1 = self.get_backend()
+        b2 = SQLiteCacheBackend(b1.path)
+        cn1 = CacheNamespace(backend=b1, generation_ttl=0.1)
+        cn2 = CacheNamespace(backend=b2)
+
+        cn1.set("foo_table", "key", 1)
+        b1.get_connection().close() # the generation comes from memory now
+        self.assertEqual((1, True), cn1.get("foo_table", "key"))
+
+        b1.local.connection = None
+        cn2.invalidate("foo_table")
+        self.assertEqual((1, True), cn1.get("foo_table", "key"))
+        time.sleep(0.1)
+        self.assertEqual((None, False), cn1.get("foo_table", "key"))
+
+    def test_errors(self):
+        b = self.get_backend()
+        b.set("foo", 1, 10)
+        b.get_connection().close()
+
+        self.assertEqual((None, False), b.get("foo"))
+        self.assertFalse(b.set("foo", 2, 10))
+        self.assertFalse(b.delete("foo"))
+        self.assertFalse(b.clear())
+        self.assertIsNone(b.generation("foo_table"))
+        self.assertIsNone(b.invalidate("foo_table"))
+
+        # nothing is current if the generation can't be read
+        cn = CacheNamespace(backend=b)
+        self.assertFalse(cn.set("foo_table", "key", 1))
+        self.assertEqual((None, False), cn.get("foo_table", "key"))
+        self.assertIsNone(cn.invalidate("foo_table"))
+
+
+class IdentityMapTest(TestCase):
+    def test_invalidate(self):
+        im = IdentityMap()
+        im.set("foo_table", 1, {"_id": 1})
+        im.set("foo_table", 2, {"_id": 2})
+
+        im.invalidate("foo_table", [1])
+        self.assertEqual((None, False), im.get("foo_table", 1))
+        self.assertEqual(({"_id": 2}, True), im.get("foo_table", 2))
+
+        im.invalidate("foo_table")
+        self.assertEqual((None, False), im.get("foo_table", 2))
+
+    def test_token(self):
+        im = IdentityMap()
+        token = im.token("foo_table")
+        im.invalidate("foo_table", [2])
+        # the table was written to while row 1 was being fetched
+        self.assertFalse(im.set("foo_table", 1, {"_id": 1}, token=token))
+        self.assertTrue(im.set("foo_table", 1, {"_id": 1}, token=im.token("foo_table")))
+
+    def test_copy(self):
+        im = IdentityMap()
+        im.set("foo_table", 1, {"_id": 1})
+        row, hit = im.get("foo_table", 1)
+        row["_id"] = 2
+        self.assertEqual(({"_id": 1}, True), im.get("foo_table", 1))
+
+    def test_context(self):
+        self.assertIsNone(get_identity_map())
+        with identity_map() as im:
+            self.assertEqual(im, get_identity_map())
+            with identity_map() as im2:
+                self.assertEqual(im2, get_identity_map())
+            self.assertEqual(im, get_identity_map())
+
+            def target():
+                self.assertIsNone(get_identity_map())
+
+            t = Thread(target=target)
+            t.start()
+            t.join()
+
+        self.assertIsNone(get_identity_map())
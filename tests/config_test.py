@@ -90,6 +90,62 @@ class SchemaTest(BaseTestCase):
         s = self.get_schema()
         self.assertEqual(s._id, s.pk)
 
+    def test_compiled(self):
+        class CompiledOrm(Orm):
+            table_name = self.get_table_name()
+            foo = Field(int, True)
+            bar = Field(str, default="bar")
+            che = ObjectField()
+
+            @foo.igetter
+            def foo(self, val):
+                return val
+
+        s = CompiledOrm.schema
+        self.assertIs(s, CompiledOrm.schema)
+        c = s.compiled
+        self.assertIs(c, s.compiled)
+        self.assertEqual("_id", c.pk_name)
+        self.assertEqual("_id", s.field_name("pk"))
+        self.assertEqual(set(["foo", "bar", "che"]), c.normal_field_names)
+        self.assertEqual(("foo",), c.required_field_names)
+        self.assertEqual(("che",), c.object_field_names)
+
+        # default iget and no default so the value is used as is
+        self.assertIsNone(c.igets["_id"])
+        self.assertIsNotNone(c.igets["foo"])
+        self.assertIsNotNone(c.igets["bar"])
+        self.assertIsNotNone(c.igets["che"])
+        self.assertIsNone(c.isets["foo"])
+        self.assertIsNotNone(c.isets["_created"])
+
+        with self.assertRaises(AttributeError):
+            s.field_name("baz")
+
+        # adding a field compiles the schema again
+        s.set_field("baz", Field(int, True))
+        self.assertIsNot(c, s.compiled)
+        self.assertEqual(set(["foo", "baz"]), set(s.compiled.required_field_names))
+        self.assertEqual("baz", s.field_name("baz"))
+
+        # changing a field's iget or iset after compiling compiles it again
+        c = s.compiled
+        @CompiledOrm.foo.isetter
+        def foo(cls, val, is_update, is_modified):
+            return val + 1
+        self.assertIsNot(c, s.compiled)
+        self.assertIsNotNone(s.compiled.isets["foo"])
+
+        c = s.compiled
+        @CompiledOrm.che.igetter
+        def che(cls, val):
+            return val
+        self.assertIsNot(c, s.compiled)
+
+        o = CompiledOrm(foo=1, baz=2)
+        o.save()
+        self.assertEqual(2, CompiledOrm.query.get_pk(o.pk).foo)
+
 
 class DsnConnectionTest(BaseTestCase):
 
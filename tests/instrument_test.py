@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import logging
+import json
+import warnings
+
+from . import TestCase, EnvironTestCase
+from prom.instrument import get_shape, QueryLog, QueryEvent, ListSink, LogSink, profile, detect_n_plus_one
+from prom.compat import StringIO
+from prom.config import DsnConnection, Field
+from prom.model import Orm, OrmPool
+from prom.exception import NPlusOneError, NPlusOneWarning
+from prom.query import AllIterator
+from prom.compat import *
+
+
+class QueryLogTest(TestCase):
+    def get_event(self, duration=1.0):
+        return QueryEvent("name", "SELECT 1", None, start=0.0, duration=duration)
+
+    def test_shape(self):
+        shape = get_shape("SELECT\n  *\nFROM foo\nWHERE  bar IN (%s, %s,%s) AND che = %s")
+        self.assertEqual("SELECT * FROM foo WHERE bar IN (%s, ...) AND che = %s", shape)
+
+        shape = get_shape("SELECT * FROM foo WHERE bar IN (?, ?)")
+        self.assertEqual("SELECT * FROM foo WHERE bar IN (?, ...)", shape)
+
+        shape = get_shape("SELECT * FROM foo LIMIT 11 OFFSET 20")
+        self.assertEqual("SELECT * FROM foo LIMIT N OFFSET N", shape)
+
+    def test_sample(self):
+        ql = QueryLog(ListSink(), sample=3)
+        kept = [ql(self.get_event()) for _ in range(6)]
+        self.assertEqual([True, False, False, True, False, False], kept)
+        self.assertEqual(2, len(ql.sink.events))
+
+    def test_slow(self):
+        ql = QueryLog(ListSink(), slow=10)
+        self.assertFalse(ql(self.get_event(9.9)))
+        self.assertTrue(ql(self.get_event(10.0)))
+
+    def test_create(self):
+        c = DsnConnection(
+            "prom.interface.sqlite.SQLite://:memory:?query_log_sample=5&query_log_slow=2.5&query_log_sink=prom.instrument.ListSink"
+        )
+        ql = QueryLog.create(c)
+        self.assertEqual(5, ql.sample)
+        self.assertEqual(2.5, ql.slow)
+        self.assertTrue(isinstance(ql.sink, ListSink))
+
+        c = DsnConnection("prom.interface.sqlite.SQLite://:memory:?query_log_level=info")
+        ql = QueryLog.create(c)
+        self.assertEqual(logging.INFO, ql.sink.level)
+
+    def test_log_sink(self):
+        sink = LogSink(level="critical")
+        self.assertTrue(sink.is_enabled())
+        sink = LogSink(level=logging.NOTSET + 1)
+        self.assertFalse(sink.is_enabled())
+
+
+class InterfaceQueryLogTest(EnvironTestCase):
+    def test_events(self):
+        orm_class = self.get_orm_class()
+        orm_class.install()
+        i = orm_class.interface
+        i.query_log = QueryLog(ListSink())
+        events = i.query_log.sink.events
+
+        pks = self.insert(orm_class, 3)
+        del events[:]
+        self.assertEqual(3, len(orm_class.query.in_pk(pks).get()))
+        self.assertEqual(1, len(events))
+        e = events[0]
+        self.assertEqual(3, e.rows)
+        self.assertLess(0.0, e.duration)
+        self.assertFalse(e.in_transaction)
+        self.assertTrue("IN (" in e.shape and ", ...)" in e.shape)
+
+        with i.transaction() as connection:
+            i.query("SELECT 1", connection=connection)
+        self.assertTrue(events[-1].in_transaction)
+        self.assertEqual(id(connection), events[-1].connection_id)
+
+        with self.assertRaises(Exception):
+            i.query("SELECT * FROM this_table_does_not_exist")
+        self.assertIsNotNone(events[-1].error)
+
+    def test_disabled(self):
+        orm_class = self.get_orm_class()
+        orm_class.install()
+        i = orm_class.interface
+        sink = ListSink()
+        sink.is_enabled = lambda: False
+        i.query_log = QueryLog(sink)
+        self.insert(orm_class, 2)
+        self.assertEqual(2, orm_class.query.count())
+        self.assertEqual(0, len(sink.events))
+
+
+class ProfileTest(EnvironTestCase):
+    def test_profile(self):
+        orm_class = self.get_orm_class()
+        orm_class.install()
+        pks = self.insert(orm_class, 5)
+
+        with profile() as p:
+            for pk in pks:
+                orm_class.query.get_pk(pk)
+            self.assertEqual(5, len(list(orm_class.query.get())))
+            orm_class.query.count()
+
+        orm_class.query.count() # not profiled
+        self.assertEqual(3, len(p.stats))
+
+        stats = p.get_stats("count")
+        s = stats[0]
+        self.assertEqual(5, s.count)
+        self.assertEqual(5, s.rows)
+        self.assertEqual(5, s.hydrated)
+        self.assertLess(0.0, s.hydration)
+        self.assertTrue(s.call_site.startswith(__file__.replace(".pyc", ".py")))
+
+        s = [s for s in stats if s.rows == 5 and s.count == 1][0]
+        self.assertEqual(5, s.hydrated)
+
+        d = json.loads(p.dump())
+        self.assertEqual(3, len(d))
+        self.assertEqual(1, sum(s["count"] for s in d if s["hydrated"] == 0))
+
+        stream = StringIO()
+        p.report(stream=stream)
+        self.assertTrue("count" in stream.getvalue())
+
+    def test_all(self):
+        """every chunk of all() is the same shape"""
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 5)
+        with profile(call_sites=False) as p:
+            self.assertEqual(5, len(list(AllIterator(orm_class.query, chunk_limit=2))))
+
+        s = p.get_stats()[0]
+        self.assertEqual(3, s.count)
+        self.assertEqual(5, s.hydrated)
+        self.assertEqual("", s.call_site)
+
+
+class NPlusOneTest(EnvironTestCase):
+    def get_orm_classes(self):
+        bar_class = self.get_orm_class()
+        class Foo(Orm):
+            table_name = self.get_table_name()
+            interface = bar_class.interface
+            bar_id = Field(bar_class, True)
+
+        pks = self.insert(bar_class, 5)
+        for pk in pks:
+            Foo.create(bar_id=pk)
+        return Foo, bar_class
+
+    def test_raise(self):
+        foo_class, bar_class = self.get_orm_classes()
+        with self.assertRaises(NPlusOneError) as cm:
+            with detect_n_plus_one(threshold=3, mode="raise"):
+                pool = OrmPool(bar_class)
+                for foo in foo_class.query.get():
+                    pool[foo.bar_id]
+
+        n = cm.exception.found[0]
+        self.assertEqual(5, n.count)
+        self.assertEqual("_id", n.field_name)
+        self.assertEqual(["Foo.bar_id"], n.ref_names)
+        self.assertTrue("get_pks(pks)" in str(n))
+        self.assertTrue(n.stats.call_site.startswith(__file__.replace(".pyc", ".py")))
+
+        # under the threshold
+        with detect_n_plus_one(threshold=5, mode="raise") as d:
+            for foo in foo_class.query.get():
+                bar_class.query.get_pk(foo.bar_id)
+        self.assertFalse(d.found)
+
+    def test_warn(self):
+        foo_class, bar_class = self.get_orm_classes()
+        with warnings.catch_warnings(record=True) as ws:
+            warnings.simplefilter("always")
+            with detect_n_plus_one(threshold=2) as d:
+                for bar in bar_class.query.get():
+                    foo_class.query.is_bar_id(bar.pk).get_one()
+
+        ws = [w for w in ws if issubclass(w.category, NPlusOneWarning)]
+        self.assertEqual(1, len(ws))
+        n = list(d.found.values())[0]
+        self.assertEqual("bar_id", n.field_name)
+        self.assertTrue("in_bar_id(values)" in str(ws[0].message))
+
+        with self.assertRaises(ValueError):
+            detect_n_plus_one(mode="foo")
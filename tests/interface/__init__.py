@@ -1,14 +1,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, division, print_function, absolute_import
 from unittest import TestSuite
+from contextlib import contextmanager
 import random
 import string
 import decimal
 import datetime
+import time
 
 
 from prom import query
 from prom.config import Schema, Field, Index
+from prom.exception import CancelError
+from prom.instrument import PlanLog
 from prom.compat import *
 import prom
 
@@ -20,6 +24,27 @@ class BaseTestInterface(BaseTestCase):
     def create_interface(cls):
         raise NotImplementedError()
 
+    @contextmanager
+    def savepoints(self, connection):
+        """count the savepoints started on connection while the with block runs
+
+        :param connection: Connection
+        :returns: list, the names of the savepoints, it is filled in as the with
+            block starts them
+        """
+        names = []
+        transaction_start = connection.transaction_start
+        def start(name):
+            names.append(name)
+            return transaction_start(name)
+        connection.transaction_start = start
+
+        try:
+            yield names
+
+        finally:
+            del connection.transaction_start
+
 #     def test_connect(self):
 #         i = self.get_interface()
 
@@ -44,6 +69,117 @@ class BaseTestInterface(BaseTestCase):
 #            with i.transaction():
 #                raise RuntimeError()
 
+    def test_savepoint(self):
+        i, s = self.get_table()
+        with i.connection() as connection:
+            with self.savepoints(connection) as names:
+                # single writes outside a transaction are sent on their own
+                pk = i.insert(s, {"foo": 1, "bar": "v1"}, connection=connection)
+                i.update(s, {"foo": 2}, query.Query().is__id(pk), connection=connection)
+                i.delete(s, query.Query().is__id(pk), connection=connection)
+                self.assertEqual(0, len(names))
+
+                # the table is known to be fine so the write doesn't need a savepoint
+                with i.transaction(connection):
+                    pk = i.insert(s, {"foo": 3, "bar": "v3"}, connection=connection)
+                self.assertEqual(1, len(names))
+
+        self.assertEqual(1, i.count(s))
+
+        # a write that creates its table inside a transaction
+        s2 = self.get_schema()
+        with i.transaction() as connection:
+            pk = i.insert(s2, {"foo": 4, "bar": "v4"}, connection=connection)
+            i.update(s, {"foo": 5}, query.Query().is_foo(3), connection=connection)
+        self.assertEqual(4, i.get_one(s2, query.Query().is__id(pk))["foo"])
+        self.assertEqual(5, i.get_one(s, query.Query())["foo"])
+
+    def test_read_savepoints(self):
+        i, s = self.get_table()
+        self.insert(i, s, 1)
+        options = i.connection_config.options
+
+        def count_starts(mode, s):
+            options["read_savepoints"] = mode
+            with i.transaction() as connection:
+                with self.savepoints(connection) as names:
+                    for x in range(3):
+                        i.count(s, connection=connection)
+            return len(names)
+
+        try:
+            # dbs that only undo the failed statement never need a savepoint
+            self.assertEqual(0 if i.statement_rollback else 3, count_starts("always", s))
+            self.assertEqual(0, count_starts("repair", s))
+            self.assertEqual(not i.statement_rollback, i.schema_cache.has_fields(s))
+            self.assertEqual(0, count_starts("never", s))
+
+            # a table that doesn't exist yet is fixed by handle_error()
+            s2 = self.get_schema()
+            count_starts("repair", s2)
+            self.assertTrue(i.has_table(str(s2)))
+
+            i.delete_table(s2)
+            self.assertFalse(i.schema_cache.has_table(s2))
+            options["read_savepoints"] = "never"
+            if i.statement_rollback:
+                with i.transaction() as connection:
+                    self.assertEqual(0, i.count(s2, connection=connection))
+
+            else:
+                with self.assertRaises(prom.InterfaceError):
+                    with i.transaction() as connection:
+                        i.count(s2, connection=connection)
+
+            options["read_savepoints"] = "foo"
+            with self.assertRaises(ValueError):
+                with i.transaction() as connection:
+                    i.count(s, connection=connection)
+
+        finally:
+            options.pop("read_savepoints", None)
+
+    def test_write_savepoints(self):
+        i, s = self.get_table()
+        pk = self.insert(i, s, 1)[0]
+
+        def count_starts(s):
+            with i.transaction() as connection:
+                with self.savepoints(connection) as names:
+                    i.insert(s, {"foo": 2, "bar": "v2"}, connection=connection)
+                    i.update(s, {"foo": 3}, query.Query().is__id(pk), connection=connection)
+            return len(names)
+
+        # the table is known to be fine so the writes go straight to the db
+        i.get_schema_cache().clear()
+        self.assertEqual(0, count_starts(s))
+        self.assertEqual(3, i.get_one(s, query.Query().is__id(pk))["foo"])
+
+        # a table that doesn't exist yet is fixed by handle_error()
+        s2 = self.get_schema()
+        count_starts(s2)
+        self.assertEqual(1, i.count(s2))
+
+    def test_schema_cache(self):
+        i, s = self.get_table()
+        cache = i.get_schema_cache()
+        self.assertTrue(cache.has_fields(s))
+        self.assertEqual(set(s.fields.keys()), cache.get_fields(s))
+
+        s.set_field("che", Field(str, False))
+        self.assertFalse(cache.has_fields(s))
+        pk = i.insert(s, {"foo": 1, "bar": "v1", "che": "v2"})
+        self.assertTrue(cache.has_fields(s))
+        self.assertEqual("v2", i.get_one(s, query.Query().is__id(pk))["che"])
+
+        s2 = self.get_schema()
+        self.assertFalse(cache.has_table(s2))
+        i.insert(s2, {"foo": 1, "bar": "v1"})
+        self.assertTrue(cache.has_fields(s2))
+
+        i.delete_table(s2)
+        self.assertFalse(cache.has_table(s2))
+
     def test_set_table(self):
         i = self.get_interface()
         s = self.get_schema()
@@ -169,6 +305,22 @@ class BaseTestInterface(BaseTestCase):
         self.assertFalse(i.has_table(s1))
         self.assertFalse(i.has_table(s2))
 
+    def test_query_timeout(self):
+        i = self.get_interface()
+        # this query never ends
+        query_str = "\n".join([
+            "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c)",
+            "SELECT count(*) AS ct FROM c",
+        ])
+        start = time.time()
+        with self.assertRaises(CancelError):
+            i.query(query_str, timeout=100)
+        self.assertLess(time.time() - start, 5)
+
+        # the timeout doesn't stick around
+        r = i.query("SELECT 1 AS one", fetchone=True)
+        self.assertEqual(1, r["one"])
+
     def test_insert(self):
         i, s = self.get_table()
         d = {
@@ -406,6 +558,81 @@ class BaseTestInterface(BaseTestCase):
         self.assertEqual(d['bar'], gd['bar'])
         self.assertEqual(pk, gd["_id"])
 
+    def test_batch(self):
+        i, s = self.get_table()
+        pk = i.insert(s, {'foo': 1, 'bar': 'value 1'})
+
+        with i.batch() as batch:
+            rs = [i.insert(s, {'foo': n, 'bar': 'value {}'.format(n)}) for n in range(2, 5)]
+            q = query.Query().is__id(pk)
+            ru = i.update(s, {'foo': 10}, q)
+            self.assertEqual(4, len(batch))
+            self.assertFalse(rs[0].done())
+            self.assertEqual(1, i.count(s))
+
+        pks = [r.result() for r in rs]
+        self.assertEqual(3, len(set(pks)))
+        self.assertEqual(4, i.count(s))
+        self.assertEqual(10, i.get_one(s, query.Query().is__id(pk))['foo'])
+        for n, pk in enumerate(pks, 2):
+            self.assertEqual(n, i.get_one(s, query.Query().is__id(pk))['foo'])
+
+        # nothing is written if the batch fails
+        with self.assertRaises(ValueError):
+            with i.batch():
+                r = i.insert(s, {'foo': 5, 'bar': 'value 5'})
+                raise ValueError()
+        self.assertEqual(4, i.count(s))
+        with self.assertRaises(ValueError):
+            r.result()
+
+        # the table is created when the batch is flushed
+        s = self.get_schema()
+        with i.batch():
+            r = i.insert(s, {'foo': 1, 'bar': 'value 1'})
+            r2 = i.insert(s, {'foo': 2, 'bar': 'value 2'})
+        self.assertEqual(2, i.count(s))
+        self.assertEqual(r.result() + 1, r2.result())
+
+        # the pks of the inserts are matched to the right results
+        with i.batch():
+            rs = [i.insert(s, {'_id': pk, 'foo': pk, 'bar': 'v'}) for pk in (1001, 1000)]
+        self.assertEqual([1001, 1000], [r.result() for r in rs])
+        self.assertEqual(1000, i.get_one(s, query.Query().is__id(1000))['foo'])
+        i.delete(s, query.Query().in__id([1000, 1001]))
+
+        # the query options of a write are used when it is flushed and only writes
+        # with the same options are sent together
+        timeouts = []
+        query_settings = i.query_settings
+        def record_settings(connection, timeout=None, settings=None):
+            timeouts.append(timeout)
+            return query_settings(connection, timeout, settings)
+        i.query_settings = record_settings
+        try:
+            with i.batch() as batch:
+                i.insert(s, {'foo': 6, 'bar': 'value 6'}, timeout=5000)
+                i.insert(s, {'foo': 7, 'bar': 'value 7'}, timeout=5000)
+                i.insert(s, {'foo': 8, 'bar': 'value 8'})
+                self.assertEqual({"timeout": 5000}, batch.statements[0].options)
+                self.assertTrue(batch.statements[1].can_send_with(batch.statements[0]))
+                self.assertFalse(batch.statements[2].can_send_with(batch.statements[0]))
+        finally:
+            del i.query_settings
+        self.assertTrue(5000 in timeouts)
+        i.delete(s, query.Query().in_foo([6, 7, 8]))
+
+        # deletes are queued with the other writes so they run in order
+        with i.batch():
+            r = i.insert(s, {'foo': 3, 'bar': 'value 3'})
+            rd = i.delete(s, query.Query().is_foo(3))
+            self.assertFalse(rd.done())
+            # reads don't see the queued writes
+            self.assertEqual(2, i.count(s))
+        self.assertTrue(rd.done())
+        self.assertEqual(2, i.count(s))
+        self.assertEqual(0, i.count(s, query.Query().is_foo(3)))
+
     def test_ref(self):
         i = self.get_interface()
         table_name_1 = "".join(random.sample(string.ascii_lowercase, random.randint(5, 15)))
@@ -569,6 +796,82 @@ class BaseTestInterface(BaseTestCase):
         r = i.get_one(s, query.Query().is_bar(1).not_foo(None))
         self.assertEqual(pk1, r['_id'])
 
+    def test_conversion_plan(self):
+        i = self.get_interface()
+        s = Schema(
+            self.get_table_name(),
+            _id=Field(int, pk=True),
+            foo=Field(int),
+            che=Field(bool),
+            bar=Field(str),
+            baz=Field(decimal.Decimal),
+            boo=Field(datetime.date),
+            moo=Field(datetime.datetime),
+        )
+
+        fields = {
+            "foo": 1,
+            "che": False,
+            "bar": "bar",
+            "baz": decimal.Decimal("1.25"),
+            "boo": datetime.date(2020, 1, 2),
+            "moo": datetime.datetime(2020, 1, 2, 3, 4, 5, 6),
+        }
+        pk = i.insert(s, fields)
+        i.insert(s, dict(fields, bar=b"bytes", moo=datetime.datetime(2020, 1, 2, 3, 4, 5)))
+        i.insert(s, {"foo": 3})
+
+        r = i.get_one(s, query.Query().is__id(pk))
+        for k, v in fields.items():
+            self.assertEqual(v, r[k])
+            self.assertEqual(type(v), type(r[k]))
+
+        rs = i.get(s, query.Query().asc__id())
+        self.assertEqual("bytes", rs[1]["bar"])
+        self.assertEqual(datetime.datetime(2020, 1, 2, 3, 4, 5), rs[1]["moo"])
+        self.assertIsNone(rs[2]["moo"])
+
+        # the plan is built once per query shape and only has the typed columns
+        # that need a conversion
+        plan = i.get_conversion_plan(s, tuple(rs[0].keys()))
+        self.assertIs(plan, i.get_conversion_plan(s, tuple(rs[0].keys())))
+        names = set(name for name, _ in plan.converters)
+        self.assertFalse(names & set(["_id", "foo"]))
+
+        rs = list(i.get(s, query.Query().asc__id(), cursor_result=True))
+        self.assertFalse(rs[0]["che"])
+        self.assertEqual("bytes", rs[1]["bar"])
+
+    def test_explain(self):
+        orm_class = self.get_orm_class()
+        self.insert(orm_class, 3)
+        plan = orm_class.query.is_foo(1).desc_bar().explain()
+        self.assertLess(0, len(plan))
+
+        q = orm_class.query.in_foo([])
+        self.assertEqual([], q.explain())
+
+    def test_plan_log(self):
+        i = self.get_interface()
+        i.plan_log = PlanLog(slow=0.000001)
+        s = self.get_schema()
+        self.insert(i, s, 3)
+
+        with i.transaction() as connection:
+            i.get(s, query.Query().is_foo(1), connection=connection)
+            i.get(s, query.Query().is_foo(2), connection=connection)
+            self.assertEqual(3, i.count(s, query.Query(), connection=connection))
+
+        query_str, _ = i.get_SQL(s, query.Query().is_foo(1))
+        p = i.plan_log.get(query_str)
+        self.assertLess(0, len(p.plan))
+        self.assertTrue(p.event.in_transaction)
+
+        shapes = [p.event.shape for p in i.plan_log.plans.values()]
+        self.assertEqual(len(shapes), len(set(shapes)))
+        self.assertFalse([shape for shape in shapes if shape.startswith("EXPLAIN")])
+        self.assertFalse([shape for shape in shapes if shape.startswith("INSERT")])
+
     def test_transaction_nested_fail_1(self):
         """make sure 2 new tables in a wrapped transaction work as expected"""
         i = self.get_interface()
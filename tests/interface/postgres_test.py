@@ -5,6 +5,8 @@ import os
 import datetime
 import time
 import subprocess
+import threading
+from threading import Thread
 
 # needed to test prom with greenthreads
 try:
@@ -17,11 +19,12 @@ from testdata.service import InitD
 from prom import query
 from prom.compat import *
 from prom.config import Schema, DsnConnection, Field
-from prom.interface.postgres import PostgreSQL
+from prom.interface.postgres import PostgreSQL, ConnectionPool, PoolError
 import prom
 import prom.interface
 
 from . import BaseTestInterface
+from .. import BaseTestCase
 
 
 stdnull = open(os.devnull, 'w') # used to suppress subprocess calls
@@ -202,6 +205,216 @@ class InterfacePostgresTest(BaseTestInterface):
             rd = i.insert(s, fields)
 
 
+    def test_query_settings(self):
+        i = self.get_interface()
+        default = i.query("SHOW work_mem", fetchone=True)["work_mem"]
+        r = i.query("SHOW work_mem", settings={"work_mem": "7MB"}, fetchone=True)
+        self.assertEqual("7MB", r["work_mem"])
+        self.assertEqual(default, i.query("SHOW work_mem", fetchone=True)["work_mem"])
+
+        with i.transaction() as connection:
+            r = i.query(
+                "SHOW enable_seqscan",
+                settings={"enable_seqscan": False},
+                fetchone=True,
+                connection=connection
+            )
+            self.assertEqual("off", r["enable_seqscan"])
+            # the old value is put back for the rest of the transaction
+            r = i.query("SHOW enable_seqscan", fetchone=True, connection=connection)
+            self.assertEqual("on", r["enable_seqscan"])
+
+    def test_explain(self):
+        i = self.get_interface()
+        s = self.get_schema()
+        self.insert(i, s, 3)
+
+        plan = i.explain(s, query.Query().is_foo(1))
+        self.assertTrue("Plan" in plan[0])
+        self.assertFalse("Actual Total Time" in plan[0]["Plan"])
+
+        plan = i.explain(s, query.Query().is_foo(1), analyze=True)
+        self.assertTrue("Actual Total Time" in plan[0]["Plan"])
+
+    def test_repair_schema(self):
+        i = self.get_interface()
+        s = self.get_schema()
+        calls = []
+        def callback(schema, **kwargs):
+            calls.append(schema)
+            time.sleep(0.2)
+            return i._set_missing_tables(schema, **kwargs)
+
+        # the threads that need the same repair wait for the first one
+        ts = [threading.Thread(target=i.repair_schema, args=(callback, s)) for x in range(5)]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        self.assertEqual(1, len(calls))
+        self.assertTrue(i.has_table(str(s)))
+
+        # another interface (like another process) finds the table when it loads
+        # its cache after getting the lock so it doesn't try and create it
+        i2 = self.create_interface()
+        i2.schema_cache.set_tables({})
+        i2.set_table = None
+        self.assertTrue(i2._set_all_tables(s))
+        self.assertTrue(i2.schema_cache.has_fields(s))
+
+
+class ConnectionPoolTest(BaseTestCase):
+    def get_pool_interface(self, **options):
+        config = DsnConnection(os.environ["PROM_POSTGRES_DSN"])
+        config.options.update(options)
+        i = config.interface
+        self.connections.add(i)
+        i.connect()
+        return i
+
+    def test_threads(self):
+        i = self.get_pool_interface(pool_maxconn=3)
+        ts = [Thread(target=i.query, args=('select pg_sleep(0.5)',)) for _ in range(3)]
+        start = time.time()
+        for t in ts: t.start()
+        for t in ts: t.join()
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(3, i.pool_stats()["size"])
+
+    def test_transaction_affinity(self):
+        i = self.get_pool_interface(pool_maxconn=2)
+        with i.transaction() as connection:
+            with i.connection() as c:
+                self.assertTrue(c is connection)
+
+            found = []
+            def target():
+                with i.connection() as c:
+                    found.append(c)
+            t = Thread(target=target)
+            t.start()
+            t.join()
+            self.assertFalse(found[0] is connection)
+
+        # the connection is back in the pool
+        self.assertEqual(2, i.pool_stats()["idle"])
+
+    def test_timeout(self):
+        i = self.get_pool_interface(pool_maxconn=1, pool_timeout=0.1)
+        errors = []
+        def target():
+            try:
+                i.get_connection()
+            except PoolError as e:
+                errors.append(e)
+
+        with i.connection():
+            t = Thread(target=target)
+            t.start()
+            t.join()
+
+        self.assertEqual(1, len(errors))
+        self.assertEqual(1, i.pool_stats()["timeouts"])
+
+    def test_closed_connection(self):
+        """a closed connection in one thread shouldn't close the pool, or the
+        connection another thread is using for its transaction"""
+        i = self.get_pool_interface(pool_maxconn=2)
+        with i.transaction() as connection:
+            handled = []
+            def target():
+                with i.connection() as c:
+                    c.close()
+                    handled.append(i.handle_error(None, Exception(), connection=c))
+            t = Thread(target=target)
+            t.start()
+            t.join()
+
+            self.assertEqual([True], handled)
+            self.assertTrue(i.connected)
+            self.assertEqual(0, connection.closed)
+            self.assertEqual(1, i.query("SELECT 1 AS n", connection=connection)[0]["n"])
+
+        self.assertEqual(0, i.pool_stats()["used"])
+        self.assertEqual(1, i.pool_stats()["size"])
+
+    def test_free_connection_reconnect(self):
+        """a connection freed after the interface reconnected goes back to the
+        pool that issued it, not the new one"""
+        i = self.get_pool_interface()
+        c = i.get_connection()
+        i.close()
+        i.connect()
+        i.free_connection(c)
+        self.assertTrue(c.closed)
+        self.assertEqual(0, i.pool_stats()["used"])
+        self.assertEqual(1, i.query("SELECT 1 AS n")[0]["n"])
+
+        c = i.get_connection()
+        pool = i.connection_pool
+        i.close()
+        i.free_connection(c)
+        self.assertTrue(c.closed)
+        self.assertEqual(0, pool.stats()["used"])
+
+    def test_lifetime_idle(self):
+        i = self.get_pool_interface()
+        kwargs = i.connection_pool._kwargs
+
+        pool = ConnectionPool(0, 2, lifetime=0.1, **kwargs)
+        c1 = pool.getconn()
+        pool.putconn(c1)
+        self.assertTrue(c1 is pool.getconn())
+        time.sleep(0.2)
+        pool.putconn(c1)
+        self.assertTrue(c1.closed)
+        pool.closeall()
+
+        pool = ConnectionPool(0, 2, idle=0.1, **kwargs)
+        c1 = pool.getconn()
+        c2 = pool.getconn()
+        pool.putconn(c1)
+        time.sleep(0.2)
+        pool.putconn(c2)
+        self.assertTrue(c1.closed)
+        self.assertEqual(1, pool.stats()["size"])
+        pool.closeall()
+
+    def test_ping(self):
+        i = self.get_pool_interface()
+        kwargs = i.connection_pool._kwargs
+        pool = ConnectionPool(1, 1, ping=True, **kwargs)
+        c1 = pool.getconn()
+        backend_pid = c1.get_backend_pid()
+        pool.putconn(c1)
+
+        i.query("SELECT pg_terminate_backend(%s)", backend_pid)
+        c2 = pool.getconn()
+        self.assertNotEqual(backend_pid, c2.get_backend_pid())
+        pool.putconn(c2)
+        pool.closeall()
+
+    def test_closeall(self):
+        i = self.get_pool_interface()
+        kwargs = i.connection_pool._kwargs
+        pool = ConnectionPool(0, 2, **kwargs)
+        c1 = pool.getconn()
+        c2 = pool.getconn()
+        pool.putconn(c2)
+
+        pool.closeall()
+        self.assertTrue(c1.closed)
+        self.assertTrue(c2.closed)
+        self.assertEqual(0, pool.stats()["size"])
+
+        # giving back a connection that was checked out doesn't count it twice
+        pool.putconn(c1)
+        self.assertEqual(0, pool.stats()["size"])
+        self.assertEqual(2, pool.stats()["discarded"])
+        with self.assertRaises(PoolError):
+            pool.getconn()
+
+
 class InterfacePGBouncerTest(InterfacePostgresTest):
     @classmethod
     def create_interface(cls):
@@ -309,6 +522,80 @@ class XInterfacePostgresGeventTest(InterfacePostgresTest):
 #            elapsed = stop - start
 #            self.assertTrue(elapsed >= 1.0 and elapsed < 2.0)
 
+    def get_pool(self, minconn, maxconn, **kwargs):
+        import prom.gevent
+        i = self.get_interface()
+        kwargs.update(i.connection_pool._kwargs)
+        return prom.gevent.ConnectionPool(minconn, maxconn, **kwargs)
+
+    def test_pool_accounting(self):
+        pool = self.get_pool(1, 2, timeout=0.1)
+        c1 = pool.getconn()
+        c2 = pool.getconn()
+        self.assertEqual(2, pool.stats()["used"])
+
+        # the pool is full so this green thread times out instead of waiting forever
+        g = gevent.spawn(pool.getconn)
+        g.join()
+        self.assertTrue(isinstance(g.exception, PoolError))
+        self.assertEqual(1, pool.stats()["timeouts"])
+
+        # closing a connection frees its spot
+        pool.putconn(c1, close=True)
+        self.assertEqual(1, pool.stats()["size"])
+        c3 = pool.getconn()
+        self.assertFalse(c3.closed)
+
+        # a connection that broke while it was out is replaced
+        c2.close()
+        pool.putconn(c2)
+        pool.putconn(c3)
+        stats = pool.stats()
+        self.assertEqual(1, stats["size"])
+        self.assertEqual(3, stats["created"])
+        self.assertEqual(2, stats["discarded"])
+
+        pool.closeall()
+        self.assertTrue(c3.closed)
+        with self.assertRaises(PoolError):
+            pool.getconn()
+
+    def test_pool_greenlets(self):
+        pool = self.get_pool(0, 2, timeout=5)
+        used = []
+        def target():
+            conn = pool.getconn()
+            used.append(pool.stats()["used"])
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT pg_sleep(0.2)")
+            finally:
+                pool.putconn(conn)
+
+        start = time.time()
+        gs = [gevent.spawn(target) for _ in range(6)]
+        gevent.joinall(gs, raise_error=True)
+        elapsed = time.time() - start
+
+        self.assertTrue(elapsed >= 0.6 and elapsed < 1.0)
+        self.assertEqual(2, max(used))
+        stats = pool.stats()
+        self.assertEqual(6, stats["waits"])
+        self.assertEqual(2, stats["created"])
+        self.assertLess(0.0, stats["max_wait_seconds"])
+        pool.closeall()
+
+    def test_pool_reap(self):
+        pool = self.get_pool(0, 2, idle=0.1)
+        self.assertEqual(0.1, pool.reap_interval)
+        c1 = pool.getconn()
+        pool.putconn(c1)
+        gevent.sleep(0.3)
+        self.assertTrue(c1.closed)
+        self.assertEqual(0, pool.stats()["size"])
+        pool.closeall()
+        self.assertIsNone(pool._reaper)
+
     def test_concurrent_error_recovery(self):
         """when recovering from an error in a green thread environment one thread
         could have added the table while the other thread was asleep, this will
@@ -2,14 +2,15 @@
 from __future__ import unicode_literals, division, print_function, absolute_import
 import os
 import datetime
+import threading # not Thread, the gevent tests patch threading after this is imported
 
 import testdata
 
-from prom import query, InterfaceError
+from prom import query, InterfaceError, CancelError, TransactionError
 from prom.interface.sqlite import SQLite
 from prom.interface import configure
 from prom.model import Orm
-from prom.config import Field
+from prom.config import Field, DsnConnection
 from prom.compat import *
 
 from . import BaseTestInterface, BaseTestCase
@@ -183,6 +184,84 @@ class InterfaceSQLiteTest(BaseTestInterface):
         _id = self.insert(i, s, 1)[0]
         self.assertTrue(_id)
 
+    def test_write_timeout_transaction(self):
+        """SQLite rolls back the whole transaction when a write in it is
+        interrupted, so the transaction block has to fail"""
+        i, s = self.get_table()
+        # this update never ends
+        query_str = " ".join([
+            "UPDATE {} SET foo = (".format(s),
+            "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c)",
+            "SELECT count(*) FROM c)",
+        ])
+
+        with self.assertRaises(TransactionError):
+            with i.transaction() as connection:
+                i.insert(s, {"foo": 1, "bar": "v1"}, connection=connection)
+                try:
+                    i.query(query_str, ignore_result=True, timeout=100, connection=connection)
+                finally:
+                    self.assertFalse(connection.in_transaction())
+        self.assertEqual(0, i.count(s))
+
+        # a read that is interrupted doesn't end the transaction
+        with i.transaction() as connection:
+            i.insert(s, {"foo": 2, "bar": "v2"}, connection=connection)
+            with self.assertRaises(CancelError):
+                i.query(
+                    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c",
+                    timeout=100,
+                    connection=connection
+                )
+            self.assertTrue(connection.in_transaction())
+        self.assertEqual(1, i.count(s))
+
+    def test_pragmas(self):
+        path = testdata.get_file("pragmas.sqlite").path
+        config = DsnConnection(
+            "prom.interface.sqlite.SQLite://{}?profile=readheavy&synchronous=FULL".format(path)
+        )
+        i = config.interface
+        self.connections.add(i)
+        self.assertEqual("wal", i.query("PRAGMA journal_mode", fetchone=True)[0])
+        self.assertEqual(2, i.query("PRAGMA synchronous", fetchone=True)[0])
+        self.assertEqual(-65536, i.query("PRAGMA cache_size", fetchone=True)[0])
+
+        config = DsnConnection("prom.interface.sqlite.SQLite://{}?profile=foo".format(path))
+        with self.assertRaises(ValueError):
+            config.interface.connect()
+
+        config = DsnConnection("prom.interface.sqlite.SQLite://{}?cache_size=1;2".format(path))
+        with self.assertRaises(ValueError):
+            config.interface.connect()
+
+    def test_immutable(self):
+        path = testdata.get_file("immutable.sqlite").path
+        i = DsnConnection("prom.interface.sqlite.SQLite://{}".format(path)).interface
+        self.connections.add(i)
+        s = self.get_schema()
+        pks = self.insert(i, s, 2)
+        i.close()
+
+        for option in ["readonly=1", "immutable=1&profile=readheavy"]:
+            config = DsnConnection("prom.interface.sqlite.SQLite://{}?{}".format(path, option))
+            i = config.interface
+            self.connections.add(i)
+            self.assertEqual(2, i.count(s))
+            with self.assertRaises(InterfaceError):
+                i.insert(s, {"foo": 3, "bar": "3"})
+            i.close()
+
+    def test_schema_lock(self):
+        path = testdata.get_file("schema_lock.sqlite").path
+        i = DsnConnection("prom.interface.sqlite.SQLite://{}".format(path)).interface
+        self.connections.add(i)
+        s = self.get_schema()
+        self.insert(i, s, 1)
+        self.assertTrue(os.path.isfile("{}.lock".format(path)))
+        self.assertIsNone(i.schema_lock_file)
+        self.assertTrue(i.schema_cache.has_fields(s))
+
     def test_list_field(self):
         from prom import Field, Orm
         class ListFieldOrm(Orm):
@@ -224,6 +303,60 @@ class InterfaceSQLiteTest(BaseTestInterface):
 #         i.close()
 
 
+class InterfaceSQLiteReadersTest(InterfaceSQLiteTest):
+    """run all the interface tests with a writer connection and reader connections"""
+    @classmethod
+    def create_interface(cls):
+        config = DsnConnection(os.environ["PROM_SQLITE_DSN"])
+        config.options["readers"] = 1
+        inter = config.interface
+        cls.connections.add(inter)
+        return inter
+
+    def test_readers(self):
+        i, s = self.get_table()
+        pks = self.insert(i, s, 2)
+        self.assertEqual("wal", i.query("PRAGMA journal_mode", fetchone=True)[0])
+
+        found = []
+        def target():
+            # the writer is in a transaction, but readers can still read
+            found.append(i.count(s))
+            with i.connection(readonly=True) as connection:
+                found.append(connection)
+
+        with i.transaction() as connection:
+            i.insert(s, {"foo": 3, "bar": "3"})
+            # reads in a transaction use the writer
+            self.assertEqual(3, i.count(s))
+            with i.connection(readonly=True) as c:
+                self.assertTrue(c is connection)
+
+            t = threading.Thread(target=target)
+            t.start()
+            t.join()
+
+        self.assertEqual(2, found[0])
+        self.assertFalse(found[1] is connection)
+        self.assertEqual(3, i.count(s))
+
+    def test_memory(self):
+        config = DsnConnection("prom.interface.sqlite.SQLite://:memory:?readers=1")
+        i = config.interface
+        self.connections.add(i)
+        s = self.get_schema()
+        pks = self.insert(i, s, 2)
+
+        found = []
+        def target():
+            found.append(i.count(s))
+
+        t = threading.Thread(target=target)
+        t.start()
+        t.join()
+        self.assertEqual([2], found)
+
+
 # not sure I'm a huge fan of this solution to remove common parent from testing queue
 # http://stackoverflow.com/questions/1323455/python-unit-test-with-base-and-sub-class
 del(BaseTestInterface)
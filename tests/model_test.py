@@ -590,6 +590,47 @@ class OrmTest(EnvironTestCase):
         self.assertEqual(1000, t.foo)
         self.assertEqual("value1000", t.bar)
 
+    def test_batch(self):
+        orm_class = self.get_orm_class()
+        t1 = orm_class.create(foo=1, bar="value1")
+
+        with orm_class.interface.batch():
+            t2 = orm_class.create(foo=2, bar="value2")
+            t1.foo = 3
+            t1.save()
+            self.assertIsNone(t2.pk)
+
+        self.assertLess(t1.pk, t2.pk)
+        self.assertEqual(2, orm_class.query.get_pk(t2.pk).foo)
+        self.assertEqual(3, orm_class.query.get_pk(t1.pk).foo)
+        self.assertFalse(t2.is_modified())
+
+        # a batched update isn't saved until the batch is flushed
+        with orm_class.interface.batch():
+            t1.foo = 4
+            t1.save()
+            self.assertTrue(t1.is_modified())
+        self.assertFalse(t1.is_modified())
+        self.assertEqual(4, orm_class.query.get_pk(t1.pk).foo)
+
+        with self.assertRaises(ValueError):
+            with orm_class.interface.batch():
+                t1.foo = 5
+                t1.save()
+                raise ValueError()
+        self.assertTrue(t1.is_modified())
+        self.assertEqual(4, orm_class.query.get_pk(t1.pk).foo)
+
+        pk = t2.pk
+        with orm_class.interface.batch():
+            t3 = orm_class.create(foo=6, bar="value6")
+            orm_class.query.is_foo(6).delete()
+            t2.delete()
+            self.assertEqual(pk, t2.pk)
+        self.assertIsNone(t2.pk)
+        self.assertIsNone(orm_class.query.get_pk(pk))
+        self.assertIsNone(orm_class.query.get_pk(t3.pk))
+
     def test_fields(self):
         orm_class = self.get_orm_class()
         t = orm_class.create(foo=1000, bar="value1000")
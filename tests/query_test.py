@@ -4,6 +4,7 @@ import datetime
 import time
 from threading import Thread
 import sys
+import os
 
 import testdata
 #from testdata.threading import Thread
@@ -15,6 +16,7 @@ from prom.query import Query, \
     CacheQuery, \
     Iterator, \
     AllIterator
+from prom.cache import SQLiteCacheBackend
 from prom.compat import *
 import prom
 
@@ -257,6 +259,22 @@ class QueryTest(EnvironTestCase):
         for v in vals:
             self.assertTrue(v >= 2 and v <= 4)
 
+    def test_timeout_settings(self):
+        _q = self.get_query()
+        pks = self.insert(_q, 2)
+
+        q = _q.copy().timeout(5000).settings(work_mem="8MB")
+        self.assertEqual(
+            {"timeout": 5000, "settings": {"work_mem": "8MB"}},
+            q.query_options()
+        )
+        self.assertEqual(2, q.count())
+        self.assertEqual(2, len(q.get()))
+
+        q = _q.copy().timeout(5000).is_pk(pks[0])
+        q.set_fields({"foo": 10})
+        self.assertEqual(1, q.update())
+
     def test_dualset(self):
         q = self.get_query()
         q.is_foo(1)
@@ -523,6 +541,29 @@ class QueryTest(EnvironTestCase):
         for set_tuple in q.fields_set:
             self.assertEqual(set_tuple[0], "_id")
 
+    def test_fingerprint(self):
+        orm_class = self.get_orm_class()
+        q1 = orm_class.query.is_foo(1).in_bar(["a", "b"]).desc_pk().limit(10)
+        q2 = orm_class.query.is_foo(1).in_bar(["a", "b"]).desc_pk().limit(10)
+        self.assertEqual(q1.fingerprint(), q2.fingerprint())
+        self.assertEqual(hash(q1.fingerprint()), hash(q2.fingerprint()))
+
+        q3 = orm_class.query.is_foo(2).in_bar(["a", "b", "c"]).desc_pk().limit(10)
+        self.assertNotEqual(q1.fingerprint(), q3.fingerprint())
+        self.assertEqual(q1.shape(), q3.shape())
+
+        q4 = orm_class.query.is_foo(None).in_bar(["a"]).desc_pk().limit(10)
+        self.assertNotEqual(q1.shape(), q4.shape())
+
+        q5 = orm_class.query.select_foo().is_foo(1)
+        q6 = orm_class.query.unique_foo().is_foo(1)
+        self.assertNotEqual(q5.fingerprint(), q6.fingerprint())
+
+        q7 = q1.copy()
+        self.assertEqual(q1.fingerprint(), q7.fingerprint())
+        q7.is_pk(1)
+        self.assertNotEqual(q1.fingerprint(), q7.fingerprint())
+
     def test_get_pks(self):
         tclass = self.get_orm_class()
         t = tclass()
@@ -541,6 +582,55 @@ class QueryTest(EnvironTestCase):
         self.assertEqual(2, len(res))
         self.assertEqual(list(res.pk), pks)
 
+    def test_get_pk_identity_map(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 3)
+
+        with prom.identity_map() as im:
+            o = orm_class.query.get_pk(pks[0])
+            self.assertEqual(1, len(im))
+
+            # change the held row so we know the db wasn't touched
+            row, hit = im.get(orm_class.schema, pks[0])
+            row["foo"] = -1
+            im.set(orm_class.schema, pks[0], row)
+            self.assertEqual(-1, orm_class.query.get_pk(pks[0]).foo)
+
+            # only the missing rows should come from the db
+            res = orm_class.query.get_pks(pks)
+            self.assertEqual(pks, list(res.pk))
+            self.assertEqual(-1, res[0].foo)
+            self.assertEqual(3, len(im))
+
+            # a query that filters on more than the pk can't use the map
+            o = orm_class.query.is_foo(-1).get_pk(pks[0])
+            self.assertIsNone(o)
+
+    def test_identity_map_invalidate(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 3)
+
+        with prom.identity_map() as im:
+            res = orm_class.query.get_pks(pks)
+            self.assertEqual(3, len(im))
+
+            o = res[0]
+            o.foo = 1000
+            o.save()
+            self.assertEqual(2, len(im))
+            self.assertEqual(1000, orm_class.query.get_pk(o.pk).foo)
+
+            orm_class.query.set_foo(2000).is_pk(pks[1]).update()
+            self.assertEqual(2000, orm_class.query.get_pk(pks[1]).foo)
+
+            res[2].delete()
+            self.assertIsNone(orm_class.query.get_pk(pks[2]))
+
+            # a where clause that isn't just the pk invalidates the whole table
+            orm_class.query.set_foo(3000).gte_foo(0).update()
+            self.assertEqual(0, len(im.get_many(orm_class.schema, pks)))
+            self.assertEqual(3000, orm_class.query.get_pk(pks[0]).foo)
+
     def test_value_query(self):
         _q = self.get_query()
 
@@ -1277,4 +1367,192 @@ class CacheQueryTest(QueryTest):
         #pout.v(orm_class.query.cache_namespace)
         #pout.v(orm_class.query.cache_namespace)
 
+    def test_cache_shared(self):
+        """results cached in one thread can be hit by another thread"""
+        orm_class = self.get_orm_class()
+        orm_class.query_class.cache_activate(False)
+        self.insert(orm_class, 5)
+
+        with orm_class.query.cache():
+            q = orm_class.query
+            pks = list(q.pks())
+            self.assertFalse(q.cache_hit)
+
+        hits = []
+        def target():
+            with orm_class.query.cache():
+                q = orm_class.query
+                self.assertEqual(pks, list(q.pks()))
+                hits.append(q.cache_hit)
+
+        t = Thread(target=target)
+        t.start()
+        t.join()
+        self.assertEqual([True], hits)
+
+    def test_cache_invalidate(self):
+        orm_class = self.get_orm_class()
+        self.insert(orm_class, 5)
+
+        q = orm_class.query
+        self.assertEqual(5, q.count())
+        q = orm_class.query
+        self.assertEqual(5, q.count())
+        self.assertTrue(q.cache_hit)
+
+        self.insert(orm_class, 1)
+        q = orm_class.query
+        self.assertEqual(6, q.count())
+        self.assertFalse(q.cache_hit)
+
+    def test_cache_backend(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 2)
+
+        path = os.path.join(testdata.create_dir(), "cache.db")
+        cn = orm_class.query.cache_namespace
+        cn.backend = SQLiteCacheBackend(path)
+        try:
+            o1 = orm_class.query.is_pk(pks[0]).get_one()
+
+            # clear the process cache so the value has to come from the backend
+            cn.reset()
+            q = orm_class.query
+            o2 = q.is_pk(pks[0]).get_one()
+            self.assertTrue(q.cache_hit)
+            self.assertEqual(o1.fields, o2.fields)
+
+            o2.foo = 1000
+            o2.save()
+            cn.reset()
+            q = orm_class.query
+            o3 = q.is_pk(pks[0]).get_one()
+            self.assertFalse(q.cache_hit)
+            self.assertEqual(1000, o3.foo)
+
+        finally:
+            cn.backend = None
+
+    def test_cache_has_more(self):
+        """make sure a cache hit doesn't lose rows to get()'s pagination"""
+        orm_class = self.get_orm_class()
+        self.insert(orm_class, 5)
+
+        r1 = orm_class.query.get(2)
+        q = orm_class.query
+        r2 = q.get(2)
+        self.assertTrue(q.cache_hit)
+        self.assertEqual(list(r1.pk), list(r2.pk))
+        self.assertTrue(r2.has_more)
+
+    def test_cache_batch(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 2)
+
+        with orm_class.interface.batch():
+            orm_class.create(foo=3, bar="value3")
+            # the insert hasn't happened yet, so this gets cached
+            self.assertEqual(2, orm_class.query.count())
+
+        # the flush invalidated the cached count
+        self.assertEqual(3, orm_class.query.count())
+
+    def test_cache_stats(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 2)
+
+        orm_class.query.is_pk(pks[0]).get_one()
+        orm_class.query.is_pk(pks[0]).get_one()
+        orm_class.query.is_pk(pks[1]).get_one()
+        orm_class.query.set_foo(1).is_pk(pks[1]).update()
+
+        stats = orm_class.query.cache_stats()
+        counters = stats["tables"][orm_class.table_name]
+        self.assertEqual(1, counters["hits"])
+        self.assertEqual(2, counters["misses"])
+        self.assertEqual(3, counters["invalidations"]) # 2 inserts and 1 update
+        self.assertLess(0, counters["bytes"])
+
+        counters = stats["shapes"][orm_class.query.is_pk(pks[0]).shape()]
+        self.assertEqual(1, counters["hits"])
+        self.assertEqual(2, counters["misses"])
+
+    def test_cache_jitter(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 1)
+        cn = orm_class.query.cache_namespace
+
+        with orm_class.query.cache(ttl=100, jitter=0.5):
+            q = orm_class.query.is_pk(pks[0])
+            q.get_one()
+            val, hit = cn.get(q.schema, q.cache_key("get_one"))
+            self.assertTrue(hit)
+            self.assertTrue(50 <= val["ttl"] <= 150)
+
+    def test_cache_stale(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 1)
+
+        with orm_class.query.cache(ttl=0.1, stale_ttl=60):
+            orm_class.query.is_pk(pks[0]).get_one()
+            time.sleep(0.2)
+
+            q = orm_class.query
+            o = q.is_pk(pks[0]).get_one()
+            self.assertTrue(q.cache_hit)
+            self.assertTrue(q.cache_stale)
+            self.assertEqual(pks[0], o.pk)
+            self.assertIsNotNone(q.cache_refresh_thread)
+            q.cache_refresh_thread.join()
+
+        with orm_class.query.cache(ttl=0.1):
+            # a thread that doesn't want stale values goes to the db
+            time.sleep(0.2)
+            q = orm_class.query
+            o = q.is_pk(pks[0]).get_one()
+            self.assertFalse(q.cache_hit)
+
+
+class CacheQueryRefreshTest(BaseTestCase):
+    """the stale values are refreshed in another thread, so these tests need an
+    interface that can be used by multiple threads"""
+    def get_orm_class(self, *args, **kwargs):
+        orm_class = super(CacheQueryRefreshTest, self).get_orm_class(*args, **kwargs)
+        orm_class.query_class = CacheQuery
+        return orm_class
+
+    def test_refresh(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 1)
+
+        with orm_class.query.cache(ttl=0.1, stale_ttl=60):
+            orm_class.query.is_pk(pks[0]).get_one()
+            time.sleep(0.2)
+
+            q = orm_class.query
+            q.is_pk(pks[0]).get_one()
+            self.assertTrue(q.cache_stale)
+            q.cache_refresh_thread.join()
+
+            q = orm_class.query
+            q.is_pk(pks[0]).get_one()
+            self.assertTrue(q.cache_hit)
+            self.assertFalse(q.cache_stale)
+
+    def test_single_flight(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 1)
+        hits = []
+
+        def target():
+            with orm_class.query.cache():
+                q = orm_class.query
+                o = q.is_pk(pks[0]).get_one()
+                hits.append(q.cache_hit)
+
+        ts = [Thread(target=target) for _ in range(5)]
+        for t in ts: t.start()
+        for t in ts: t.join()
 
+        self.assertEqual(5, len(hits))
+        self.assertTrue(any(hits))
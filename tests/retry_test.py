@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import time
+
+from . import TestCase, BaseTestCase
+from prom.retry import RetryPolicy, CircuitBreaker, CircuitOpenError
+from prom.exception import InterfaceError
+from prom.compat import *
+
+
+class CircuitBreakerTest(TestCase):
+    def test_states(self):
+        b = CircuitBreaker(threshold=2, timeout=0.1)
+        self.assertFalse(b.failure())
+        self.assertTrue(b.allow())
+        self.assertTrue(b.failure())
+        self.assertEqual(b.OPEN, b.state)
+        self.assertFalse(b.allow())
+
+        time.sleep(0.1)
+        self.assertEqual(b.HALF_OPEN, b.state)
+        self.assertTrue(b.allow())
+        # one failure while half open opens it again
+        self.assertTrue(b.failure())
+        self.assertFalse(b.allow())
+
+        time.sleep(0.1)
+        b.success()
+        self.assertEqual(b.CLOSED, b.state)
+        self.assertFalse(b.failure())
+
+    def test_threshold_zero(self):
+        b = CircuitBreaker(threshold=0)
+        for x in range(10):
+            self.assertFalse(b.failure())
+        self.assertTrue(b.allow())
+
+
+class RetryPolicyTest(BaseTestCase):
+    def get_policy(self, **kwargs):
+        kwargs.setdefault("backoff", 0.01)
+        policy = RetryPolicy(**kwargs)
+        policy.sleeps = []
+        policy.sleep = lambda seconds: policy.sleeps.append(seconds)
+        return policy
+
+    def get_callback(self, *errors):
+        calls = []
+        errors = list(errors)
+        def callback(*args, **kwargs):
+            calls.append((args, kwargs))
+            if errors:
+                raise InterfaceError(errors.pop(0))
+            return len(calls)
+        return callback, calls
+
+    def test_backoff(self):
+        policy = self.get_policy(backoff=1.0, max_backoff=5.0, jitter=False)
+        self.assertEqual(0.0, policy.get_backoff(1))
+        self.assertEqual(1.0, policy.get_backoff(2))
+        self.assertEqual(2.0, policy.get_backoff(3))
+        self.assertEqual(4.0, policy.get_backoff(4))
+        self.assertEqual(5.0, policy.get_backoff(5))
+
+        policy = self.get_policy(backoff=1.0, jitter=True)
+        for x in range(10):
+            self.assertTrue(0.0 <= policy.get_backoff(3) <= 2.0)
+
+    def test_call(self):
+        i = self.get_interface()
+        policy = self.get_policy(attempts=3)
+
+        callback, calls = self.get_callback(ValueError("connection already closed"))
+        r = policy.call(i, callback, args=[1], kwargs={"foo": 2})
+        self.assertEqual(2, r)
+        self.assertEqual(((1,), {"foo": 2}), calls[0])
+        self.assertEqual(1, len(policy.sleeps))
+
+        # errors that aren't connection errors are never retried
+        callback, calls = self.get_callback(ValueError("syntax error"))
+        with self.assertRaises(InterfaceError):
+            policy.call(i, callback)
+        self.assertEqual(1, len(calls))
+
+        callback, calls = self.get_callback(*([ValueError("closed")] * 3))
+        with self.assertRaises(InterfaceError):
+            policy.call(i, callback)
+        self.assertEqual(3, len(calls))
+
+        stats = policy.stats()
+        self.assertEqual(3, stats["calls"])
+        self.assertEqual(3, stats["retries"])
+        self.assertEqual(1, stats["failures"])
+        self.assertEqual("closed", stats["state"])
+
+    def test_call_transaction(self):
+        i = self.get_interface()
+        policy = self.get_policy(attempts=3)
+        with i.transaction() as connection:
+            callback, calls = self.get_callback(ValueError("closed"))
+            with self.assertRaises(InterfaceError):
+                policy.call(i, callback, kwargs={"connection": connection})
+            self.assertEqual(1, len(calls))
+
+    def test_deadline(self):
+        i = self.get_interface()
+        policy = self.get_policy(attempts=10, backoff=1.0, jitter=False, deadline=2.5)
+        callback, calls = self.get_callback(*([ValueError("closed")] * 10))
+        with self.assertRaises(InterfaceError):
+            policy.call(i, callback)
+        # the fake sleep doesn't take any time so the 4 second wait of the 3rd
+        # retry is the first wait that goes past the deadline
+        self.assertEqual([1.0, 2.0], policy.sleeps)
+        self.assertEqual(3, len(calls))
+
+    def test_breaker(self):
+        i = self.get_interface()
+        policy = self.get_policy(attempts=2, breaker=CircuitBreaker(threshold=2, timeout=60))
+        callback, calls = self.get_callback(*([ValueError("closed")] * 2))
+        with self.assertRaises(InterfaceError):
+            policy.call(i, callback)
+
+        callback, calls = self.get_callback()
+        with self.assertRaises(CircuitOpenError):
+            policy.call(i, callback)
+        self.assertEqual(0, len(calls))
+
+        stats = policy.stats()
+        self.assertEqual(1, stats["opened"])
+        self.assertEqual(1, stats["rejected"])
+        self.assertEqual("open", stats["state"])
+
+    def test_interface(self):
+        i = self.get_interface()
+        i.connection_config.options["reconnect_attempts"] = 5
+        i.connection_config.options["breaker_threshold"] = 10
+        policy = i.retry_policy
+        self.assertEqual(5, policy.attempts)
+        self.assertEqual(10, policy.breaker.threshold)
+
+        s = self.get_schema()
+        i.set_table(s)
+        calls = policy.stats()["calls"]
+        i.count(s)
+        self.assertEqual(calls + 1, policy.stats()["calls"])
+
+        self.assertTrue(i.is_retryable_error(InterfaceError(ValueError("connection already closed"))))
+        self.assertFalse(i.is_retryable_error(InterfaceError(ValueError("syntax error"))))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+
+from . import BaseTestCase
+from prom.compat import *
+from prom.session import Session, get_session
+import prom
+
+
+class SessionTest(BaseTestCase):
+    def test_flush(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 3)
+
+        with prom.session() as s:
+            self.assertEqual(s, get_session())
+            o1 = orm_class.query.get_pk(pks[0])
+            o2 = orm_class.query.get_pk(pks[1])
+            o3 = orm_class.query.get_pk(pks[2])
+            o1.foo = 1000
+            o2.foo = o2.foo # not a real change
+            o4 = orm_class(foo=2000, bar="v2000")
+            o5 = orm_class(foo=3000, bar="v3000")
+
+            self.assertEqual([o1, o4, o5], s.dirty())
+            self.assertIsNone(o4.pk)
+
+        self.assertIsNone(get_session())
+        self.assertLess(pks[2], o4.pk)
+        self.assertLess(o4.pk, o5.pk)
+        self.assertEqual(1000, orm_class.query.get_pk(pks[0]).foo)
+        self.assertEqual(2000, orm_class.query.get_pk(o4.pk).foo)
+        self.assertEqual(5, orm_class.query.count())
+
+        # nothing changed since the flush so nothing is dirty
+        with prom.session() as s:
+            o1 = orm_class.query.get_pk(pks[0])
+            o1.foo = 1001
+            s.flush()
+            self.assertEqual([], s.dirty())
+            o1.foo = 1002
+            self.assertEqual([o1], s.dirty())
+        self.assertEqual(1002, orm_class.query.get_pk(pks[0]).foo)
+
+    def test_error(self):
+        orm_class = self.get_orm_class()
+        pk = self.insert(orm_class, 1)[0]
+
+        with self.assertRaises(ValueError):
+            with prom.session():
+                o = orm_class.query.get_pk(pk)
+                o.foo = 1000
+                orm_class(foo=2000, bar="v2000")
+                raise ValueError()
+
+        self.assertNotEqual(1000, orm_class.query.get_pk(pk).foo)
+        self.assertEqual(1, orm_class.query.count())
+
+    def test_identity(self):
+        orm_class = self.get_orm_class()
+        pks = self.insert(orm_class, 2)
+
+        with prom.session() as s:
+            o1 = orm_class.query.get_pk(pks[0])
+            o1.foo = 1000
+            self.assertTrue(o1 is orm_class.query.get_pk(pks[0]))
+
+            # rows that come back from a query are the held instances
+            os = {o.pk: o for o in orm_class.query.all()}
+            self.assertTrue(o1 is os[pks[0]])
+            self.assertEqual(1000, os[pks[0]].foo)
+            self.assertTrue(os[pks[1]] is orm_class.query.get_pk(pks[1]))
+
+            o1.delete()
+            self.assertFalse(o1 in s)
+            self.assertEqual([], s.dirty())
+
+        self.assertEqual(1, orm_class.query.count())
+
+    def test_groups(self):
+        orm_class = self.get_orm_class()
+        orm_class2 = self.get_orm_class()
+        orm_class2.interface = orm_class.interface
+        s = Session()
+        orms = [
+            orm_class(foo=1, bar="v1"),
+            orm_class({"_id": 10, "foo": 2, "bar": "v2"}, hydrate=True),
+            orm_class2(foo=3, bar="v3"),
+            orm_class(foo=4, bar="v4"),
+        ]
+        for o in orms:
+            s.add(o, written=o.pk is not None)
+        orms[1].foo = 5
+
+        # writes with the same table and fields end up next to each other
+        groups = s.get_groups(s.dirty())
+        self.assertEqual(1, len(groups))
+        self.assertEqual([orms[0], orms[3], orms[1], orms[2]], groups[0][1])
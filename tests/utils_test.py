@@ -4,7 +4,7 @@ from __future__ import unicode_literals, division, print_function, absolute_impo
 import testdata
 
 from . import BaseTestCase, TestCase
-from prom.utils import get_objects
+from prom.utils import get_objects, make_hashable
 
 
 class GetObjectsTest(TestCase):
@@ -52,3 +52,26 @@ class GetObjectsTest(TestCase):
         self.assertEqual("relimp", module.__name__)
         self.assertEqual("Relimp", klass.__name__)
 
+
+class MakeHashableTest(TestCase):
+    def test_containers(self):
+        self.assertEqual((1, 2), make_hashable([1, 2]))
+        self.assertEqual(
+            make_hashable({"foo": [1, 2], "bar": {3}}),
+            make_hashable({"bar": set([3]), "foo": (1, 2)})
+        )
+        hash(make_hashable({"foo": [{"bar": 1}]}))
+
+        # values that can't be compared are still sorted, never left in set order
+        self.assertEqual((1, "foo"), make_hashable(set(["foo", 1])))
+        self.assertEqual(
+            (1, "foo", (2, "bar")),
+            make_hashable(frozenset(["foo", 1, (2, "bar")]))
+        )
+
+    def test_unhashable(self):
+        class Foo(object):
+            __hash__ = None
+            def __repr__(self): return "foo"
+
+        self.assertEqual(("Foo", "foo"), make_hashable(Foo()))